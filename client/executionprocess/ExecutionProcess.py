@@ -26,7 +26,7 @@
 """
 Execution Process (EP) should be started as a service, on system startup.
 Each EP has a unique name for its user, called Ep Name.
-EP gets his status from CE every few seconds. The status can be changed using the Java interface.
+EP gets his status from CE, which pushes every change. The status can be changed using the Java interface.
 When it receives START from CE, it will start the Runner that will execute all test files from suite,
   send all Runner logs to CE and after the execution, it will wait for another START to repeat the cycle.
 EP is basically a simple service, designed to start and stop the Runner.
@@ -43,6 +43,8 @@ import socket
 import signal
 import shutil
 import binascii
+import zlib
+import hashlib
 import platform
 import inspect
 import traceback
@@ -51,7 +53,10 @@ import argparse
 
 from pprint import pprint
 from string import Template
-from threading import Thread
+from threading import Thread, Condition, current_thread
+from collections import deque
+from Queue import Queue, Empty, Full
+import thread
 from thread import allocate_lock
 
 import rpyc
@@ -78,14 +83,33 @@ sys.path.append(TWISTER_PATH)
 
 PORTABLE = False
 EP_CACHE, EP_LOG = None, None
+LIB_STORE = None # The library store is shared by the EP and its worker processes
 PROXY_LOCK = allocate_lock() # Lock the connection access
 RUNNER = None
 LOGGER = None
 DEBUG = False
 CE_PROXY = None # Used to keep the current Central Engine connection
 BG_SERVER = None # Background serving server
+PARENT_PROXY = None # In a worker process, the connection of the parent process; never used
+EP_WORKER = False # A worker process never registers the EP; the parent process owns it
 USER_NAME = None # Used to check the Central Engine connection
 EP_NAME = None # Used by the logger when sending the Live Log
+EVENT_TIMEOUT = 30.0 # Re-check the status, if the CE didn't push anything
+PREFETCH_WINDOW = 8 # Test files downloaded ahead of the running test
+PREFETCH_MEMORY = 64 * 1024 * 1024 # Max size of the test files downloaded ahead
+PREFETCH_THREADS = 2 # Parallel downloads
+DOWNLOAD_CHUNK = 4 * 1024 * 1024 # Files are downloaded from the CE in chunks of this size
+LOG_BATCH_SIZE = 64 * 1024 # The live log is sent to CE when it's this large...
+LOG_BATCH_DELAY = 1.0 # ... or this old
+LOG_QUEUE_SIZE = 4096 # Max prints waiting for the logger thread
+LOG_CLOSE_TIMEOUT = 10.0 # Max time to wait for the last logs, on exit
+PARALLEL_PROP = 'independent' # Suite property; the suite can run in parallel with the others
+
+# Known File and Suite properties, not sent to the tests as PROPERTIES
+FILE_PROPS = frozenset(['type', 'ep', 'sut', 'name', 'pd', 'libraries',
+    'children', 'clearcase', 'twister_tc_revision', 'status', 'file',
+    'suite', '_depend', '_dep_id', 'Runnable', 'setup_file',
+    'teardown_file', 'Optional', '_cfg_files', 'param'])
 
 TMPL_LIB = """
 PROXY_ADDR = "$proxy"
@@ -125,9 +149,94 @@ REVERSED_STATUS = dict((v, k) for k, v in TEST_STATUS.iteritems())
 
 # ------------------------------------------------------------------------------
 
+class EpEvents(object):
+
+    """
+    Events pushed by the Central Engine: the status of this EP
+    and the dependencies that finished running.
+    The Runner waits for these, instead of polling the Central Engine.
+    """
+
+    def __init__(self):
+        self.cond = Condition()
+        self.status = None  # Last known EP status
+        self.counter = 0    # Incremented on every pushed status
+        self.deps = {}      # Finished dependencies: dep ID -> status
+
+
+    def set_status(self, status, counter=None):
+        """
+        Save the EP status and wake up the Runner.
+        If the counter is given and another status was pushed in the
+        meantime, the older status is ignored.
+        """
+        with self.cond:
+            if counter is not None:
+                if counter != self.counter:
+                    return False
+            else:
+                self.counter += 1
+            self.status = status
+            self.cond.notify_all()
+        return True
+
+
+    def wait_status(self, current, timeout=EVENT_TIMEOUT):
+        """
+        Wait until the EP status is different from `current`.
+        If nothing is pushed, the status is requested from the CE,
+        in case an event was lost. Returns None if the CE is down.
+        """
+        with self.cond:
+            if self.status == current:
+                self.cond.wait(timeout)
+            status = self.status
+        if status != current:
+            return status
+        return self.refresh()
+
+
+    def refresh(self):
+        """
+        Ask the Central Engine for the EP status.
+        Returns None if the CE is down.
+        """
+        counter = self.counter
+        try:
+            status = proxy().get_ep_status(EP_NAME)
+        except Exception:
+            return None
+        self.set_status(status, counter)
+        return status
+
+
+    def dependency_done(self, dep_id, status):
+        """
+        Save the status of a finished dependency and wake up the Runner.
+        """
+        with self.cond:
+            self.deps[dep_id] = status
+            self.cond.notify_all()
+
+
+    def wait_dependency(self, dep_id, timeout=EVENT_TIMEOUT):
+        """
+        Wait until a dependency finishes; returns the status, or None,
+        if nothing was pushed before the timeout.
+        """
+        with self.cond:
+            if dep_id not in self.deps:
+                self.cond.wait(timeout)
+            return self.deps.pop(dep_id, None)
+
+
+EP_EVENTS = EpEvents()
+
+#
+
 class EpService(rpyc.Service):
     """
-    Dummy service.
+    Service exposed to the Central Engine.
     """
     def exposed_hello(self, param=None):
         """
@@ -137,14 +246,30 @@ class EpService(rpyc.Service):
 
     def exposed_start_ep(self, *arg, **kw):
         """
-        Fake function.
+        Called when the EP is portable and the project starts.
         """
+        EP_EVENTS.set_status('running')
         return True
 
     def exposed_stop_ep(self, *arg, **kw):
         """
-        Fake function.
+        Called when the EP is portable and the project stops.
         """
+        EP_EVENTS.set_status('stopped')
+        return True
+
+    def exposed_set_ep_status(self, status):
+        """
+        Pushed by the Central Engine when the EP status changes.
+        """
+        EP_EVENTS.set_status(status)
+        return True
+
+    def exposed_dependency_done(self, dep_id, status):
+        """
+        Pushed by the Central Engine when a dependency finished running.
+        """
+        EP_EVENTS.dependency_done(dep_id, status)
         return True
 
     def exposed_echo(self, text):
@@ -208,7 +333,7 @@ def proxy():
         try:
             # Transform XML-RPC port into RPyc Port; RPyc port = XML-RPC port + 10 !
             p = rpyc.connect(ce_ip, int(ce_port) + 10, service=EpService, config=config)
-            p.root.hello('ep::{}'.format(EP_NAME))
+            p.root.hello('ep::{}'.format(EP_NAME), {'ep_events': True})
         except Exception:
             print('*ERROR* Cannot connect to CE path `{}`! Exiting!'.format(CE_PATH))
             CE_PROXY = None
@@ -233,11 +358,12 @@ def proxy():
             CE_PROXY = None
             return None
 
-        if PORTABLE:
+        # Registering the EP again would reset it and move it to the worker connection
+        if PORTABLE and not EP_WORKER:
             print('EP Debug: Must register the EP...')
             try:
                 # Register this EP to the Central Engine
-                p.root.hello('client', {'eps': [EP_NAME]})
+                p.root.hello('client', {'eps': [EP_NAME], 'ep_events': True})
                 print('EP Debug: Register EP successful!\n')
                 return CE_PROXY.root
             except Exception:
@@ -248,48 +374,129 @@ def proxy():
 
 #
 
-class Logger(object):
+class LiveLog(object):
+
+    """
+    Sends the live log to the Central Engine, in zlib compressed batches.
+    A batch is sent when it's large enough, or old enough.
+    """
+
+    def __init__(self):
+        self.buffer = []   # The text buffer
+        self.size = 0      # Size of the text buffer
+        self.timer = time.time() # Last time the log was sent to CE
+        self.compress = True # False if the Central Engine accepts only base64
+
+
+    def add(self, text, force=False):
+        """
+        Add some text in the batch, then send the batch, if the time is right,
+        or if the batch is large enough.
+        """
+        if text:
+            self.buffer.append(text)
+            self.size += len(text)
+        if not self.size:
+            return
+        if not force and self.size < LOG_BATCH_SIZE and time.time() - self.timer < LOG_BATCH_DELAY:
+            return
+
+        data = ''.join(self.buffer)
+        self.buffer = []
+        self.size = 0
+        self.timer = time.time()
+        if CE_PROXY is None:
+            return
+
+        try:
+            if self.compress:
+                try:
+                    proxy().log_live(EP_NAME, zlib.compress(data), True)
+                    return
+                except TypeError:
+                    # Older Central Engine
+                    self.compress = False
+            proxy().log_live(EP_NAME, binascii.b2a_base64(data))
+        except Exception as exp_err:
+            sys.__stdout__.write('Cannot send the live log: `{}`!\n'.format(exp_err))
+
+#
+
+class Logger(Thread):
+
+    """
+    Portable logger: all the prints are written in the log file and sent to CE
+    by a single writer thread, so the tests don't wait for their own logs.
+    """
 
     def __init__(self):
+        Thread.__init__(self)
+        self.setDaemon(True)
         self.closed = False
-        self.buffer = ''  # The text buffer
-        self.timer = 0    # Last time the log was sent to CE
+        self.queue = Queue(LOG_QUEUE_SIZE) # Texts waiting for the writer thread
+        self.logfile = None # The log file, open in the writer thread
+        self.dropped = 0 # Texts not logged, because the queue was full
+        self.live = LiveLog()
         sys.__stdout__.write('EP Debug: Creating a portable logger...')
         sys.__stdout__.flush()
         sys.stdout = self
 
 
-    def write(self, text):
+    def run(self):
         """
-        Write in the OUT stream, in the log file and send to CE.
+        Write the queued texts in the log file, with the same handle,
+        and send them to the Central Engine.
         """
-        # Write in the OUTPUT stream
-        sys.__stdout__.write(text)
-        sys.__stdout__.flush()
-        # Write in the file
+        stop = False
         with open(EP_LOG, 'a') as logfile:
-            logfile.write(text)
-        # Send the message to the Central Engine
-        if  CE_PROXY is not None:
-            self.logLive(text)
+            self.logfile = logfile
+            while not stop:
+                texts = []
+                try:
+                    texts.append(self.queue.get(timeout=LOG_BATCH_DELAY))
+                    # Everything that is waiting is written at once
+                    while True:
+                        texts.append(self.queue.get_nowait())
+                except Empty:
+                    pass
+                if None in texts:
+                    texts = texts[:texts.index(None)]
+                    stop = True
+                if self.dropped:
+                    texts.append('EP Warn: The logger was too slow, `{}` prints were dropped!\n'.format(self.dropped))
+                    self.dropped = 0
+                data = ''.join(texts)
+                if data:
+                    logfile.write(data)
+                    logfile.flush()
+                self.live.add(data, force=stop)
+            self.logfile = None
 
-    def logLive(self, text):
+
+    def write(self, text):
         """
-        If the time is right and the buffer is large enough,
-        send the text to the Central Engine.
+        Write in the OUT stream, then queue the text for the log file and for CE.
         """
-        if  CE_PROXY is None:
+        # Write in the OUTPUT stream
+        sys.__stdout__.write(text)
+        sys.__stdout__.flush()
+        if self.closed:
             return
-        ctimer = time.time()
-        self.buffer += text
+        # The writer thread prints too (eg: while connecting to CE); it must not wait for its own queue
+        if current_thread() is self:
+            if self.logfile:
+                self.logfile.write(text)
+            return
+        try:
+            self.queue.put_nowait(text)
+        except Full:
+            self.dropped += 1
+
+
+    def flush(self):
+        """ the texts are written by the writer thread """
+        pass
 
-        if ((ctimer - self.timer) > 1.5) and len(self.buffer):
-            proxy().log_live(EP_NAME, binascii.b2a_base64(self.buffer))
-            self.timer = ctimer
-            self.buffer = ''
-        elif len(self.buffer) > 256:
-            proxy().log_live(EP_NAME, binascii.b2a_base64(self.buffer))
-            self.buffer = ''
 
     def close(self, *args, **kw):
         """
@@ -297,11 +504,12 @@ class Logger(object):
         """
         # Restore the normal stdout
         sys.stdout = sys.__stdout__
-        # Send last chunk
-        if self.buffer:
-            proxy().log_live(EP_NAME, binascii.b2a_base64(self.buffer))
-            self.buffer = ''
+        if self.closed:
+            return
         self.closed = True
+        # Send last chunk
+        self.queue.put(None)
+        self.join(LOG_CLOSE_TIMEOUT)
 
 #
 
@@ -313,9 +521,9 @@ class ThreadedLogger(Thread):
         """
         Thread.__init__(self)
         self.setDaemon(True)
-        self.buffer = ''   # The text buffer
+        self.log_file = None # The log file, open for all the reads
         self.read_len = 0  # Read file position
-        self.timer = 0    # Last time the log was sent to CE
+        self.live = LiveLog()
         self.closed = False
         self.acc_lock = allocate_lock()
         print('EP Debug: Creating a threaded logger...')
@@ -327,52 +535,36 @@ class ThreadedLogger(Thread):
         """
         # Wait a little, before enter the cycle
         time.sleep(1)
-        while not self.closed:
+        while True:
             with self.acc_lock:
-                data = self.tail()
-                self.logLive(data)
+                if self.closed:
+                    break
+                self.live.add(self.tail())
             # Wait and retry...
-            time.sleep(1)
-        # The end
-        with self.acc_lock:
-            data = self.tail()
-            self.logLive(data, force=True)
+            time.sleep(LOG_BATCH_DELAY / 2)
 
     def tail(self):
         """
         Tail on a file.
         """
-        vString = ''
-        with open(EP_LOG, 'r') as f:
-            # Go at "current position"
-            f.seek(self.read_len, 0)
-            vString = f.read()
-            vLen = len(vString)
+        if self.log_file is None:
+            try:
+                self.log_file = open(EP_LOG, 'r')
+            except Exception:
+                return ''
+        # The log was reset
+        if os.fstat(self.log_file.fileno()).st_size < self.read_len:
+            self.read_len = 0
+        # Go at "current position"
+        self.log_file.seek(self.read_len, 0)
+        vString = self.log_file.read()
+        # Increment "current position"
+        self.read_len += len(vString)
         # Fix double new-line
         vString = vString.replace('\r\n', '\n')
         vString = vString.replace('\n\r', '\n')
-        # Increment "current position"
-        self.read_len += vLen
         return vString
 
-    def logLive(self, text, force=False):
-        """
-        If the time is right and the buffer is large enough,
-        send the text to the Central Engine.
-        """
-        if  CE_PROXY is None:
-            return
-        ctimer = time.time()
-        self.buffer += text
-
-        if ((ctimer - self.timer) > 1.5) and len(self.buffer):
-            proxy().log_live(EP_NAME, binascii.b2a_base64(self.buffer))
-            self.timer = ctimer
-            self.buffer = ''
-        elif len(self.buffer) > 256 or force:
-            proxy().log_live(EP_NAME, binascii.b2a_base64(self.buffer))
-            self.buffer = ''
-
     def write(self, text):
         # The write is from nohup, not here
         pass
@@ -381,10 +573,14 @@ class ThreadedLogger(Thread):
         """
         This will force the thread to exit.
         """
-        # Last read to make sure all CLI.log is captured
-        data = self.tail()
-        self.logLive(data, force=True)
-        self.closed = True
+        with self.acc_lock:
+            if self.closed:
+                return
+            # Last read to make sure all CLI.log is captured
+            self.live.add(self.tail(), force=True)
+            self.closed = True
+            if self.log_file:
+                self.log_file.close()
 
 
 # # #
@@ -413,6 +609,247 @@ def dbg_breakpoint():
 # # #
 
 
+class TestReport(object):
+
+    """
+    Collects the updates the Runner sends to the Central Engine for a test:
+    file statuses, file and EP variables, log messages and heartbeats.
+    All the updates are sent in a single RPC, when `flush` is called.
+    """
+
+    def __init__(self, epname):
+        self.epName = epname
+        self.ops = []
+
+
+    def _add(self, oper):
+        """
+        Queue one operation, merging it with the previous one, if possible.
+        """
+        last = self.ops[-1] if self.ops else None
+        if last and oper[0] == 'log' and last[0] == 'log' and last[1] == oper[1]:
+            # Consecutive messages for the same log are sent as one
+            self.ops[-1] = ('log', oper[1], last[2] + oper[2])
+        elif oper[0] in ['ep_var', 'file_var']:
+            # Only the last value of a variable is important
+            key = oper[:-1]
+            self.ops = [op for op in self.ops if op[:-1] != key]
+            self.ops.append(oper)
+        else:
+            self.ops.append(oper)
+
+
+    def status(self, file_id, new_status, time_elapsed=0.0):
+        """ change the status of a file """
+        self._add(('status', file_id, new_status, time_elapsed))
+
+    def file_var(self, file_id, key, value):
+        """ create or overwrite a file variable """
+        self._add(('file_var', file_id, key, value))
+
+    def ep_var(self, key, value):
+        """ create or overwrite an EP variable """
+        self._add(('ep_var', key, value))
+
+    def log(self, log_type, msg):
+        """ write a message in one of the logs """
+        self._add(('log', log_type, msg))
+
+    def suite_var(self, suite_id, key):
+        """ ask for a suite variable; the value is returned by flush """
+        self._add(('suite_var', suite_id, key))
+
+    def echo(self, msg):
+        """ print a message in the Central Engine log """
+        self._add(('echo', msg))
+
+
+    def _flush_one_by_one(self, ops):
+        """
+        Fallback for Central Engines that don't know about batches.
+        """
+        ce = proxy()
+        results = []
+        for oper in ops:
+            cmd, args = oper[0], oper[1:]
+            if cmd == 'status':
+                ce.set_file_status(self.epName, *args)
+            elif cmd == 'file_var':
+                ce.set_file_variable(self.epName, *args)
+            elif cmd == 'ep_var':
+                ce.set_ep_variable(self.epName, *args)
+            elif cmd == 'log':
+                ce.log_message(*args)
+            elif cmd == 'suite_var':
+                results.append(ce.get_suite_variable(self.epName, *args))
+            elif cmd == 'echo':
+                ce.echo(*args)
+        return (ce.get_ep_status(self.epName), tuple(results))
+
+
+    def flush(self):
+        """
+        Send all the queued operations to the Central Engine.
+        Returns the EP status and the results of the queries;
+        the status is None if the Central Engine cannot be reached.
+        """
+        # A tuple of tuples is sent by value, in one message
+        ops = tuple(self.ops)
+        self.ops = []
+        counter = EP_EVENTS.counter
+        try:
+            resp = proxy().report_test_batch(self.epName, ops)
+        except AttributeError:
+            try:
+                resp = self._flush_one_by_one(ops)
+            except Exception:
+                trace = traceback.format_exc()[34:].strip()
+                print('Exception on sending test report `{}`!\n'.format(trace))
+                return (None, ())
+        except Exception:
+            trace = traceback.format_exc()[34:].strip()
+            print('Exception on sending test report `{}`!\n'.format(trace))
+            return (None, ())
+        if not resp:
+            return (None, ())
+        # Keep the pushed status in sync, unless a newer status was pushed
+        EP_EVENTS.set_status(resp[0], counter)
+        return (resp[0], tuple(resp[1]))
+
+
+# # #
+
+
+class Prefetcher(object):
+
+    """
+    Downloads the next test files and the suite libraries in the background,
+    while the current test is running.
+    The files are queued in the order of the suites, without waiting for the runner,
+    so the dependencies are checked by the runner only when a test is next.
+    Only `window` files are downloaded ahead, and max `max_memory` bytes are kept.
+    The files are kept in memory, because EP_CACHE is used for the repeated files.
+    """
+
+    def __init__(self, runner, window=PREFETCH_WINDOW, max_memory=PREFETCH_MEMORY):
+        self.runner = runner
+        self.window = window
+        self.max_memory = max_memory
+        self.order = {}   # Position of each file, in execution order
+        self.queue = deque()
+        self.ready = {}   # Downloaded files: file ID -> data
+        self.loading = set()
+        self.taken = set()
+        self.size = 0
+        self.stopped = False
+        self.done = False # All the files were queued
+        self.cond = Condition()
+
+        self.threads = [Thread(target=self._worker) for _ in range(PREFETCH_THREADS)]
+        for thr in self.threads:
+            thr.daemon = True
+            thr.start()
+
+
+    def add_nodes(self, nodes):
+        """
+        Queue the libraries of the suites and the test files, for download.
+        The consecutive test files from the same suite, except the setup and teardown
+        files, can run in another order (see `_ready_nodes`), so they have the same position.
+        """
+        pos, group = 0, None
+        with self.cond:
+            for n_id, node in nodes:
+                plain = node['type'] == 'file' and not node.get('setup_file') and not node.get('teardown_file')
+                if node['type'] == 'suite':
+                    libs = [lib.strip().lstrip('/').replace('//', '/') for lib in (node.get('libraries') or '').split(';')]
+                    libs = [lib for lib in libs if lib]
+                    if libs:
+                        self.queue.append(('libs', libs))
+                else:
+                    if not plain or node['suite'] != group:
+                        pos += 1
+                    self.order[n_id] = pos
+                    self.queue.append(('file', n_id))
+                group = node['suite'] if plain else None
+            self.done = True
+            self.cond.notify_all()
+
+
+    def _worker(self):
+        """
+        Download the files from the queue, while there is room in the window.
+        """
+        while True:
+            with self.cond:
+                # Wait for the files to be queued, or for room in the window
+                while not self.stopped and ((not self.queue and not self.done) or (self.queue and \
+                    self.queue[0][0] == 'file' and (len(self.ready) + len(self.loading) >= self.window or \
+                    self.size >= self.max_memory))):
+                    self.cond.wait(1.0)
+                if self.stopped or not self.queue:
+                    return
+                kind, item = self.queue.popleft()
+                if kind == 'file':
+                    if item in self.taken:
+                        continue
+                    self.loading.add(item)
+
+            if kind == 'libs':
+                try:
+                    self.runner.prefetchLibraries(item)
+                except Exception as exp_err:
+                    print('Prefetch: Cannot download libraries `{}`: `{}`!'.format(item, exp_err))
+                continue
+
+            try:
+                data = self.runner.downloadFile(item)
+            except Exception:
+                data = None
+
+            with self.cond:
+                self.loading.discard(item)
+                if isinstance(data, str) and not self.stopped and item not in self.taken:
+                    self.ready[item] = data
+                    self.size += len(data)
+                self.cond.notify_all()
+
+
+    def get(self, file_id):
+        """
+        Returns the downloaded file, or None if the file was not downloaded.
+        Waits for the file, if it's downloading right now.
+        The files before this one, that were not used, are dropped.
+        """
+        with self.cond:
+            self.taken.add(file_id)
+            while file_id in self.loading:
+                self.cond.wait(1.0)
+            data = self.ready.pop(file_id, None)
+            if data is not None:
+                self.size -= len(data)
+            # Files skipped by the runner, before the group of this file
+            pos = self.order.get(file_id, 0)
+            for f_id in [f_id for f_id in self.ready if self.order[f_id] < pos]:
+                self.size -= len(self.ready.pop(f_id))
+            self.cond.notify_all()
+            return data
+
+
+    def stop(self):
+        """
+        Stop downloading and forget all the files.
+        """
+        with self.cond:
+            self.stopped = True
+            self.ready = {}
+            self.size = 0
+            self.cond.notify_all()
+
+
+# # #
+
+
 class TwisterRunner(object):
 
     def __init__(self, USER_NAME, EP_NAME, CE_PATH):
@@ -426,6 +863,14 @@ class TwisterRunner(object):
         self.commonLib = None
         self.exit_on_test_fail = False
         self.tc_delay = 0
+        # Updates for the Central Engine, sent once for each test step
+        self.report = TestReport(EP_NAME)
+        # Downloads the next test files, while the tests are running
+        self.prefetcher = None
+        # True in the processes that run the independent suites
+        self.worker = False
+        # The EP variable with the top level suite running in this process
+        self.suite_var = 'curent_suite'
 
 
     def __del__(self):
@@ -437,6 +882,9 @@ class TwisterRunner(object):
         Send stop status.
         """
         print('\n~ Stop the Execution Process ~\n')
+        if self.prefetcher:
+            self.prefetcher.stop()
+            self.prefetcher = None
         # Send the STOP signal? Default, yes.
         stop = kw.get('stop', True)
         if stop:
@@ -457,10 +905,13 @@ class TwisterRunner(object):
         # Send stop status
         self.stop(timer_f, args, kw)
         # Flush all messages
-        LOGGER.close()
+        if LOGGER:
+            LOGGER.close()
         # Close everything
-        CE_PROXY.close()
-        BG_SERVER.stop()
+        if CE_PROXY is not None:
+            CE_PROXY.close()
+        if BG_SERVER is not None:
+            BG_SERVER.stop()
         # Ok to exit
         return True
 
@@ -556,58 +1007,134 @@ class TwisterRunner(object):
         return True
 
 
-    def saveLibraries(self, libs_list=''):
+    @staticmethod
+    def _lib_store_path(digest):
         """
-        Downloads all libraries from Central Engine.
+        Path of one library file in the local store, by SHA1.
         """
-        libs_path = '{}/ce_libs'.format(EP_CACHE)
-        reset_libs = False
-        dl_libs = proxy().get_user_variable('dl_libs')
+        return '{}/{}/{}'.format(LIB_STORE, digest[:2], digest)
 
-        if not libs_list:
-            # This is a list with unique names, sorted alphabetically
-            libs_list = proxy().list_libraries(False)
-            # Pop CommonLib from the list of libraries...
-            if 'TscCommonLib.py' in libs_list:
-                libs_list.pop(libs_list.index('TscCommonLib.py'))
-            # And inject it in the first position! This is important!
-            libs_list.insert(0, 'TscCommonLib.py')
-            # Save the list for later
-            self.libs_list.extend(libs_list)
-            reset_libs = True
-        else:
-            libs_list = [lib.strip() for lib in libs_list.split(';') if lib.strip() not in self.libs_list]
-            self.libs_list.extend(libs_list)
 
-        if reset_libs:
-            # Remove libs path only if saving libraries for all project
-            shutil.rmtree(libs_path, ignore_errors=True)
-            # Create the path, after removal
-            try:
-                os.makedirs(libs_path)
-            except Exception as exp_err:
-                pass
+    def _store_library_file(self, rel_path, digest):
+        """
+        Downloads one library file in the local store, if it's not there.
+        Returns 1 if the file was downloaded, 0 if it was in the store, or None on error.
+        """
+        blob = self._lib_store_path(digest)
+        if os.path.isfile(blob):
+            return 0
+        try: os.makedirs(os.path.split(blob)[0])
+        except Exception: pass
+        # Write the blob and rename it, so the store never has partial files;
+        # the prefetcher might download the same file, at the same time
+        tmp_blob = '{}.{}.{}.tmp'.format(blob, os.getpid(), thread.get_ident())
+        sha = hashlib.sha1()
+        # Only one chunk is kept in memory
+        with open(tmp_blob, 'wb') as f:
+            while True:
+                lib_data = proxy().download_library_blob(digest, f.tell(), DOWNLOAD_CHUNK)
+                if not isinstance(lib_data, str) or lib_data.startswith('*ERROR*'):
+                    break
+                sha.update(lib_data)
+                f.write(lib_data)
+                if len(lib_data) < DOWNLOAD_CHUNK:
+                    break
+        if sha.hexdigest() != digest:
+            print('Cannot download library file `{}`!'.format(rel_path))
+            try: os.remove(tmp_blob)
+            except Exception: pass
+            return None
+        os.rename(tmp_blob, blob)
+        return 1
 
-        # Create the ce_libs file
-        self.makeCeLibs()
 
-        all_libs = [] # Normal python files or folders
-        zip_libs = [] # Zip libraries
+    def downloadFile(self, file_info):
+        """
+        Downloads a test file from the Central Engine, chunk by chunk.
+        `file_info` is a file ID, or a path.
+        Returns the file data, or the error sent by the Central Engine.
+        """
+        chunks = []
+        fstart = 0
+        while True:
+            fdata = proxy().download_chunk(self.epName, file_info, fstart, DOWNLOAD_CHUNK)
+            if not isinstance(fdata, str) or fdata.startswith('*ERROR*'):
+                return fdata
+            fdata = zlib.decompress(fdata)
+            chunks.append(fdata)
+            fstart += len(fdata)
+            # A short chunk is the end of the file
+            if len(fdata) < DOWNLOAD_CHUNK:
+                break
+        return ''.join(chunks)
+
+
+    def prefetchLibraries(self, libs):
+        """
+        Downloads the files of some libraries in the local store,
+        without saving them in `ce_libs`. Called by the prefetcher.
+        """
+        manifest = proxy().get_libraries_manifest(tuple(libs))
+        if not manifest:
+            return False
+        for _, files in manifest:
+            for rel_path, digest, _ in files:
+                self._store_library_file(rel_path, digest)
+        return True
 
-        for lib in libs_list:
-            # Null libraries ?
-            if not lib:
-                continue
-            # Fix / and // issues
-            lib = lib.lstrip('/').replace('//', '/')
-            # Already in the list ?
-            if lib in zip_libs or lib in all_libs:
+
+    def _sync_libraries(self, libs_path, libs, dl_libs):
+        """
+        Downloads only the library files that are not in the local store,
+        then copies the libraries from the store into `ce_libs`.
+        Returns False if the CE cannot send the manifest of the libraries.
+        """
+        try:
+            manifest = proxy().get_libraries_manifest(tuple(libs))
+        except Exception as exp_err:
+            print('Cannot get the manifest of the libraries: `{}`!'.format(exp_err))
+            return False
+        if not manifest:
+            return False
+
+        downloaded = 0
+
+        for lib_file, files in manifest:
+            if not files:
+                print('Library `{}` does not exist!'.format(lib_file))
                 continue
-            if lib.endswith('.zip'):
-                zip_libs.append(lib)
-            else:
-                all_libs.append(lib)
 
+            for rel_path, digest, _ in files:
+                stored = self._store_library_file(rel_path, digest)
+                if stored is None:
+                    continue
+                downloaded += stored
+                blob = self._lib_store_path(digest)
+
+                lib_pth = libs_path + '/' + rel_path
+                try: os.makedirs(os.path.split(lib_pth)[0])
+                except Exception: pass
+                try:
+                    shutil.copyfile(blob, lib_pth)
+                except Exception as exp_err:
+                    print('Cannot save library file `{}`: {}!'.format(rel_path, exp_err))
+
+            # Flatten file ?
+            if dl_libs == 'flat' and '/' in lib_file:
+                lib_name = os.path.split(lib_file)[-1]
+                os.chdir(libs_path)
+                shutil.move(lib_file, libs_path + '/' + lib_name)
+
+        os.system('chmod -R 777 ' + libs_path)
+        print('Synchronized `{}` libraries, downloaded `{}` files.'.format(len(manifest), downloaded))
+        return True
+
+
+    def _download_libraries(self, libs_path, zip_libs, all_libs, dl_libs):
+        """
+        Downloads the libraries one by one; the folders are sent as tar.gz archives.
+        Used when the libraries are in ClearCase.
+        """
         for lib_file in zip_libs:
             lib_data = proxy().download_library(lib_file)
             time.sleep(0.1) # Must take it slow
@@ -681,6 +1208,63 @@ class TwisterRunner(object):
                 os.chdir(libs_path)
                 shutil.move(lib_file, libs_path + '/' + lib_name)
 
+
+    def saveLibraries(self, libs_list=''):
+        """
+        Downloads all libraries from Central Engine.
+        """
+        libs_path = '{}/ce_libs'.format(EP_CACHE)
+        reset_libs = False
+        dl_libs = proxy().get_user_variable('dl_libs')
+
+        if not libs_list:
+            # This is a list with unique names, sorted alphabetically
+            libs_list = proxy().list_libraries(False)
+            # Pop CommonLib from the list of libraries...
+            if 'TscCommonLib.py' in libs_list:
+                libs_list.pop(libs_list.index('TscCommonLib.py'))
+            # And inject it in the first position! This is important!
+            libs_list.insert(0, 'TscCommonLib.py')
+            # Save the list for later
+            self.libs_list.extend(libs_list)
+            reset_libs = True
+        else:
+            libs_list = [lib.strip() for lib in libs_list.split(';') if lib.strip() not in self.libs_list]
+            self.libs_list.extend(libs_list)
+
+        if reset_libs:
+            # Remove libs path only if saving libraries for all project
+            shutil.rmtree(libs_path, ignore_errors=True)
+            # Create the path, after removal
+            try:
+                os.makedirs(libs_path)
+            except Exception as exp_err:
+                pass
+
+        # Create the ce_libs file
+        self.makeCeLibs()
+
+        all_libs = [] # Normal python files or folders
+        zip_libs = [] # Zip libraries
+
+        for lib in libs_list:
+            # Null libraries ?
+            if not lib:
+                continue
+            # Fix / and // issues
+            lib = lib.lstrip('/').replace('//', '/')
+            # Already in the list ?
+            if lib in zip_libs or lib in all_libs:
+                continue
+            if lib.endswith('.zip'):
+                zip_libs.append(lib)
+            else:
+                all_libs.append(lib)
+
+        # Download only the changed files, if the CE can send the manifest of the libraries
+        if self._sync_libraries(libs_path, zip_libs + all_libs, dl_libs) is False:
+            self._download_libraries(libs_path, zip_libs, all_libs, dl_libs)
+
         # Flatten recursive ? Default yes !
         if not dl_libs or dl_libs == 'flat':
             os.chdir(libs_path)
@@ -713,51 +1297,262 @@ class TwisterRunner(object):
 
     def start_logs(self, file_id, filename):
         """
-        Write start log messages for current test.
+        Queue start log messages for current test.
+        The messages are sent with the next report.
         """
         msg = '<<< START filename: `{}:{}` >>>\n'.format(file_id, filename)
         print(msg)
-        proxy().log_message('logRunning', msg + '\n')
-        proxy().log_message('logDebug', msg + '\n')
-        proxy().log_message('logTest', msg + '\n')
+        self.report.log('logRunning', msg + '\n')
+        self.report.log('logDebug', msg + '\n')
+        self.report.log('logTest', msg + '\n')
         return True
 
 
     def end_logs(self, file_id, filename):
         """
         Write end log messages for current test.
+        This sends the report with all the updates for the current test.
         """
         msg = '<<< END filename: `{}:{}` >>>\n'.format(file_id, filename)
         print(msg)
-        proxy().log_message('logRunning', msg + '\n')
-        proxy().log_message('logDebug', msg + '\n')
-        proxy().log_message('logTest', msg + '\n')
+        self.report.log('logRunning', msg + '\n')
+        self.report.log('logDebug', msg + '\n')
+        self.report.log('logTest', msg + '\n')
+        self.report.flush()
         return True
 
 
+    @staticmethod
+    def _node_deps(node):
+        """
+        The list of dependency IDs of a test file.
+        """
+        deps = []
+        for dep in (node.get('_depend') or '').split(';'):
+            dep_id = dep.strip().split(':')[0]
+            if dep_id:
+                deps.append(dep_id)
+        return deps
+
+
+    def _ready_order(self, files):
+        """
+        Generator over a group of consecutive files from the same suite.
+        The files that can run now are returned first; the files with unfinished
+        dependencies are delayed, until they are the only ones left.
+        """
+        pending = list(files)
+        while pending:
+            deps = set()
+            for _, node in pending:
+                deps.update(self._node_deps(node))
+            if not deps or len(pending) == 1:
+                for item in pending:
+                    yield item
+                return
+
+            try:
+                statuses = dict(proxy().get_dependencies_status(tuple(deps)))
+            except Exception:
+                # The Central Engine doesn't know about this call; keep the order
+                for item in pending:
+                    yield item
+                return
+
+            # All the dependencies finished; nothing to delay
+            if STATUS_PENDING not in statuses.values() and STATUS_WORKING not in statuses.values():
+                for item in pending:
+                    yield item
+                return
+
+            ready = 0
+            for i, (_, node) in enumerate(pending):
+                dep_statuses = [statuses.get(dep_id, -1) for dep_id in self._node_deps(node)]
+                if STATUS_PENDING not in dep_statuses and STATUS_WORKING not in dep_statuses:
+                    ready = i
+                    break
+
+            yield pending.pop(ready)
+
+
+    def _ready_nodes(self, suitesManager):
+        """
+        Generator over the suites and files, in execution order.\n
+        Inside each group of consecutive test files from the same suite,
+        except the setup and teardown files, the tests waiting for dependencies
+        are delayed, so the independent tests run first.
+        """
+        group = []
+        for n_id, node in suitesManager.iter_nodes(None, []):
+            plain = node['type'] == 'file' and not node.get('setup_file') and not node.get('teardown_file')
+            if group and not (plain and node['suite'] == group[-1][1]['suite']):
+                for item in self._ready_order(group):
+                    yield item
+                group = []
+            if plain:
+                group.append((n_id, node))
+            else:
+                yield n_id, node
+        for item in self._ready_order(group):
+            yield item
+
+
+    def _common_globs(self):
+        """
+        The globals injected in all the tests: all the public functions from commonLib.
+        Returns the functions, and the names of the properties (eg: `ce_proxy`),
+        that must be evaluated again for each test, because they can change.
+        """
+        globs = {'breakpoint': dbg_breakpoint}
+        props = []
+        for f in dir(self.commonLib):
+            # Ignore "private" functions
+            if f[0] == '_':
+                continue
+            if isinstance(getattr(type(self.commonLib), f, None), property):
+                props.append(f)
+                continue
+            func = getattr(self.commonLib, f)
+            if callable(func):
+                globs[f] = func
+        return globs, props
+
+
+    @staticmethod
+    def _first_iterator(iteration_nr):
+        """
+        The value, name and component of the first iterator, from the iteration number.
+        """
+        if type(iteration_nr) != str or not iteration_nr:
+            return None, None, None
+        first = iteration_nr.split(',')[0]
+        return first.split('=')[1], first.split('#')[2].split('=')[0], first.split('#')[1]
+
+
+    def _start_prefetcher(self):
+        """
+        Start downloading the test files and the libraries, before they are needed.
+        """
+        try:
+            window = int(proxy().get_user_variable('prefetch_window') or PREFETCH_WINDOW)
+            max_memory = int(proxy().get_user_variable('prefetch_memory') or 0) * 1024 * 1024 or PREFETCH_MEMORY
+        except Exception:
+            window, max_memory = PREFETCH_WINDOW, PREFETCH_MEMORY
+        if window > 0:
+            self.prefetcher = Prefetcher(self, window, max_memory)
+
+
+    def _parallel_suites(self, suitesManager):
+        """
+        The top level suites marked independent, split between the worker processes.
+        Parallel mode is enabled by the `parallel_suites` user variable, the max number of workers.
+        """
+        try:
+            max_workers = int(proxy().get_user_variable('parallel_suites') or 0)
+        except Exception:
+            max_workers = 0
+        if max_workers < 1:
+            return []
+        if not hasattr(os, 'fork'):
+            print('EP Warn: Parallel suites are not supported on this system!\n')
+            return []
+
+        suites = [s_id for s_id, node in suitesManager.iteritems()
+            if str(node.get(PARALLEL_PROP, '')).lower() == 'true']
+        workers = min(max_workers, len(suites))
+        return [suites[i::workers] for i in range(workers)]
+
+
+    def _fork_worker(self, suitesManager, suites, glob_time, index):
+        """
+        Run some suites in a new process, with a new runner and a new CE connection.
+        The worker has its own cache folder and `ce_libs`, because the `ce_libs` file
+        is re-created for each test, and its own `curent_suite` EP variable.
+        Returns the PID of the worker, in the parent process.
+        """
+        global CE_PROXY, BG_SERVER, LOGGER, PARENT_PROXY, EP_WORKER, EP_CACHE
+
+        # The connection must not be used by another thread during fork
+        with PROXY_LOCK:
+            pid = os.fork()
+        if pid:
+            print('EP Info: Running suites `{}` in worker process `{}`.\n'.format(', '.join(suites), pid))
+            return pid
+
+        code = 0
+        try:
+            # The connection of the parent must stay open
+            PARENT_PROXY = (CE_PROXY, BG_SERVER)
+            CE_PROXY, BG_SERVER = None, None
+            # The worker only says hello as `ep::name`, for the events
+            EP_WORKER = True
+            if PORTABLE:
+                LOGGER = Logger()
+                LOGGER.start()
+            else:
+                # The parent logger sends the log of this process, too
+                LOGGER = None
+            self.worker = True
+            self.suite_var = 'curent_suite_{}'.format(index)
+            self.runners = dict.fromkeys(self.runners)
+
+            # The libraries already downloaded by the parent are copied;
+            # the runners and the common library find the cache from the environment
+            parent_libs = '{}/ce_libs'.format(EP_CACHE)
+            EP_CACHE = '{}/worker_{}'.format(EP_CACHE, index)
+            shutil.rmtree(EP_CACHE, ignore_errors=True)
+            shutil.copytree(parent_libs, EP_CACHE + '/ce_libs')
+            os.environ['TWISTER_EP_CACHE'] = EP_CACHE
+            sys.path = [EP_CACHE + '/ce_libs' if p == parent_libs else p for p in sys.path]
+            self.report = TestReport(self.epName)
+            self.prefetcher = None
+
+            if not proxy():
+                os._exit(1)
+            worker_sm = type(suitesManager)([(s_id, suitesManager[s_id]) for s_id in suites])
+            self._start_prefetcher()
+            self._run_nodes(worker_sm, glob_time)
+
+        except Exception:
+            trace = traceback.format_exc()[34:].strip()
+            print('Worker process for suites `{}` crashed: `{}`!'.format(', '.join(suites), trace))
+            code = 1
+
+        finally:
+            if self.prefetcher:
+                self.prefetcher.stop()
+            try:
+                proxy().set_ep_variable(self.epName, self.suite_var, '')
+            except Exception:
+                pass
+            if LOGGER:
+                LOGGER.close()
+            os._exit(code)
+
+
     def tests(self):
         """
         Cycle in all files, run each file, in order.
         """
         # Count the time
         glob_time = time.time()
-        last_time = glob_time
         time_diff = 30
 
-        if proxy().get_ep_status(self.epName) == 'running':
+        # Old dependency events are not important
+        EP_EVENTS.deps.clear()
+        status = EP_EVENTS.refresh()
+
+        if status == 'running':
             print('EP Info: Start running the tests!')
         # Portable ?
         elif PORTABLE:
             print('EP Info: Waiting for the EP to start...\n')
-            while True:
-                time.sleep(2)
-                glob_time = time.time()
-                if  glob_time > last_time + time_diff:
-                    last_time = glob_time
+            # The start signal is pushed by the Central Engine
+            while status != 'running':
+                status = EP_EVENTS.wait_status(status, time_diff)
+                if status != 'running':
                     print('Still waiting for the start signal...')
-                # Running !
-                if proxy().get_ep_status(self.epName) == 'running':
-                    break
+            glob_time = time.time()
             # Must re-check the libraries !
             self.saveLibraries()
         else:
@@ -770,9 +1565,65 @@ class TwisterRunner(object):
         suitesManager = copy.deepcopy(data)
         del data
 
+        # The independent suites run in parallel, in worker processes
+        workers = []
+        for index, suites in enumerate(self._parallel_suites(suitesManager)):
+            pid = self._fork_worker(suitesManager, suites, glob_time, index)
+            if pid:
+                workers.append(pid)
+                for suite_id in suites:
+                    del suitesManager[suite_id]
+
+        self._start_prefetcher()
+        ret = self._run_nodes(suitesManager, glob_time)
+
+        # Wait for the suites running in parallel
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except Exception as exp_err:
+                print('Cannot wait for worker process `{}`: `{}`!'.format(pid, exp_err))
+
+        # The tests were stopped
+        if ret is not None:
+            return ret
+
+        print('\n==========================')
+        print('. . . All tests done . . .')
+        print('==========================\n')
+
+
+        del suitesManager
+
+        # Print the final message
+        diff_time = time.time() - glob_time
+
+        # Clean the cache, but keep the library store for the next runs
+        try:
+            for fname in os.listdir(EP_CACHE):
+                if fname == 'lib_store':
+                    continue
+                fpath = EP_CACHE + os.sep + fname
+                if os.path.isdir(fpath) and not os.path.islink(fpath):
+                    shutil.rmtree(fpath)
+                else:
+                    os.remove(fpath)
+        except Exception as exp_err:
+            print('Cannot clean cache! {}'.format(exp_err))
+
+        if PORTABLE:
+            return self.stop(timer_f=diff_time)
+        else:
+            return self.exit(timer_f=diff_time)
+
+
+    def _run_nodes(self, suitesManager, glob_time):
+        """
+        Run all the suites and files, in order.
+        Returns None when all the tests are done, or the result of the exit, if the tests are stopped.
+        """
         # Used by all files
         suite_id = None
-        suite_data = None
         suite_name = None # Suite name string. This varies for each file.
         abort_suite = False # Abort suite X, when setup file fails.
         abort_iter = False # Abort repeated file X, when Iteration has Stop on Fail.
@@ -780,8 +1631,17 @@ class TwisterRunner(object):
         # Import all custom exceptions
         from TscCommonLib import ExceptionTestFail, ExceptionTestAbort, ExceptionTestTimeout, ExceptionTestSkip
 
+        # The part of the test globals that is the same for all the tests
+        common_globs, common_props = self._common_globs()
+        # Properties of the current suite, without the known properties
+        suite_props = {}
+
 
-        for id, node in suitesManager.iter_nodes(None, []):
+        # The prefetcher downloads the files in the order of the suites
+        if self.prefetcher:
+            self.prefetcher.add_nodes(suitesManager.iter_nodes(None, []))
+
+        for id, node in self._ready_nodes(suitesManager):
 
             # When starting a new suite or sub-suite ...
             # Some files don't belong to this suite, they might belong to the parent of this suite,
@@ -794,13 +1654,13 @@ class TwisterRunner(object):
 
                 self.sut = node['sut']
                 suite_id = id
-                suite_data = node
+                suite_props = dict((k, v) for k, v in node.iteritems() if k not in FILE_PROPS)
                 suite_name = node['name']
                 suite_str = suite_id +' - '+ suite_name
 
                 # If this is a top level suite, set current_suite flag in EP Variables
                 if suite_id in suitesManager:
-                    proxy().set_ep_variable(self.epName, 'curent_suite', suite_id)
+                    proxy().set_ep_variable(self.epName, self.suite_var, suite_id)
 
                 print('\n===== ===== ===== ===== =====')
                 print(' Starting suite `{}`'.format(suite_str))
@@ -819,8 +1679,6 @@ class TwisterRunner(object):
             # Files section
             file_id = id
             suite_id = node['suite']
-            # Update suite name from CE
-            suite_name = proxy().get_suite_variable(self.epName, suite_id, 'name')
 
             # The name of the file
             filename = node['file']
@@ -840,23 +1698,8 @@ class TwisterRunner(object):
             iteration_sof = 'true' in [it['iter_sof'].lower() for it in node.get('_cfg_files', [])]
             # Iteration number
             iteration_nr = node.get('iterationNr', '')
-            # first iterator value
-            first_iterator_value = None
-            if type(iteration_nr) == str and len(iteration_nr) > 0 and \
-            len(iteration_nr.split(',')) > 0:
-                first_iterator_value = iteration_nr.split(',')[0].split('=')[1]
-            # first iterator name
-            first_iterator_name = None
-            if type(iteration_nr) == str and len(iteration_nr) > 0 and \
-            len(iteration_nr.split(',')) > 0:
-                first_iterator_name = iteration_nr.split(',')[0].\
-                split('#')[2].split('=')[0]
-            # first iterator component
-            first_iterator_comp = None
-            if type(iteration_nr) == str and len(iteration_nr) > 0 and \
-            len(iteration_nr.split(',')) > 0:
-                first_iterator_comp = iteration_nr.split(',')[0].\
-                split('#')[1]
+            # First iterator value, name and component
+            first_iterator_value, first_iterator_name, first_iterator_comp = self._first_iterator(iteration_nr)
             # Get args
             args = node.get('param')
             if args:
@@ -864,27 +1707,23 @@ class TwisterRunner(object):
             else:
                 args = []
 
-            # Extra properties, from the applet
-            props = dict(node)
-            props.update(suite_data)
-            for prop in ['type', 'ep', 'sut', 'name', 'pd', 'libraries',\
-            'children', 'clearcase', 'twister_tc_revision', 'status', 'file',\
-            'suite', '_depend', '_dep_id', 'Runnable', 'setup_file',\
-            'teardown_file', 'Optional', '_cfg_files', 'param']:
-                # Removing all known File properties
-                try:
-                    del props[prop]
-                except Exception:
-                    pass
-
-            # Re-create the ce_libs file
-            self.makeCeLibs(suite_id, suite_name, file_id, os.path.split(filename)[1])
+            # Extra properties, from the applet; all known File properties are removed
+            props = dict((k, v) for k, v in node.iteritems() if k not in FILE_PROPS)
+            props.update(suite_props)
 
             # Write START TEST in all logs
             self.start_logs(file_id, filename)
-
             # Set Last seen alive flag on this EP
-            proxy().set_ep_variable(self.epName, 'last_seen_alive', time.strftime('%Y-%m-%d %H:%M:%S'))
+            self.report.ep_var('last_seen_alive', time.strftime('%Y-%m-%d %H:%M:%S'))
+            # Update suite name from CE
+            self.report.suite_var(suite_id, 'name')
+            # Send everything and get the EP status, in one call
+            STATUS, values = self.report.flush()
+            if values:
+                suite_name = values[0]
+
+            # Re-create the ce_libs file
+            self.makeCeLibs(suite_id, suite_name, file_id, os.path.split(filename)[1])
 
 
             # If a setup file failed, abort the current suite and all sub-suites,
@@ -899,14 +1738,9 @@ class TwisterRunner(object):
                         print('Running a tear-down file...\n')
                     else:
                         print('Not executed file `{}` because of failed setup file!\n\n'.format(filename))
-                        proxy().set_file_status(self.epName, file_id, STATUS_NOT_EXEC, 0.0) # File status NOT EXEC
-                        try:
-                            proxy().set_file_variable(self.epName, file_id,\
-                            '_reason', 'Not executed, because of failed \
-                            setup file!')
-                        except Exception:
-                            trace = traceback.format_exc()[34:].strip()
-                            print('Exception on sending reason `{}`!'.format(trace))
+                        self.report.status(file_id, STATUS_NOT_EXEC, 0.0) # File status NOT EXEC
+                        self.report.file_var(file_id, '_reason',\
+                        'Not executed, because of failed setup file!')
                         self.end_logs(file_id, filename)
                         continue
                 del aborted_ids, current_ids
@@ -915,34 +1749,25 @@ class TwisterRunner(object):
             if abort_iter == filename and iteration_nr and iteration_sof:
                 print('Not executed file `{}` because of iteration stop on fail!\n'.format(filename))
                 print('Iteration `{}` will not run!!\n\n'.format(iteration_nr))
-                proxy().set_file_status(self.epName, file_id, STATUS_NOT_EXEC, 0.0) # File status NOT EXEC
-                try:
-                    proxy().set_file_variable(self.epName, file_id,\
-                    '_reason', 'Not executed, because of failed iteration \
-                    file!')
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on sending reason `{}`!'.format(trace))
+                self.report.status(file_id, STATUS_NOT_EXEC, 0.0) # File status NOT EXEC
+                self.report.file_var(file_id, '_reason',\
+                'Not executed, because of failed iteration file!')
                 self.end_logs(file_id, filename)
                 continue
             else:
                 abort_iter = False
 
 
-            try:
-                STATUS = proxy().get_ep_status(self.epName)
-            except Exception:
+            # The status was received with the start report
+            if not STATUS:
                 print('Cannot connect to the Central Engine! Exiting!\n')
                 return False
 
             # When a test file is about to be executed and STOP is received, send status ABORTED
             if STATUS == 'stopped':
-                proxy().set_file_status(self.epName, file_id, STATUS_ABORTED, 0.0) # File status ABORTED
-                try:
-                    proxy().set_file_variable(self.epName, file_id, '_reason', 'Manual stop! Time to exit!')
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on sending reason `{}`!'.format(trace))
+                self.report.status(file_id, STATUS_ABORTED, 0.0) # File status ABORTED
+                self.report.file_var(file_id, '_reason', 'Manual stop! Time to exit!')
+                self.report.flush()
                 print('~ STOP: Time to exit! ~')
                 diff_time = time.time() - glob_time
                 return self.exit(timer_f=diff_time, stop=False)
@@ -959,12 +1784,10 @@ class TwisterRunner(object):
                         print('~ PAUSE: Waiting for RESUME signal... ~\n')
                         vPauseMsg = True
 
-                    # Wait ...
-                    time.sleep(2)
+                    # Wait for the Central Engine to push Resume or Stop
+                    STATUS = EP_EVENTS.wait_status('paused')
 
-                    try:
-                        STATUS = proxy().get_ep_status(self.epName)
-                    except Exception:
+                    if STATUS is None:
                         print('~ NOT EXECUTED: Connection lost, while waiting for resume ! ~\n')
                         return False
 
@@ -975,13 +1798,10 @@ class TwisterRunner(object):
                     # On stop...
                     elif STATUS == 'stopped':
                         # When a test is waiting for resume, but receives STOP, send status NOT EXECUTED
-                        proxy().set_file_status(self.epName, file_id, STATUS_NOT_EXEC, 0.0)
-                        try:
-                            proxy().set_file_variable(self.epName, file_id,\
-                            '_reason', 'Manual stop, while waiting for resume!')
-                        except Exception:
-                            trace = traceback.format_exc()[34:].strip()
-                            print('Exception on sending reason `{}`!'.format(trace))
+                        self.report.status(file_id, STATUS_NOT_EXEC, 0.0)
+                        self.report.file_var(file_id, '_reason',\
+                        'Manual stop, while waiting for resume!')
+                        self.report.flush()
                         print('~ STOP: Received STOP, while waiting for resume ! ~')
                         # Exit the cycle
                         diff_time = time.time() - glob_time
@@ -1005,7 +1825,8 @@ class TwisterRunner(object):
                         continue
 
                     # Dependency file information
-                    dep_info = proxy().get_dependency_info(dep_id)
+                    # The CE will push an event when the dependency finishes
+                    dep_info = proxy().get_dependency_info(dep_id, self.epName)
                     if not dep_info:
                         print('Invalid dependency `{}` will be ignored!'.format(dep_id))
                         continue
@@ -1018,8 +1839,11 @@ class TwisterRunner(object):
                         execution...\n'.\
                         format(dep_info['id'], dep_info['file']))
                         while 1:
-                            time.sleep(2)
-                            dep_info['status'] = proxy().get_file_variable(dep_info['ep'], dep_info['id'], 'status')
+                            dep_curr_status = EP_EVENTS.wait_dependency(dep_id)
+                            # Nothing pushed; ask the CE, in case the event was lost
+                            if dep_curr_status is None:
+                                dep_curr_status = proxy().get_file_variable(dep_info['ep'], dep_info['id'], 'status')
+                            dep_info['status'] = dep_curr_status
                             dep_curr_status = REVERSED_STATUS.get(dep_info.get('status', -1), 'invalid')
                             # Reload info about dependency file
                             if  dep_curr_status not in ['invalid', 'pending', 'working']:
@@ -1043,17 +1867,9 @@ class TwisterRunner(object):
                         print('Dependency matched with success: `{}`.\n'.format(dep_status))
 
                 if not dep_ok:
-                    try:
-                        # Send status SKIP
-                        proxy().set_file_status(self.epName, file_id, STATUS_SKIPPED, 0.0)
-                    except Exception:
-                        trace = traceback.format_exc()[34:].strip()
-                        print('Exception on dependency change file status `{}`!\n'.format(trace))
-                    try:
-                        proxy().set_file_variable(self.epName, file_id, '_reason', 'Skip, dependency not ok!')
-                    except Exception:
-                        trace = traceback.format_exc()[34:].strip()
-                        print('Exception on sending reason `{}`!'.format(trace))
+                    # Send status SKIP
+                    self.report.status(file_id, STATUS_SKIPPED, 0.0)
+                    self.report.file_var(file_id, '_reason', 'Skip, dependency not ok!')
                     self.end_logs(file_id, filename)
                     continue
 
@@ -1065,7 +1881,9 @@ class TwisterRunner(object):
                 with open(cache_file, 'r') as f:
                     str_to_execute = f.read()
             else:
-                str_to_execute = proxy().download_file(self.epName, file_id)
+                str_to_execute = self.prefetcher.get(file_id) if self.prefetcher else None
+                if str_to_execute is None:
+                    str_to_execute = self.downloadFile(file_id)
 
             # If CE sent False, it means the file is empty, does not exist, or it's not runnable.
             if str_to_execute == '' or str_to_execute.startswith('*ERROR*'):
@@ -1075,32 +1893,16 @@ class TwisterRunner(object):
                     print('*ERROR* Setup file for suite `{}` cannot run! \
                     No such file! All suite will be ABORTED!\n\n'.\
                     format(suite_name))
-                try:
-                    proxy().set_file_status(self.epName, file_id, STATUS_SKIPPED, 0.0) # Status SKIPPED
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on change file status `{}`!\n'.format(trace))
-                try:
-                    proxy().set_file_variable(self.epName, file_id, '_reason', 'Skip, invalid setup file!')
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on sending reason `{}`!'.format(trace))
+                self.report.status(file_id, STATUS_SKIPPED, 0.0) # Status SKIPPED
+                self.report.file_var(file_id, '_reason', 'Skip, invalid setup file!')
                 self.end_logs(file_id, filename)
                 continue
 
             elif not str_to_execute:
                 print('EP Debug: File `{}` will be skipped.\n'.format(filename))
                 # Skipped setup files are ok, no need to abort.
-                try:
-                    proxy().set_file_status(self.epName, file_id, STATUS_SKIPPED, 0.0) # Status SKIPPED
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on change file status `{}`!\n'.format(trace))
-                try:
-                    proxy().set_file_variable(self.epName, file_id, '_reason', 'File marked skip!')
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on sending reason `{}`!'.format(trace))
+                self.report.status(file_id, STATUS_SKIPPED, 0.0) # Status SKIPPED
+                self.report.file_var(file_id, '_reason', 'File marked skip!')
                 self.end_logs(file_id, filename)
                 continue
 
@@ -1111,16 +1913,8 @@ class TwisterRunner(object):
                 f = open(fpath, 'wb')
                 f.write(str_to_execute)
                 f.close() ; del f
-                try:
-                    proxy().set_file_status(self.epName, file_id, STATUS_SKIPPED, 0.0) # Status SKIPPED
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on change file status `{}`!\n'.format(trace))
-                try:
-                    proxy().set_file_variable(self.epName, file_id, '_reason', 'Skip, file is not runnable!')
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on sending reason `{}`!'.format(trace))
+                self.report.status(file_id, STATUS_SKIPPED, 0.0) # Status SKIPPED
+                self.report.file_var(file_id, '_reason', 'Skip, file is not runnable!')
                 self.end_logs(file_id, filename)
                 continue
 
@@ -1159,16 +1953,8 @@ class TwisterRunner(object):
                     print('*ERROR* Setup file for suite `{}` cannot run! \
                     Unknown file extension! All suite will be ABORTED!\n\n'.\
                     format(suite_name))
-                try:
-                    proxy().set_file_status(self.epName, file_id, STATUS_NOT_EXEC, 0.0) # Status NOT_EXEC
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on change file status `{}`!\n'.format(trace))
-                try:
-                    proxy().set_file_variable(self.epName, file_id, '_reason', 'Not executed, unknown file extension!')
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on sending reason `{}`!'.format(trace))
+                self.report.status(file_id, STATUS_NOT_EXEC, 0.0) # Status NOT_EXEC
+                self.report.file_var(file_id, '_reason', 'Not executed, unknown file extension!')
                 self.end_logs(file_id, filename)
                 continue
 
@@ -1179,22 +1965,20 @@ class TwisterRunner(object):
                 time.sleep(self.tc_delay)
 
 
+            # The file is preparing
+            self.report.status(file_id, STATUS_WORKING, 0.0) # Status WORKING
             # Check the general status again...
-            try:
-                if proxy().get_ep_status(self.epName) == 'stopped':
-                    # Exit the cycle
-                    diff_time = time.time() - glob_time
-                    return self.exit(timer_f=diff_time, stop=False)
-            except Exception:
+            STATUS, _ = self.report.flush()
+            if not STATUS:
                 print('Cannot connect to the Central Engine! Exiting!\n')
                 return False
-
-            # The file is preparing
-            try:
-                proxy().set_file_status(self.epName, file_id, STATUS_WORKING, 0.0) # Status WORKING
-            except Exception:
-                trace = traceback.format_exc()[34:].strip()
-                print('Exception on change file status `{}`!\n'.format(trace))
+            if STATUS == 'stopped':
+                self.report.status(file_id, STATUS_ABORTED, 0.0) # File status ABORTED
+                self.report.file_var(file_id, '_reason', 'Manual stop! Time to exit!')
+                self.report.flush()
+                # Exit the cycle
+                diff_time = time.time() - glob_time
+                return self.exit(timer_f=diff_time, stop=False)
 
             # Start counting test time
             timer_i = time.time()
@@ -1221,18 +2005,13 @@ class TwisterRunner(object):
                 'FIRST_ITERATOR_NAME' : first_iterator_name,
                 'FIRST_ITERATOR_COMP' : first_iterator_comp,
                 'PROXY'     : proxy(),
-                'breakpoint' : dbg_breakpoint
             }
-
-            # Find all functions from commonLib
-            to_inject = [f for f in dir(self.commonLib) if callable(getattr(self.commonLib, f))]
-            # Expose all known function in tests
-            for f in to_inject:
-                # Ignore "private" functions
-                if f[0] == '_':
-                    continue
-                # print('DEBUG: Exposing Python command `{}` into TCL...'.format(f))
-                globs[f] = getattr(self.commonLib, f)
+            # The functions from commonLib are the same for all the tests
+            globs.update(common_globs)
+            for f in common_props:
+                func = getattr(self.commonLib, f)
+                if callable(func):
+                    globs[f] = func
 
             try:
                 result = current_runner._eval(str_to_execute, globs, args)
@@ -1266,23 +2045,16 @@ class TwisterRunner(object):
                 print(traceback.format_exc()[34:].strip())
                 print('\n>>> File `{}` execution CRASHED. <<<\n'.format(filename))
 
-                proxy().echo('*ERROR* Error executing file `{}`!'.format(filename))
-                try:
-                    proxy().set_file_status(self.epName, file_id, STATUS_FAIL, (time.time() - timer_i))
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on change file status `{}`!\n'.format(trace))
-
-                try:
-                    proxy().set_file_variable(self.epName, file_id, '_reason', 'Test execution CRASHED!')
-                except Exception:
-                    trace = traceback.format_exc()[34:].strip()
-                    print('Exception on sending reason `{}`!'.format(trace))
+                self.report.echo('*ERROR* Error executing file `{}`!'.format(filename))
+                # Send crash detected = True, before the status
+                self.report.file_var(file_id, 'twister_tc_crash_detected', 1)
+                self.report.status(file_id, STATUS_FAIL, (time.time() - timer_i))
+                self.report.file_var(file_id, '_reason', 'Test execution CRASHED!')
 
                 # If status is FAIL and the file is not Optional and Exit on test fail is ON, CLOSE the EP
                 if not optional_test and self.exit_on_test_fail:
                     print('*ERROR* Mandatory file `{}` CRASHED! Closing the EP!\n\n'.format(filename))
-                    proxy().echo('*ERROR* Mandatory file `{}::{}::{}` CRASHED! Closing the EP!'\
+                    self.report.echo('*ERROR* Mandatory file `{}::{}::{}` CRASHED! Closing the EP!'\
                         ''.format(self.epName, suite_name, filename))
                     self.end_logs(file_id, filename)
                     # Exit the cycle
@@ -1293,12 +2065,10 @@ class TwisterRunner(object):
                     abort_suite = suite_id
                     print('*ERROR* Setup file for suite `{}` returned FAIL! \
                     All suite will be ABORTED!\n\n'.format(suite_name))
-                    proxy().echo('*ERROR* Setup file for `{}::{}` returned \
+                    self.report.echo('*ERROR* Setup file for `{}::{}` returned \
                     FAIL! All suite will be ABORTED!'.\
                     format(self.epName, suite_name))
 
-                # Send crash detected = True
-                proxy().set_file_variable(self.epName, file_id, 'twister_tc_crash_detected', 1)
                 # Stop counting time. END OF TEST!
                 timer_f = time.time() - timer_i
                 end_time = time.strftime('%Y-%m-%d %H:%M:%S')
@@ -1324,36 +2094,29 @@ class TwisterRunner(object):
             except Exception:
                 result = str(result).upper()
 
-            try:
-                if  result == 0 or result == STATUS_PASS or result == 'PASS':
-                    result = STATUS_PASS
-                    proxy().set_file_status(self.epName, file_id, STATUS_PASS, timer_f) # File status PASS
-                elif result == STATUS_SKIPPED or result in ['SKIP', 'SKIPPED']:
-                    result = STATUS_SKIPPED
-                    proxy().set_file_status(self.epName, file_id, STATUS_SKIPPED, timer_f) # File status SKIPPED
-                elif result == STATUS_ABORTED or result in ['ABORT', 'ABORTED']:
-                    result = STATUS_ABORTED
-                    proxy().set_file_status(self.epName, file_id, STATUS_ABORTED, timer_f) # File status ABORTED
-                elif result == STATUS_NOT_EXEC or result in ['NOT-EXEC', 'NOT EXEC', 'NOT EXECUTED']:
-                    result = STATUS_NOT_EXEC
-                    proxy().set_file_status(self.epName, file_id, STATUS_NOT_EXEC, timer_f) # File status NOT_EXEC
-                elif result == STATUS_TIMEOUT or result == 'TIMEOUT':
-                    result = STATUS_TIMEOUT
-                    proxy().set_file_status(self.epName, file_id, STATUS_TIMEOUT, timer_f) # File status TIMEOUT
-                elif result == STATUS_INVALID or result == 'INVALID':
-                    proxy().set_file_status(self.epName, file_id, STATUS_INVALID, timer_f) # File status INVALID
-                else:
-                    result = STATUS_FAIL
-                    proxy().set_file_status(self.epName, file_id, STATUS_FAIL, timer_f) # File status FAIL
-            except Exception:
-                trace = traceback.format_exc()[34:].strip()
-                print('EXCEPTION on changing file status `{}`!'.format(trace))
+            if  result == 0 or result == STATUS_PASS or result == 'PASS':
+                result = STATUS_PASS
+                self.report.status(file_id, STATUS_PASS, timer_f) # File status PASS
+            elif result == STATUS_SKIPPED or result in ['SKIP', 'SKIPPED']:
+                result = STATUS_SKIPPED
+                self.report.status(file_id, STATUS_SKIPPED, timer_f) # File status SKIPPED
+            elif result == STATUS_ABORTED or result in ['ABORT', 'ABORTED']:
+                result = STATUS_ABORTED
+                self.report.status(file_id, STATUS_ABORTED, timer_f) # File status ABORTED
+            elif result == STATUS_NOT_EXEC or result in ['NOT-EXEC', 'NOT EXEC', 'NOT EXECUTED']:
+                result = STATUS_NOT_EXEC
+                self.report.status(file_id, STATUS_NOT_EXEC, timer_f) # File status NOT_EXEC
+            elif result == STATUS_TIMEOUT or result == 'TIMEOUT':
+                result = STATUS_TIMEOUT
+                self.report.status(file_id, STATUS_TIMEOUT, timer_f) # File status TIMEOUT
+            elif result == STATUS_INVALID or result == 'INVALID':
+                self.report.status(file_id, STATUS_INVALID, timer_f) # File status INVALID
+            else:
+                result = STATUS_FAIL
+                self.report.status(file_id, STATUS_FAIL, timer_f) # File status FAIL
 
-            try:
-                proxy().set_file_variable(self.epName, file_id, '_reason', reason)
-            except Exception:
-                trace = traceback.format_exc()[34:].strip()
-                print('EXCEPTION on sending reason `{}`!'.format(trace))
+            # The status and the reason are sent with the end logs
+            self.report.file_var(file_id, '_reason', reason)
 
 
             # If status is not PASS
@@ -1362,7 +2125,7 @@ class TwisterRunner(object):
                 # If status is FAIL and the file is not Optional and Exit on test fail is ON, CLOSE the EP
                 if not optional_test and self.exit_on_test_fail:
                     print('*ERROR* Mandatory file `{}` did not PASS! Closing the EP!\n\n'.format(filename))
-                    proxy().echo('*ERROR* Mandatory file `{}::{}::{}` did not PASS! Closing the EP!'\
+                    self.report.echo('*ERROR* Mandatory file `{}::{}::{}` did not PASS! Closing the EP!'\
                         ''.format(self.epName, suite_name, filename))
                     self.end_logs(file_id, filename)
                     # Exit the cycle
@@ -1373,7 +2136,7 @@ class TwisterRunner(object):
                     abort_suite = suite_id
                     print('*ERROR* Setup file for suite `{}` did not PASS! \
                     All suite will be ABORTED!\n\n'.format(suite_name))
-                    proxy().echo('*ERROR* Setup file for `{}::{}` returned \
+                    self.report.echo('*ERROR* Setup file for `{}::{}` returned \
                     FAIL! All suite will be ABORTED!'.\
                     format(self.epName, suite_name))
 
@@ -1398,26 +2161,7 @@ class TwisterRunner(object):
 
             #---------------------------------------------------------------------------------------
 
-        print('\n==========================')
-        print('. . . All tests done . . .')
-        print('==========================\n')
-
-
-        del suitesManager
-
-        # Print the final message
-        diff_time = time.time() - glob_time
-
-        try:
-            shutil.rmtree(EP_CACHE)
-            os.makedirs(EP_CACHE)
-        except Exception as exp_err:
-            print('Cannot clean cache! {}'.format(exp_err))
-
-        if PORTABLE:
-            return self.stop(timer_f=diff_time)
-        else:
-            return self.exit(timer_f=diff_time)
+        return None
 
 #
 
@@ -1425,9 +2169,12 @@ def warmup():
     """
     Main function.
     """
-    global EP_CACHE, EP_LOG, PORTABLE, LOGGER
+    global EP_CACHE, EP_LOG, LIB_STORE, PORTABLE, LOGGER
 
     EP_CACHE = TWISTER_PATH + '/.twister_cache/' + EP_NAME
+    LIB_STORE = EP_CACHE + '/lib_store'
+    # The runners and the common library use the cache of this process
+    os.environ['TWISTER_EP_CACHE'] = EP_CACHE
     EP_LOG = '{}/.twister_cache/{}_LIVE.log'.format(TWISTER_PATH, EP_NAME)
 
     # Create the EP folder
@@ -1474,7 +2221,7 @@ def warmup():
         LOGGER = Logger()
     else:
         LOGGER = ThreadedLogger()
-        LOGGER.start()
+    LOGGER.start()
 
     print('EP Debug: Created the logger.\n')
 
@@ -34,6 +34,9 @@ import sys
 import time
 import glob
 import json
+import imp
+import marshal
+import hashlib
 from shutil import copyfile
 
 import subprocess # For running Perl/ Jython
@@ -50,6 +53,44 @@ if not TWISTER_PATH:
 __all__ = ['TCRunTcl', 'TCRunPython', 'TCRunPerl', 'TCRunJava']
 
 
+def ep_cache(epname):
+    """
+    The cache folder of the EP; the worker processes of the EP have their own.
+    """
+    return os.getenv('TWISTER_EP_CACHE') or '{}/.twister_cache/{}'.format(TWISTER_PATH, epname)
+
+
+# Compiled Python tests: file path -> (source SHA1, code object); only the last version is kept
+CODE_CACHE = {}
+# The compiled Python tests are also saved here, for the next runs; one file for each test path
+CODE_CACHE_PATH = '{}/.twister_cache/code_cache'.format(TWISTER_PATH)
+# The compiled tests not used for this many days are deleted
+CODE_CACHE_DAYS = 30
+CODE_CACHE_PRUNED = False
+
+
+def prune_code_cache():
+    """
+    Delete the compiled tests not used for `CODE_CACHE_DAYS`, once for each EP run.
+    """
+    global CODE_CACHE_PRUNED
+    if CODE_CACHE_PRUNED:
+        return
+    CODE_CACHE_PRUNED = True
+    limit = time.time() - CODE_CACHE_DAYS * 86400
+    try:
+        names = os.listdir(CODE_CACHE_PATH)
+    except Exception:
+        return
+    for name in names:
+        fname = CODE_CACHE_PATH + os.sep + name
+        try:
+            if os.path.getmtime(fname) < limit:
+                os.remove(fname)
+        except Exception:
+            pass
+
+
 class TCRunTcl(object):
     """
     TCL runner class.
@@ -72,6 +113,9 @@ class TCRunTcl(object):
         except Exception:
             raise Exception('*ERROR* Cannot create TCL console! Exiting!')
 
+        # Python commands registered in the interpreter: name -> function
+        self.commands = {}
+
         if os.path.exists(os.getcwd()+'/__recomposed.tcl'):
             # Restore all variables and functions
             self.tcl.evalfile(os.getcwd()+'/__recomposed.tcl')
@@ -89,7 +133,7 @@ class TCRunTcl(object):
             os.remove('__recomposed.tcl')
         except Exception:
             pass
-        fnames = '{}/.twister_cache/{}/*.tcl'.format(TWISTER_PATH, self.epname)
+        fnames = ep_cache(self.epname) + '/*.tcl'
         for fname in glob.glob(fnames):
             # print('Cleanup TCL file:', fname)
             try:
@@ -97,6 +141,15 @@ class TCRunTcl(object):
             except Exception:
                 pass
 
+    def _register(self, name, func):
+        '''
+        Create a TCL command, only if it's not already registered
+        in this interpreter, with the same function.
+        '''
+        if self.commands.get(name) is not func:
+            self.tcl.createcommand(name, func)
+            self.commands[name] = func
+
     def _eval(self, str_to_execute, globs={}, params=[]):
         '''
         After executing a TCL statement, the last value will be used
@@ -123,13 +176,16 @@ class TCRunTcl(object):
             self.tcl.eval('set PROPERTIES({}) {}'.format(k_val, v_val))
 
         # Compatibility log message
-        self.tcl.createcommand('logMessage', globs['log_msg'])
+        self._register('logMessage', globs['log_msg'])
 
         # Inject all functions
         for func in globs:
+            # The functions are the same for all the tests of a run
+            if self.commands.get(func) is globs[func]:
+                continue
             # print('DEBUG: Exposing Python command `{}` into TCL...'.format(f))
             if callable(globs[func]):
-                self.tcl.createcommand(func, globs[func])
+                self._register(func, globs[func])
 
         to_execute = '\nset argc %i\n' % len(params) + str_to_execute
         to_execute = 'set argv {%s}\n' % str(params)[1:-1] + to_execute
@@ -230,6 +286,51 @@ class TCRunPython(object):
     epname = ''
     filename = ''
 
+    def __init__(self):
+        self.sources = {} # The sources saved on disk: path -> source
+
+
+    def _compile(self, str_to_execute, fpath):
+        """
+        Compile a test only once for each (content, file name).
+        The code is cached in memory, and as marshal on disk, for the next runs;
+        a new version of the test replaces the old one.
+        """
+        src_hash = hashlib.sha1(str_to_execute).hexdigest()
+        cached = CODE_CACHE.get(fpath)
+        if cached and cached[0] == src_hash:
+            return cached[1]
+
+        prune_code_cache()
+        cpath = '{}/{}.pyc'.format(CODE_CACHE_PATH, hashlib.sha1(fpath).hexdigest())
+        code = None
+        try:
+            with open(cpath, 'rb') as f_p:
+                if f_p.read(4) == imp.get_magic() and f_p.read(40) == src_hash:
+                    code = marshal.load(f_p)
+            # Used now, so it's not deleted with the old files
+            os.utime(cpath, None)
+        except Exception:
+            code = None
+
+        if code is None:
+            code = compile(str_to_execute, fpath, 'exec')
+            try:
+                if not os.path.isdir(CODE_CACHE_PATH):
+                    os.makedirs(CODE_CACHE_PATH)
+                tmp_path = '{}.{}.tmp'.format(cpath, os.getpid())
+                with open(tmp_path, 'wb') as f_p:
+                    f_p.write(imp.get_magic())
+                    f_p.write(src_hash)
+                    marshal.dump(code, f_p)
+                os.rename(tmp_path, cpath)
+            except Exception:
+                pass
+
+        CODE_CACHE[fpath] = (src_hash, code)
+        return code
+
+
     def _eval(self, str_to_execute, globs={}, params=[]):
         """
         Variable `_RESULT` must be injected inside the exec,
@@ -238,25 +339,25 @@ class TCRunPython(object):
         self.epname = globs['EP']
         self.filename = os.path.split(globs['FILE_NAME'])[1]
         params.insert(0, self.filename)
-        fpath = '{}/.twister_cache/{}/{}'.format(TWISTER_PATH, self.epname, self.filename)
+        fpath = ep_cache(self.epname) + os.sep + self.filename
+
+        # The source is saved only for the tracebacks
+        if self.sources.get(fpath) != str_to_execute or not os.path.isfile(fpath):
+            with open(fpath, 'wb') as fname:
+                fname.write(str_to_execute)
+            self.sources[fpath] = str_to_execute
+
+        code = self._compile(str_to_execute, fpath)
 
         # Start injecting inside tests
         globs_copy = dict(globs)
         globs_copy['os'] = os
         globs_copy['sys'] = sys
         globs_copy['time'] = time
+        globs_copy['__file__'] = fpath
+        sys.argv = params
 
-        script_head = """
-__file__ = '{}'
-sys.argv = {}
-""".format(fpath, params)
-
-        fname = open(fpath, 'wb')
-        fname.write(script_head)
-        fname.write(str_to_execute)
-        fname.close()
-
-        execfile(fpath, globs_copy)
+        exec code in globs_copy
 
         # The _RESULT must be injected from within the python script,
         # or the test will default to FAIL
@@ -269,7 +370,7 @@ sys.argv = {}
         """
         On exit, delete all Python files.
         """
-        fnames = '{}/.twister_cache/{}/*.py*'.format(TWISTER_PATH, self.epname)
+        fnames = ep_cache(self.epname) + '/*.py*'
         for fname in glob.glob(fnames):
             # print('Cleanup Python file:', fname)
             try:
@@ -293,7 +394,7 @@ class TCRunPerl(object):
         """
         self.epname = globs['EP']
         self.filename = os.path.split(globs['FILE_NAME'])[1]
-        fdir = '{}/.twister_cache/{}'.format(TWISTER_PATH, self.epname)
+        fdir = ep_cache(self.epname)
         fpath = fdir + os.sep + self.filename
 
         # String begins with #!/usr/bin/perl ?
@@ -446,14 +547,14 @@ class TCRunJava(object):
 
             copyfile(os.path.join(TWISTER_PATH,\
             'common/jython/jythonExternalVariableClass.jpy'),\
-            '{0}/.twister_cache/{1}/ce_libs/jythonExternalVariableClass.py'.\
-            format(TWISTER_PATH, self.epname))
+            '{0}/ce_libs/jythonExternalVariableClass.py'.\
+            format(ep_cache(self.epname)))
 
             copyfile(os.path.join(TWISTER_PATH, 'common/jython/tscJython.jar'),\
-            '{0}/.twister_cache/{1}/ce_libs/tscJython.jar'.\
-            format(TWISTER_PATH, self.epname))
-            tsc_jython_path = '{0}/.twister_cache/{1}/ce_libs/tscJython.jar'.\
-            format(TWISTER_PATH, self.epname)
+            '{0}/ce_libs/tscJython.jar'.\
+            format(ep_cache(self.epname)))
+            tsc_jython_path = '{0}/ce_libs/tscJython.jar'.\
+            format(ep_cache(self.epname))
         except Exception as exp_err:
             print 'Error: Compiler path not found'
             print 'Error: {}'.format(exp_err)
@@ -461,7 +562,7 @@ class TCRunJava(object):
 
         # create test
         file_name = os.path.split(globs['FILE_NAME'])[1]
-        files_path = '{}/.twister_cache/{}'.format(TWISTER_PATH, self.epname)
+        files_path = ep_cache(self.epname)
         file_path = os.path.join(files_path, file_name)
 
         with open(file_path, 'wb') as fname:
@@ -496,7 +597,7 @@ class TCRunJava(object):
         """
         On exit, cleanup.
         """
-        file_names = '{}/.twister_cache/{}/*.java*'.format(TWISTER_PATH, self.epname)
+        file_names = ep_cache(self.epname) + '/*.java*'
         for file_path in glob.glob(file_names):
             # print('Cleanup Java file:',' file_path)
             try:
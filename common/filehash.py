@@ -0,0 +1,77 @@
+
+# File: filehash.py ; This file is part of Twister.
+
+# version: 3.001
+
+# Copyright (C) 2012-2014 , Luxoft
+
+# Authors:
+#    Andrei Costachi <acostachi@luxoft.com>
+#    Cristi Constantin <crconstantin@luxoft.com>
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+SHA1 of the library files, used by the Central Engine and by the User Service.\n
+This module doesn't import anything from Twister, so the User Service
+can import it without the Central Engine logging.
+"""
+
+import os
+import hashlib
+import threading
+
+# Hashes of the library files: path -> ((mtime, size), sha1)
+HASH_CACHE = {}
+HASH_LOCK = threading.Lock()
+
+
+def file_hash(fpath, fstat):
+    """
+    The SHA1 of one file, calculated again only if the file changed.
+    """
+    f_key = (fstat.st_mtime, fstat.st_size)
+    cached = HASH_CACHE.get(fpath)
+    if cached and cached[0] == f_key:
+        return cached[1]
+    digest = hashlib.sha1()
+    with open(fpath, 'rb') as f_p:
+        for fdata in iter(lambda: f_p.read(1024*1024), ''):
+            digest.update(fdata)
+    digest = digest.hexdigest()
+    with HASH_LOCK:
+        HASH_CACHE[fpath] = (f_key, digest)
+    return digest
+
+
+def file_hashes(fpath, root):
+    """
+    The SHA1 of one file, or of all the files from one folder, recursively.
+    Returns a tuple of (path relative to `root`, sha1, size).
+    """
+    root = root.rstrip('/') + '/'
+    if os.path.isfile(fpath):
+        paths = [fpath]
+    else:
+        paths = []
+        for dirpath, _, fnames in os.walk(fpath):
+            paths.extend([dirpath + '/' + fname for fname in fnames])
+    result = []
+    for l_file in sorted(paths):
+        fstat = os.stat(l_file)
+        rel_path = l_file[len(root):] if l_file.startswith(root) else os.path.basename(l_file)
+        result.append((rel_path, file_hash(l_file, fstat), fstat.st_size))
+    return tuple(result)
+
+
+# Eof()
@@ -41,40 +41,170 @@ class SuitesManager(OrderedDict):
     a lot of suites with subsuites that contain other subsuites.
     All this structure must allow files execution in order.
     This class is common for Central Engine and Execution Process!
+
+    The manager keeps an index of ID -> node, a map of ID -> parent ID
+    and the ordered lists of suite and file IDs, so lookups don't have
+    to walk the tree. The top level nodes are indexed automatically;
+    nodes added or removed deeper in the tree must use `add_node` and
+    `del_node`, or call `reindex` after changing the children directly.
     """
 
-    def _recursive_find_suites(self, nodes, result=[]):
-        """ search suites in recursive mode """
-        # Nodes are Ordered Dicts
-        for n_id, node in nodes.iteritems():
-            if node.get('type', 'file') != 'suite':
-                continue
-            result.append(n_id)
-            ids = self._recursive_find_suites(node['children'], [])
-            result.extend(ids)
-        return result
+    def __init__(self, *args, **kwds):
+        # The index must exist before OrderedDict calls __setitem__
+        self._index = {}
+        self._parents = {}
+        self._suite_ids = None
+        self._file_ids = None
+        OrderedDict.__init__(self, *args, **kwds)
 
 
-    def get_suites(self):
+    def __reduce__(self):
         """
-        Returns a list of suite IDs.
+        Pickle only the ordered items, like a plain OrderedDict.
+        The index is rebuilt on the other side, when the items are
+        inserted back, so the EP receives the same data as before.
         """
-        # Must pass a null result as default parameter!
-        result = self._recursive_find_suites(self, [])
-        return result
+        items = [[k, self[k]] for k in self]
+        return (self.__class__, (items,))
 
 
-    def _recursive_find_files(self, nodes, result=[]):
-        """ search for files recursive mode """
-        # Nodes are Ordered Dicts
-        for n_id, node in nodes.iteritems():
-            # This is a file
-            if node.get('type', 'file') == 'file':
-                result.append(n_id)
-            # This is a suite
+    def __setitem__(self, key, value, dict_setitem=dict.__setitem__):
+        if key in self:
+            self._unindex(key)
+        OrderedDict.__setitem__(self, key, value, dict_setitem)
+        self._index_node(key, value, None)
+        self._invalidate()
+
+
+    def __delitem__(self, key, dict_delitem=dict.__delitem__):
+        OrderedDict.__delitem__(self, key, dict_delitem)
+        self._unindex(key)
+        self._invalidate()
+
+
+    def clear(self):
+        OrderedDict.clear(self)
+        self._index = {}
+        self._parents = {}
+        self._invalidate()
+
+
+    def _invalidate(self):
+        """ the ordered lists must be re-created """
+        self._suite_ids = None
+        self._file_ids = None
+
+
+    def _index_node(self, node_id, node, parent_id):
+        """ add one node and all the sub-nodes in the index """
+        self._index[node_id] = node
+        self._parents[node_id] = parent_id
+        if node.get('type', 'file') == 'suite':
+            for n_id, child in node['children'].iteritems():
+                self._index_node(n_id, child, node_id)
+
+
+    def _unindex(self, node_id):
+        """ remove one node and all the sub-nodes from the index """
+        node = self._index.pop(node_id, None)
+        self._parents.pop(node_id, None)
+        if node and node.get('type', 'file') == 'suite':
+            for n_id in node['children']:
+                self._unindex(n_id)
+
+
+    def reindex(self):
+        """
+        Re-create the index from scratch.
+        Must be called after changing the children of a suite directly.
+        """
+        self._index = {}
+        self._parents = {}
+        for n_id, node in self.iteritems():
+            self._index_node(n_id, node, None)
+        self._invalidate()
+
+
+    def add_node(self, parent_id, node_id, node):
+        """
+        Add a suite or a file at the end of a suite.
+        If the parent ID is null, the node is added at the top level.
+        """
+        if not parent_id:
+            self[node_id] = node
+            return True
+        parent = self._index.get(parent_id)
+        if not parent or parent.get('type', 'file') != 'suite':
+            return False
+        if node_id in parent['children']:
+            self._unindex(node_id)
+        parent['children'][node_id] = node
+        self._index_node(node_id, node, parent_id)
+        self._invalidate()
+        return True
+
+
+    def del_node(self, node_id):
+        """
+        Remove a suite or a file, from any level.
+        Returns the removed node, or None.
+        """
+        if node_id not in self._index:
+            return None
+        parent_id = self._parents[node_id]
+        if parent_id is None:
+            node = self[node_id]
+            del self[node_id]
+            return node
+        node = self._index[parent_id]['children'].pop(node_id)
+        self._unindex(node_id)
+        self._invalidate()
+        return node
+
+
+    def get_parent(self, node_id):
+        """
+        Returns the ID of the parent suite, or None for top level nodes.
+        """
+        return self._parents.get(node_id)
+
+
+    def is_suite(self, node_id):
+        """
+        True if the ID belongs to a suite.
+        """
+        node = self._index.get(node_id)
+        return node is not None and node.get('type', 'file') == 'suite'
+
+
+    def is_file(self, node_id):
+        """
+        True if the ID belongs to a file.
+        """
+        node = self._index.get(node_id)
+        return node is not None and node.get('type', 'file') == 'file'
+
+
+    def _build_lists(self):
+        """ create the ordered lists of suite IDs and file IDs """
+        suites = []
+        files = []
+        for n_id, node in self.iter_nodes(None, []):
+            if node.get('type', 'file') == 'suite':
+                suites.append(n_id)
             else:
-                self._recursive_find_files(node['children'], result)
-        return result
+                files.append(n_id)
+        self._suite_ids = suites
+        self._file_ids = files
+
+
+    def get_suites(self):
+        """
+        Returns a list of suite IDs.
+        """
+        if self._suite_ids is None:
+            self._build_lists()
+        return list(self._suite_ids)
 
 
     def get_files(self, suite_id=None, recursive=True):
@@ -82,30 +212,27 @@ class SuitesManager(OrderedDict):
         Returns a list of file IDs. Can filter for one suite.
         """
         if suite_id:
-            suite = self.find_id(suite_id, self)
-            if not suite:
+            if not self.is_suite(suite_id):
                 return []
-            if recursive:
-                # Must pass a null result as default parameter!
-                return self._recursive_find_files(suite['children'], [])
-            else:
-                result = []
-                for n_id, node in suite['children'].iteritems():
-                    # This is a file
-                    if node.get('type', 'file') == 'file':
-                        result.append(n_id)
-                return result
+            nodes = self._index[suite_id]['children']
+        elif recursive:
+            if self._file_ids is None:
+                self._build_lists()
+            return list(self._file_ids)
         else:
-            if recursive:
-                # Must pass a null result as default parameter!
-                return self._recursive_find_files(self, [])
-            else:
-                result = []
-                for n_id, node in self.iteritems():
-                    # This is a file
-                    if node.get('type', 'file') == 'file':
-                        result.append(n_id)
-                return result
+            nodes = self
+
+        result = []
+        if recursive:
+            for n_id, node in self.iter_nodes(nodes, []):
+                if node.get('type', 'file') == 'file':
+                    result.append(n_id)
+        else:
+            for n_id, node in nodes.iteritems():
+                # This is a file
+                if node.get('type', 'file') == 'file':
+                    result.append(n_id)
+        return result
 
 
     def iter_nodes(self, nodes=None, result=[]):
@@ -113,7 +240,7 @@ class SuitesManager(OrderedDict):
         Depth iterate through suites and files.
         This is used by the Execution Runner.
         """
-        if not nodes:
+        if nodes is None:
             nodes = self
         for n_id, node in nodes.iteritems():
             result.append([n_id, node])
@@ -126,8 +253,8 @@ class SuitesManager(OrderedDict):
         """
         Find a node, using the ID.
         """
-        if not nodes:
-            nodes = self
+        if nodes is None or nodes is self:
+            return self._index.get(node_id)
         if _found:
             return _found
         for n_id, node in nodes.iteritems():
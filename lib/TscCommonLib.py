@@ -131,7 +131,9 @@ class TscCommonLib(object):
     def _reload_libs(self):
         """ Internal function. Reload libraries. """
         from common import iniparser
-        ce_path = '{}/.twister_cache/{}/ce_libs/ce_libs.py'.format(TWISTER_PATH, self.epName)
+        # The worker processes of the EP have their own cache
+        ep_cache = os.getenv('TWISTER_EP_CACHE') or '{}/.twister_cache/{}'.format(TWISTER_PATH, self.epName)
+        ce_path = '{}/ce_libs/ce_libs.py'.format(ep_cache)
         cfg = iniparser.ConfigObj(ce_path)
         for n, v in cfg.iteritems():
             setattr(self, '_' + n, v)
@@ -426,6 +428,27 @@ class TscCommonLib(object):
         return config_data.get(component_name, False)
 
 
+    def get_bind_ids(self, component_names, test_config='default_binding'):
+        """
+        Function to get the config -> SUT binding IDs of many components.
+        The bindings are read only once.
+        Returns a dictionary: component -> ID.
+        """
+        bindings = copy.deepcopy(self.ce_proxy.get_user_variable('bindings')) or {}
+        if not test_config:
+            test_config = 'default_binding'
+        config_data = bindings.get(test_config, {})
+        default_data = bindings.get('default_binding', {})
+        result = {}
+        for component_name in component_names:
+            # If the component cannot be found in the requested config, search in default config
+            if component_name in config_data:
+                result[component_name] = config_data[component_name]
+            else:
+                result[component_name] = default_data.get(component_name, False)
+        return result
+
+
     def get_bind_name(self, component_name, test_config='default_binding'):
         """
         Function to get a cfg -> SUT binding name.
@@ -597,6 +620,31 @@ class TscCommonLib(object):
         return self.get_tb(query, dtype)
 
 
+    def get_tbs(self, queries, dtype=unicode):
+        """
+        Get the content of many TBs, or TB components, with one call.
+        Returns a dictionary: query -> content.
+        """
+        try:
+            data = self.ce_proxy.get_tbs(tuple(queries))
+            # Copy the result locally, so reading it doesn't call the CE again
+            data = copy.deepcopy(data)
+            if dtype == str:
+                return self._encode_unicode(data)
+            else:
+                return data
+        except Exception as e:
+            print('Error on get Resources! `{}`!'.format(e))
+            return None
+
+
+    def get_resources(self, queries, dtype=unicode):
+        """
+        Get the content of many TBs. Alias function for `get_tbs`.
+        """
+        return self.get_tbs(queries, dtype)
+
+
     def create_new_tb(self, name, parent='/', props={}):
         """
         Update a TB.
@@ -630,6 +678,18 @@ class TscCommonLib(object):
             return None
 
 
+    def update_meta_tbs(self, updates):
+        """
+        Update many TB components, with one call.
+        updates : dictionary: path -> props
+        """
+        try:
+            return copy.deepcopy(self.ce_proxy.update_meta_tbs(dict(updates)))
+        except Exception as e:
+            print('Error on update Resources! `{}`!'.format(e))
+            return None
+
+
     def set_tb(self, name, parent='/', props={}):
         """
         Update a TB. High level function.
@@ -705,6 +765,23 @@ class TscCommonLib(object):
             return None
 
 
+    def get_suts(self, queries, follow_links=False, dtype=unicode):
+        """
+        Get the content of many SUTs, or SUT components, with one call.
+        Returns a dictionary: query -> content.
+        """
+        try:
+            data = self.ce_proxy.get_suts(tuple(queries), follow_links)
+            data = copy.deepcopy(data)
+            if dtype == str:
+                return self._encode_unicode(data)
+            else:
+                return data
+        except Exception as e:
+            print('Error on get SUTs! `{}`!'.format(e))
+            return None
+
+
     def get_info_sut(self, query):
         """
         Get SUT info.
@@ -749,6 +826,18 @@ class TscCommonLib(object):
             return None
 
 
+    def update_meta_suts(self, updates):
+        """
+        Update many SUT components, with one call.
+        updates : dictionary: path -> props
+        """
+        try:
+            return copy.deepcopy(self.ce_proxy.update_meta_suts(dict(updates)))
+        except Exception as e:
+            print('Error on update SUTs! `{}`!'.format(e))
+            return None
+
+
     def set_sut(self, name, parent='/', props={}):
         """
         Update a SUT.
@@ -804,6 +893,18 @@ class TscCommonLib(object):
             return None
 
 
+    def reserve_tbs(self, queries):
+        """
+        Reserve many resources, with one call.
+        Returns a dictionary: query -> result.
+        """
+        try:
+            return copy.deepcopy(self.ce_proxy.reserve_tbs(tuple(queries)))
+        except Exception as e:
+            print('Error on reserve resources! `{}`!'.format(e))
+            return None
+
+
     def save_reserved_tb(self, query):
         """
         Save changes. Don't release.
@@ -848,6 +949,18 @@ class TscCommonLib(object):
             return None
 
 
+    def reserve_suts(self, queries):
+        """
+        Reserve many SUTs, with one call.
+        Returns a dictionary: query -> result.
+        """
+        try:
+            return copy.deepcopy(self.ce_proxy.reserve_suts(tuple(queries)))
+        except Exception as e:
+            print('Error on reserve SUTs! `{}`!'.format(e))
+            return None
+
+
     def save_reserved_sut(self, query):
         """
         Save changes. Don't release.
@@ -29,6 +29,8 @@ import os
 import sys
 import ast
 import copy
+import time
+import threading
 
 import cherrypy
 from binascii import hexlify
@@ -42,6 +44,87 @@ if TWISTER_PATH not in sys.path:
 
 from common.tsclogging import logFull, logDebug, logError
 
+# The changes are written on the disk after no other change came for SAVE_DELAY seconds,
+# but not later than SAVE_MAX_DELAY seconds after the first change
+SAVE_DELAY = 0.5
+SAVE_MAX_DELAY = 5.0
+
+
+class RWLock(object):
+    """
+    Readers / writer lock: many readers at the same time, or one writer.
+    A waiting writer stops the new readers, so the writers don't starve.
+    A thread can read again while reading (eg: the batch functions).
+    Use it as: `with rw_lock.read:` or `with rw_lock.write:`.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting = 0
+        self._owners = {} # Thread ID -> nested reads
+        self.read = _LockSide(self.acquire_read, self.release_read)
+        self.write = _LockSide(self.acquire_write, self.release_write)
+
+
+    def acquire_read(self):
+        """ Wait until there is no writer, then read. A thread that is already reading doesn't wait. """
+        me = threading.current_thread().ident
+        with self._cond:
+            if not self._owners.get(me):
+                while self._writer or self._waiting:
+                    self._cond.wait()
+            self._owners[me] = self._owners.get(me, 0) + 1
+            self._readers += 1
+
+
+    def release_read(self):
+        """ Done reading. """
+        me = threading.current_thread().ident
+        with self._cond:
+            self._owners[me] -= 1
+            if not self._owners[me]:
+                del self._owners[me]
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+
+    def acquire_write(self):
+        """ Wait until there are no readers and no writer, then write. """
+        with self._cond:
+            self._waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writer = True
+
+
+    def release_write(self):
+        """ Done writing. """
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+
+class _LockSide(object):
+    """
+    One side of the RWLock, usable in a `with` statement.
+    """
+
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+
+    def __enter__(self):
+        self._acquire()
+
+
+    def __exit__(self, *args):
+        self._release()
+
 #
 
 class CommonAllocator(object):
@@ -60,6 +143,17 @@ class CommonAllocator(object):
         self.imp_lock = None
         self.save_lock = None
         self.load_lock = None
+        self.idx_lock = None
+        self.res_index = dict()
+        self.idx_tops = dict()
+        self.idx_root = None
+        self.idx_version = 0
+        self.res_version = 0
+        self.tree_lock = None
+        self.top_locks = dict()
+        self.pending = dict()
+        self.pend_lock = None
+        self.save_thread = None
 
 
     def user_info(self, props={}):
@@ -85,6 +179,105 @@ class CommonAllocator(object):
         return [user_roles.get('user'), user_roles]
 
 
+    # # #    Persistence    # # #
+
+
+    def save_later(self, key, data=None):
+        """
+        Mark one resource file as changed.
+        A burst of changes is written only once, by the save thread,
+        or when somebody needs the file (flush).
+        """
+        now = time.time()
+        with self.pend_lock:
+            pending = self.pending.get(key)
+            if not pending:
+                pending = {'data': set(), 'time': now, 'first': now}
+                self.pending[key] = pending
+            pending['data'].add(data)
+            pending['time'] = now
+
+            if not self.save_thread:
+                self.save_thread = threading.Thread(target=self._save_writer)
+                self.save_thread.daemon = True
+                self.save_thread.start()
+        return True
+
+
+    def drop_pending(self, key):
+        """
+        Forget the pending changes of one resource file (eg: the file is deleted).
+        """
+        with self.save_lock:
+            with self.pend_lock:
+                self.pending.pop(key, None)
+
+
+    def flush(self, key=None):
+        """
+        Write the pending changes of one resource file, or of all the files.
+        """
+        # Nothing pending and nothing being written; the readers don't wait for the save lock
+        with self.pend_lock:
+            if key is None:
+                nothing = not self.pending
+            else:
+                nothing = key not in self.pending
+        if nothing and not self.save_lock.locked():
+            return True
+
+        success = True
+        with self.save_lock:
+            with self.pend_lock:
+                if key is None:
+                    items = self.pending.items()
+                    self.pending.clear()
+                elif key in self.pending:
+                    items = [(key, self.pending.pop(key))]
+                else:
+                    items = []
+
+            for r_key, pending in items:
+                try:
+                    ret = self._write(r_key, pending['data'])
+                except Exception as exp_err:
+                    ret = '*ERROR* {}'.format(exp_err)
+                if ret is not True:
+                    logError('CeCommonAllocator: Cannot save `{}`: {}'.format(r_key, ret))
+                    success = False
+                    # Put the changes back, so the save thread tries again
+                    with self.pend_lock:
+                        newer = self.pending.get(r_key)
+                        if newer:
+                            pending['data'].update(newer['data'])
+                            pending['time'] = newer['time']
+                        self.pending[r_key] = pending
+
+        return success
+
+
+    def _write(self, key, data):
+        """
+        Write one resource file. Must be implemented by TestBeds and SUTs.
+        This function is called with the save lock!
+        """
+        raise NotImplementedError
+
+
+    def _save_writer(self):
+        """
+        Thread that writes the resource files, when the changes settle down.
+        """
+        while 1:
+            time.sleep(SAVE_DELAY / 2)
+            now = time.time()
+            with self.pend_lock:
+                keys = [key for key, pending in self.pending.iteritems() \
+                    if now - pending['time'] >= SAVE_DELAY or now - pending['first'] >= SAVE_MAX_DELAY]
+            for key in keys:
+                self.flush(key)
+
+
     def fix_path(self, res, path=[], modified=False):
         """
         Add path to resources that does not have this field.
@@ -111,10 +304,97 @@ class CommonAllocator(object):
         return modified
 
 
-    def get_id(self, node_id, resource):
+    @staticmethod
+    def _index_node(node, path, ids, index):
         """
-        This method searches in resource for node_id and returns its dictionary.
-        Also, in the path key we save the complete path from root to this node_id.
+        Add the IDs of a node and of all its children in an ID index.
+        """
+        stack = [(node, path)]
+        while stack:
+            node, path = stack.pop()
+            if not isinstance(node, dict):
+                continue
+            if node.get('id'):
+                index[node['id']] = path
+                ids.add(node['id'])
+            if isinstance(node.get('children'), dict):
+                for name, child in node['children'].iteritems():
+                    stack.append((child, path + (name,)))
+        return ids
+
+
+    def _sync_index(self):
+        """
+        Keep the ID index in sync with the resources.
+        The top level resources that were created, replaced (saved, or imported),
+        renamed or deleted since the last call are indexed again; a new resources
+        dictionary (loaded from the disk) is indexed from scratch.
+        This function must be called with the index lock!
+        """
+        resources = self.resources
+        version = self.res_version
+        if self.idx_root is resources and self.idx_version == version:
+            return
+
+        children = resources.get('children')
+        if not isinstance(children, dict):
+            children = {}
+
+        # A new index is built aside, the readers use the old one meanwhile
+        if self.idx_root is not resources:
+            index = {}
+            tops = {}
+            for name, node in children.items():
+                tops[name] = (node, self._index_node(node, (name,), set(), index))
+            self.res_index = index
+            self.idx_tops = tops
+            self.idx_root = resources
+            self.idx_version = version
+            return
+
+        for name, (node, ids) in self.idx_tops.items():
+            if children.get(name) is node:
+                continue
+            for node_id in ids:
+                path = self.res_index.get(node_id)
+                if path and path[0] == name:
+                    del self.res_index[node_id]
+            del self.idx_tops[name]
+
+        for name, node in children.items():
+            if name not in self.idx_tops:
+                self.idx_tops[name] = (node, self._index_node(node, (name,), set(), self.res_index))
+
+        self.idx_version = version
+
+
+    def tree_changed(self):
+        """
+        Must be called after a top level resource is created, replaced, renamed, or deleted.
+        The readers don't check the resources for changes, until this is called.
+        """
+        self.res_version += 1
+
+
+    def replace_top(self, old_name, new_name, node):
+        """
+        Replace one top level resource, maybe renamed.
+        The top level is not changed in place: the new one is built aside and swapped
+        in one assignment, so the readers find the old resource, or the new one.
+        """
+        node['path'] = [new_name]
+        with self.acc_lock:
+            children = copy.copy(self.resources['children'])
+            if old_name != new_name:
+                children.pop(old_name, None)
+            children[new_name] = node
+            self.resources['children'] = children
+        self.tree_changed()
+
+
+    def _find_id(self, node_id, resource):
+        """
+        Walk the resource, searching for node_id.
         """
         if not resource:
             return None
@@ -126,12 +406,89 @@ class CommonAllocator(object):
             return None
 
         for node in resource.get('children'):
-            result = self.get_id(node_id, resource['children'][node])
+            result = self._find_id(node_id, resource['children'][node])
 
             if result:
                 return result
 
 
+    def get_id(self, node_id, resource):
+        """
+        This method searches in resource for node_id and returns its dictionary.
+        Also, in the path key we save the complete path from root to this node_id.
+        The main resources are searched in the ID index; the other resources
+        (eg: the reserved copies) are searched node by node.
+        """
+        if not resource:
+            return None
+
+        if resource is not self.resources:
+            return self._find_id(node_id, resource)
+
+        # The readers don't lock, while the index is up to date
+        if self.idx_root is not resource or self.idx_version != self.res_version:
+            with self.idx_lock:
+                self._sync_index()
+        path = self.res_index.get(node_id)
+
+        if path is not None:
+            node = resource
+            for part in path:
+                node = (node.get('children') or {}).get(part)
+                if not isinstance(node, dict):
+                    break
+            if isinstance(node, dict) and node.get('id') == node_id:
+                return node
+
+        # Some node was changed in place; index everything again, next time
+        result = self._find_id(node_id, resource)
+        if result:
+            with self.idx_lock:
+                self.idx_root = None
+        return result
+
+
+    def root_id(self, res_query):
+        """
+        The ID of the top level resource (TB or SUT) that contains a path or an ID.
+        """
+        res_query = res_query.split(':')[0]
+
+        if '/' in res_query:
+            parts = [q for q in res_query.split('/') if q]
+            if not parts:
+                return None
+            node = self.resources.get('children', {}).get(parts[0])
+            if isinstance(node, dict) and node.get('id'):
+                return node['id']
+            return parts[0]
+
+        node = self.get_id(res_query, self.resources)
+        if node:
+            path = self.res_index.get(res_query) or node.get('path')
+            if path:
+                top = self.resources['children'].get(path[0])
+                if isinstance(top, dict) and top.get('id'):
+                    return top['id']
+
+        # Maybe it's a component that is not saved yet
+        for user_res in self.reservedResources.values():
+            for res_id, res_node in user_res.items():
+                if self._find_id(res_query, res_node):
+                    return res_id
+
+        return res_query
+
+
+    def top_lock(self, res_query):
+        """
+        The write lock of the top level resource (TB or SUT) that contains a path or an ID.
+        The changes on different TBs, or SUTs, don't wait for each other.
+        The lock is re-entrant, so the batch functions can call the single functions.
+        """
+        return self.top_locks.setdefault(self.root_id(res_query), threading.RLock())
+
+
     def get_path(self, query, resource):
         """
         This method searches in resource for a path (query) and returns its dictionary.
@@ -247,14 +604,13 @@ class CommonAllocator(object):
         Generate index when creating a new sut, or test bed.
         """
         logDebug('CeCommonAllocator: generate_index')
-        new_sut_id = False
-
-        while not new_sut_id:
-            new_sut_id = hexlify(os.urandom(5))
-            # If by any chance, this ID already exists, generate another one!
-            exists_id = self.get_id(new_sut_id, self.resources)
-            if exists_id:
-                new_sut_id = False
+        with self.idx_lock:
+            self._sync_index()
+            while 1:
+                new_sut_id = hexlify(os.urandom(5))
+                # If by any chance, this ID already exists, generate another one!
+                if new_sut_id not in self.res_index:
+                    break
 
         return new_sut_id
 
@@ -303,7 +659,8 @@ class CommonAllocator(object):
         if ':' in res_query:
             res_query = res_query.split(':')[0]
 
-        with self.acc_lock:
+        # Only the TB or SUT of this resource is locked
+        with self.tree_lock.read, self.top_lock(res_query):
             # verify if the resource is locked by other user
             _is_res_locked = self.is_resource_locked(res_query)
             if _is_res_locked:
@@ -362,10 +719,9 @@ class CommonAllocator(object):
                         return '*ERROR* ' + msg
 
             #adding the resource to reservedResources dictionary
-            if user_info[0] in self.reservedResources:
-                self.reservedResources[user_info[0]].update([(node_path['id'], copy.deepcopy(node_path)), ])
-            else:
-                self.reservedResources.update([(user_info[0], {node_path['id']: copy.deepcopy(node_path)}), ])
+            node_copy = copy.deepcopy(node_path)
+            with self.acc_lock:
+                self.reservedResources.setdefault(user_info[0], {})[node_path['id']] = node_copy
         if source == 'rpyc':
             return (True, 'NO_ERROR')
         else:
@@ -482,7 +838,8 @@ class CommonAllocator(object):
         if ':' in res_query:
             res_query = res_query.split(':')[0]
 
-        with self.acc_lock:
+        # Only the TB or SUT of this resource is locked
+        with self.tree_lock.read, self.top_lock(res_query):
 
             # verify if the resource is locked by other user
             _is_res_locked = self.is_resource_locked(res_query)
@@ -521,9 +878,9 @@ class CommonAllocator(object):
                     logError(msg)
                     return '*ERROR* ' + msg
 
-            user_res = self.lockedResources.get(user_info[0], {})
-            user_res.update({node['id']: copy.deepcopy(node)})
-            self.lockedResources[user_info[0]] = user_res
+            node_copy = copy.deepcopy(node)
+            with self.acc_lock:
+                self.lockedResources.setdefault(user_info[0], {})[node['id']] = node_copy
 
         return True
 
@@ -633,15 +990,101 @@ class CommonAllocator(object):
                     return False
                 node_id = node['id']
             # Delete the entry from reserved dict
-            try:
-                self.reservedResources[user].pop(node_id)
-                if not self.reservedResources[user]:
-                    self.reservedResources.pop(user)
-            except Exception as exp_err:
-                logError('CeCommonAllocator:discard_release_reserved_resource: `{}` for user {}!'.format(exp_err, user))
-                return False
+            with self.acc_lock:
+                try:
+                    self.reservedResources[user].pop(node_id)
+                    if not self.reservedResources[user]:
+                        self.reservedResources.pop(user)
+                except Exception as exp_err:
+                    logError('CeCommonAllocator:discard_release_reserved_resource: `{}` for user {}!'.format(exp_err, user))
+                    return False
 
         return True #RESOURCE_FREE
 
 
+    # # #    Batch    # # #
+
+
+    def get_resources(self, queries, props={}):
+        """
+        Get many TBs, or SUTs, or components, at once.
+        The pending changes are written and the tree is locked only once.
+        Returns a dictionary: query -> the result of `get_tb` or `get_sut`.
+        """
+        logDebug('CeCommonAllocator:get_resources {} queries {}'.format(len(queries), self.type.upper()))
+        get_one = getattr(self, 'get_' + self.type)
+        results = {}
+
+        self.flush()
+        with self.tree_lock.read:
+            for query in queries:
+                try:
+                    results[query] = get_one(query, dict(props))
+                except Exception as exp_err:
+                    results[query] = '*ERROR* Cannot get `{}`: {}'.format(query, exp_err)
+
+        return results
+
+
+    def update_meta_many(self, updates, props={}):
+        """
+        Update the meta of many components, from a dictionary: path -> meta.
+        The components of the same TB, or SUT, are updated under one lock,
+        and the changes are written only once, at the end.
+        Returns a dictionary: path -> the result of `update_meta_tb` or `update_meta_sut`.
+        """
+        logDebug('CeCommonAllocator:update_meta_many {} paths {}'.format(len(updates), self.type.upper()))
+        update_one = getattr(self, 'update_meta_' + self.type)
+        results = {}
+        groups = {}
+
+        with self.tree_lock.read:
+            # Group the components by TB, or SUT
+            for path, meta in updates.iteritems():
+                parts = [p for p in path.split('/') if p]
+                if len(parts) > 1:
+                    parent = '/' + '/'.join(parts[:-1])
+                    name = parts[-1]
+                    verify = parent
+                else:
+                    parent = '/'
+                    name = parts[0] if parts else '/'
+                    verify = '/' + name
+                group = groups.setdefault(self.root_id(verify), (verify, []))
+                group[1].append((path, name, parent, meta))
+
+            for verify, items in groups.values():
+                with self.top_lock(verify):
+                    for path, name, parent, meta in items:
+                        meta = dict(meta or {})
+                        if props.get('__user'):
+                            meta['__user'] = props['__user']
+                        try:
+                            results[path] = update_one(name, parent, meta)
+                        except Exception as exp_err:
+                            results[path] = '*ERROR* Cannot update `{}`: {}'.format(path, exp_err)
+
+        self.flush()
+        return results
+
+
+    def reserve_many(self, queries, props={}):
+        """
+        Reserve many TBs, or SUTs, at once, under one lock.
+        Returns a dictionary: query -> the result of `reserve_tb` or `reserve_sut`.
+        """
+        logDebug('CeCommonAllocator:reserve_many {} queries {}'.format(len(queries), self.type.upper()))
+        reserve_one = getattr(self, 'reserve_' + self.type)
+        results = {}
+
+        with self.tree_lock.read:
+            for query in queries:
+                try:
+                    results[query] = reserve_one(query, dict(props))
+                except Exception as exp_err:
+                    results[query] = '*ERROR* Cannot reserve `{}`: {}'.format(query, exp_err)
+
+        return results
+
+
 # Eof()
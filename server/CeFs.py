@@ -29,9 +29,14 @@ Local file system; used to help workign with files where user is owner
 import os, sys
 import time
 import copy
-import random
+import select
 import socket
+import stat
+import itertools
+import zlib
 import subprocess
+import threading
+from thread import allocate_lock, start_new_thread
 from plumbum import local
 import rpyc
 import pwd
@@ -39,6 +44,19 @@ import grp
 
 socket.setdefaulttimeout(3)
 
+# The appends for one file are written when they reach this size, or this age
+APPEND_MAX_SIZE = 256 * 1024
+APPEND_MAX_DELAY = 0.5
+
+# Connections for each User Service, for read and for write
+SERVICE_POOL_SIZE = 2
+# The User Service connections are checked after this many seconds
+SERVICE_TTL = 10.0
+# Max time to wait for a new User Service
+SERVICE_START_TIMEOUT = 10.0
+# Size of one chunk, for the chunked reads
+MAX_CHUNK = 4 * 1024 * 1024
+
 TWISTER_PATH = os.getenv('TWISTER_PATH')
 if not TWISTER_PATH:
     print '$TWISTER_PATH environment variable is not set! Exiting!'
@@ -46,10 +64,151 @@ if not TWISTER_PATH:
 if TWISTER_PATH not in sys.path:
     sys.path.append(TWISTER_PATH)
 
+from common.filehash   import file_hashes
 from common.helpers    import FsBorg, userHome
 from common.tsclogging import logError, logInfo, logWarning, logDebug
 
 
+# The folders are listed again after this many seconds, even if they didn't change
+LIST_CACHE_TTL = 60.0
+# Max number of folders kept in the listing cache
+LIST_CACHE_SIZE = 20000
+
+# Owner names, for the meta info of the listings
+_UID_NAMES = {}
+_GID_NAMES = {}
+# Entries of the listed folders: (path, hidden, accept, reject) -> (mtime, time, folders, files)
+_LIST_CACHE = {}
+_LIST_LOCK = threading.Lock()
+
+
+def _uid_name(uid):
+    """
+    User name for one UID, or the UID if the user is unknown.
+    """
+    if uid not in _UID_NAMES:
+        try:
+            _UID_NAMES[uid] = pwd.getpwuid(uid).pw_name
+        except Exception:
+            _UID_NAMES[uid] = uid
+    return _UID_NAMES[uid]
+
+
+def _gid_name(gid):
+    """
+    Group name for one GID, or the GID if the group is unknown.
+    """
+    if gid not in _GID_NAMES:
+        try:
+            _GID_NAMES[gid] = grp.getgrgid(gid).gr_name
+        except Exception:
+            _GID_NAMES[gid] = gid
+    return _GID_NAMES[gid]
+
+
+def _path_patterns(patterns):
+    """
+    The Accept or Reject patterns, as a tuple, or None if there are no patterns.
+    """
+    if not patterns:
+        return None
+    if isinstance(patterns, basestring):
+        return (patterns,)
+    return tuple(patterns)
+
+
+def _dir_entries(path, hidden, accept, reject):
+    """
+    The sub-folders and the files of one folder, filtered and sorted,
+    as 2 lists of (name, meta info).
+    The entries are listed again only when the folder changes.
+    """
+    try:
+        d_mtime = os.stat(path).st_mtime
+    except Exception as exp_err:
+        logWarning('*WARN* Cannot list folder `{}`: `{}`!'.format(path, exp_err))
+        return [], []
+
+    key = (path, hidden, accept, reject)
+    now = time.time()
+    cached = _LIST_CACHE.get(key)
+    if cached and cached[0] == d_mtime and now - cached[1] < LIST_CACHE_TTL:
+        return cached[2], cached[3]
+
+    try:
+        names = sorted(os.listdir(path), key=str.lower)
+    except Exception as exp_err:
+        logWarning('*WARN* Cannot list folder `{}`: `{}`!'.format(path, exp_err))
+        return [], []
+
+    dlist = [] # Folders list
+    flist = [] # Files list
+
+    for fname in names:
+        # Ignore hidden files
+        if hidden and fname[0] == '.':
+            continue
+        long_path = path + '/' + fname
+        # Only one stat for each entry
+        try:
+            fstat = os.stat(long_path)
+        except Exception:
+            flist.append((fname, ''))
+            continue
+
+        if stat.S_ISDIR(fstat.st_mode):
+            is_folder = True
+        else:
+            is_folder = False
+            if stat.S_ISREG(fstat.st_mode):
+                # If Accept is active and file doesn't match, ignore file
+                if accept and not (long_path.startswith(accept) or long_path.endswith(accept)):
+                    continue
+                # If Reject is active and file matches, ignore the file
+                if reject and (long_path.startswith(reject) or long_path.endswith(reject)):
+                    continue
+
+        meta_info = '{}|{}|{}|{}'.format(_uid_name(fstat.st_uid), _gid_name(fstat.st_gid),
+            fstat.st_size, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(fstat.st_mtime)))
+
+        if is_folder:
+            dlist.append((fname, meta_info))
+        else:
+            flist.append((fname, meta_info))
+
+    with _LIST_LOCK:
+        if len(_LIST_CACHE) >= LIST_CACHE_SIZE:
+            _LIST_CACHE.clear()
+        _LIST_CACHE[key] = (d_mtime, now, dlist, flist)
+
+    return dlist, flist
+
+
+def _list_tree(base_path, path, hidden, recursive, accept, reject):
+    """
+    Create recursive list of folders and files from base path.
+    The format of a node is: {"path": "/..." "data": "name", "folder":true|false, "children": []}
+    The unchanged sub-folders are not listed again; only their mtime is checked.
+    """
+    len_path = len(base_path) + 1
+    folders, files = _dir_entries(path, hidden, accept, reject)
+    dlist = []
+
+    for fname, meta_info in folders:
+        long_path = path + '/' + fname
+        if recursive:
+            children = _list_tree(base_path, long_path, hidden, recursive, accept, reject)
+        else:
+            children = []
+        dlist.append({'path': long_path[len_path:], 'data': fname, 'meta': meta_info,
+            'folder': True, 'children': children})
+
+    # Folders first, files second
+    return dlist + [{'path': (path + '/' + fname)[len_path:], 'data': fname, 'meta': meta_info}
+        for fname, meta_info in files]
+
+
+
 class BaseFS(object):
     """
     Base file system class.
@@ -127,16 +286,16 @@ class BaseFS(object):
             return -1
 
 
-    def read_user_file(self, user, fpath, flag='r', fstart=0):
+    def read_user_file(self, user, fpath, flag='r', fstart=0, flen=0):
         """
-        Read 1 file. Client access via RPyc.
+        Read 1 file, or `flen` bytes from position `fstart`. Client access via RPyc.
         """
         if not fpath:
             return '*ERROR* Empty `fpath` parameter on read file, user `{}`!'.format(user)
         srvr = self._usr_service(user)
         if srvr:
             try:
-                return srvr.root.read_file(fpath, flag, fstart)
+                return srvr.root.read_file(fpath, flag, fstart, flen)
             except Exception as exp_err:
                 err = '*ERROR* Cannot read file `{}`, user `{}`! {}'.format(fpath, user, exp_err)
                 logWarning(err)
@@ -145,6 +304,53 @@ class BaseFS(object):
             return '*ERROR* Cannot access the UserService on read file, user `{}`!'.format(user)
 
 
+    def read_user_chunk(self, user, fpath, fstart=0, flen=MAX_CHUNK, compress=False):
+        """
+        Read a chunk of max `flen` bytes from position `fstart`, in binary mode.
+        If `compress` is True, the chunk travels compressed and it's decompressed here.
+        An empty chunk means the end of the file.
+        """
+        if not fpath:
+            return '*ERROR* Empty `fpath` parameter on read chunk, user `{}`!'.format(user)
+        srvr = self._usr_service(user)
+        if srvr:
+            try:
+                fdata = srvr.root.read_chunk(fpath, fstart, flen, compress)
+                if fdata.startswith('*ERROR*'):
+                    return fdata
+                if compress:
+                    return zlib.decompress(fdata)
+                return fdata
+            except Exception as exp_err:
+                err = '*ERROR* Cannot read chunk from file `{}`, user `{}`! {}'.format(fpath, user, exp_err)
+                logWarning(err)
+                return err
+        else:
+            return '*ERROR* Cannot access the UserService on read chunk, user `{}`!'.format(user)
+
+
+    def iter_user_file(self, user, fpath, fstart=0, flen=0, chunk=MAX_CHUNK, compress=False):
+        """
+        Generator over the chunks of 1 file, from position `fstart`,
+        max `flen` bytes, or until the end of the file if `flen` is 0.
+        Only one chunk is kept in memory at a time.
+        Raises IOError if the file cannot be read.
+        """
+        # Negative means until the end of the file
+        remaining = flen or -1
+        while remaining:
+            size = chunk if remaining < 0 else min(chunk, remaining)
+            fdata = self.read_user_chunk(user, fpath, fstart, size, compress)
+            if fdata.startswith('*ERROR*'):
+                raise IOError(fdata)
+            if not fdata:
+                break
+            fstart += len(fdata)
+            if remaining > 0:
+                remaining -= len(fdata)
+            yield fdata
+
+
     def write_user_file(self, user, fpath, fdata, flag='w'):
         """
         Write 1 file. Client access via RPyc.
@@ -264,6 +470,25 @@ class BaseFS(object):
             return '*ERROR* Cannot access the UserService on tar.gz folder, user `{}`!'.format(user)
 
 
+    def hash_user_files(self, user, fpath, root=''):
+        """
+        The SHA1 of one user file, or of all the files from a user folder.
+        Returns a tuple of (path relative to `root`, sha1, size).
+        """
+        if not fpath:
+            return '*ERROR* Empty `fpath` parameter on hash files, user `{}`!'.format(user)
+        srvr = self._usr_service(user)
+        if srvr:
+            try:
+                return srvr.root.hash_files(fpath, root)
+            except Exception as exp_err:
+                err = '*ERROR* Cannot hash `{}`, user `{}`! {}'.format(fpath, user, exp_err)
+                logWarning(err)
+                return err
+        else:
+            return '*ERROR* Cannot access the UserService on hash files, user `{}`!'.format(user)
+
+
     def detect_libraries(self, user, files):
         """
         Autodetect libraries: parses all the tests and finds the import statements.
@@ -298,9 +523,9 @@ class BaseFS(object):
 
 
     @staticmethod
-    def read_system_file(fpath, flag='r', fstart=0):
+    def read_system_file(fpath, flag='r', fstart=0, flen=0):
         """
-        Read 1 file. ROOT access.
+        Read 1 file, or `flen` bytes from position `fstart`. ROOT access.
         """
         if not fpath:
             return False
@@ -317,7 +542,10 @@ class BaseFS(object):
                 # logDebug('Reading file `{}`, flag `{}`.'.format(fpath, flag))
                 if fstart:
                     file_p.seek(fstart)
-                fdata = file_p.read()
+                if flen:
+                    fdata = file_p.read(flen)
+                else:
+                    fdata = file_p.read()
                 if len(fdata) > 20*1000*1000:
                     err = '*ERROR* File data too long `{}`: {}!'.format(fpath, len(fdata))
                     logWarning(err)
@@ -360,6 +588,37 @@ class BaseFS(object):
             return err
 
 
+    @staticmethod
+    def write_system_file_atomic(fpath, fdata, flag='w'):
+        """
+        Overwrite a file, using a temporary file and a rename,
+        so the file is never left half written. ROOT access.
+        The new file keeps the mode and the owner of the old file.
+        """
+        if flag not in ['w', 'wb']:
+            err = '*ERROR* Invalid flag `{}`! Cannot overwrite!'.format(flag)
+            logWarning(err)
+            return err
+        tmp_path = '{}.{}.tmp'.format(fpath, os.getpid())
+        resp = BaseFS.write_system_file(tmp_path, fdata, flag)
+        try:
+            if resp is True:
+                if os.path.exists(fpath):
+                    fstat = os.stat(fpath)
+                    os.chmod(tmp_path, stat.S_IMODE(fstat.st_mode))
+                    os.chown(tmp_path, fstat.st_uid, fstat.st_gid)
+                os.rename(tmp_path, fpath)
+                return True
+        except Exception as exp_err:
+            resp = '*ERROR* Cannot replace file `{}`! {}'.format(fpath, exp_err)
+            logWarning(resp)
+        try:
+            os.remove(tmp_path)
+        except Exception:
+            pass
+        return resp
+
+
     def delete_system_file(self, fname):
         """ Dummy method """
         pass
@@ -370,6 +629,22 @@ class BaseFS(object):
         pass
 
 
+    @staticmethod
+    def hash_system_files(fpath, root=''):
+        """
+        The SHA1 of one system file, or of all the files from a system folder.
+        Returns a tuple of (path relative to `root`, sha1, size).
+        """
+        if not os.path.exists(fpath):
+            return '*ERROR* Invalid path `{}`!'.format(fpath)
+        try:
+            return file_hashes(fpath, root or os.path.dirname(fpath))
+        except Exception as exp_err:
+            err = '*ERROR* Cannot hash `{}`! {}'.format(fpath, exp_err)
+            logWarning(err)
+            return err
+
+
     def list_system_files(self, folder, hidden=True, recursive=True, accept=[], reject=[]):
         """
         List all files, recursively.
@@ -386,110 +661,12 @@ class BaseFS(object):
             logWarning(err)
             return err
 
-        def dirList(path):
-            """
-            Create recursive list of folders and files from base path.
-            The format of a node is: {"path": "/..." "data": "name", "folder":true|false, "children": []}
-            """
-            # The node is valid ?
-            if not path:
-                return False
-            # Cleanup '/'
-            if path != '/':
-                path = path.rstrip('/')
-            # This is folder ?
-            if os.path.isfile(path):
-                return False
-
-            len_path = len(base_path) + 1
-            dlist = [] # Folders list
-            flist = [] # Files list
-
-            try:
-                names = sorted(os.listdir(path), key=str.lower)
-            except Exception as exp_err:
-                logWarning('*WARN* Cannot list folder `{}`: `{}`!'.\
-                format(path, exp_err))
-                return []
-
-            # Cycle a folder
-            for fname in names:
-                long_path = path + '/' + fname
-
-                # If Accept is active and file doesn't match, ignore file
-                if accept and os.path.isfile(long_path):
-                    valid = True
-                    if isinstance(accept, list):
-                        # If nothing from the Accept matches the file
-                        if True not in [(long_path.startswith(f) or long_path.endswith(f)) for f in accept]:
-                            valid = False
-                    elif isinstance(accept, str):
-                        if not (long_path.startswith(accept) or long_path.endswith(accept)):
-                            valid = False
-                    if not valid:
-                        continue
-
-                # If Reject is active and file matches, ignore the file
-                if reject and os.path.isfile(long_path):
-                    valid = True
-                    if isinstance(reject, list):
-                        # If nothing from the Reject matches the file
-                        if True in [(long_path.startswith(f) or long_path.endswith(f)) for f in reject]:
-                            valid = False
-                    elif isinstance(reject, str):
-                        if long_path.startswith(reject) or long_path.endswith(reject):
-                            valid = False
-                    if not valid:
-                        continue
-
-                # Ignore hidden files
-                if hidden and fname[0] == '.':
-                    continue
-                # Meta info
-                try:
-                    fstat = os.stat(long_path)
-                    try:
-                        uname = pwd.getpwuid(fstat.st_uid).pw_name
-                    except Exception:
-                        uname = fstat.st_uid
-                    try:
-                        gname = grp.getgrgid(fstat.st_gid).gr_name
-                    except Exception:
-                        gname = fstat.st_gid
-                    meta_info = '{}|{}|{}|{}'.\
-                    format(uname, gname, fstat.st_size,\
-                    time.strftime('%Y-%m-%d %H:%M:%S',\
-                    time.localtime(fstat.st_mtime)))
-                except Exception:
-                    meta_info = ''
-
-                # Semi long path
-                short_path = long_path[len_path:]
-                # Data to append
-                data = {'path': short_path, 'data': fname, 'meta': meta_info}
-
-                if os.path.isdir(long_path):
-                    data['folder'] = True
-                    # Recursive !
-                    if recursive:
-                        children = dirList(long_path)
-                    else:
-                        children = []
-                    if children in [False, None]:
-                        continue
-                    data['children'] = children
-                    dlist.append(data)
-                else:
-                    flist.append(data)
-
-            # Folders first, files second
-            return dlist + flist
-
         paths = {
             'path' : '/',
             'data' : base_path,
             'folder' : True,
-            'children' : dirList(base_path) or []
+            'children' : _list_tree(base_path, base_path, hidden, recursive,
+                _path_patterns(accept), _path_patterns(reject))
         }
 
         clen = len(paths['children'])
@@ -509,6 +686,12 @@ class LocalFS(BaseFS, FsBorg):
     This is a singleton.
     """
 
+    _appends = {}   # Pending appends: (user, file path) -> {'data', 'size', 'time'}
+    _app_wlocks = {} # Write locks, to keep the order of appends: (user, file path) -> lock
+    _app_lock = allocate_lock() # Pending appends lock
+    _app_thread = None # Thread writing the old appends
+    _usr_locks = {} # Start/ check lock for each user
+
     def __init__(self):
         FsBorg.__init__(self)
         self.name = 'Local'
@@ -517,100 +700,336 @@ class LocalFS(BaseFS, FsBorg):
         logInfo('Created {} FS.'.format(self.name))
 
 
+    # ----- APPENDS ------------------------------------------------------------
+
+
+    def append_user_file(self, user, fpath, fdata):
+        """
+        Queue data to be appended in 1 file.\n
+        The appends for the same file are written in order, in one RPC,
+        when they are big enough, or old enough, or when the file is used.
+        """
+        if not fpath:
+            return '*ERROR* Empty `fpath` parameter on append file, user `{}`!'.format(user)
+        fpath = os.path.normpath(fpath)
+        key = (user, fpath)
+
+        with self._app_lock:
+            pending = self._appends.get(key)
+            if not pending:
+                pending = {'data': [], 'size': 0, 'time': time.time()}
+                self._appends[key] = pending
+            pending['data'].append(fdata)
+            pending['size'] += len(fdata)
+            full = pending['size'] >= APPEND_MAX_SIZE
+
+            if not LocalFS._app_thread:
+                LocalFS._app_thread = threading.Thread(target=self._appends_writer)
+                LocalFS._app_thread.daemon = True
+                LocalFS._app_thread.start()
+
+        if full:
+            return self.flush_user_file(user, fpath)
+        return True
+
+
+    def flush_user_file(self, user, fpath):
+        """
+        Write the pending appends for 1 file.
+        """
+        if not fpath:
+            return True
+        fpath = os.path.normpath(fpath)
+        key = (user, fpath)
+
+        with self._app_lock:
+            wlock = self._app_wlocks.get(key)
+            if not wlock:
+                # Nothing was ever appended in this file
+                if key not in self._appends:
+                    return True
+                wlock = self._app_wlocks.setdefault(key, allocate_lock())
+
+        # Only one batch of appends is written at a time, for the same file;
+        # a batch that is being written by another thread is waited for
+        with wlock:
+            with self._app_lock:
+                pending = self._appends.pop(key, None)
+            if not pending:
+                return True
+            ret = BaseFS.write_user_file(self, user, fpath, ''.join(pending['data']), 'a')
+
+        if ret is not True:
+            logWarning('{} FS: Lost `{}` appended chars in file `{}`, user `{}`!'.format(
+                self.name, pending['size'], fpath, user))
+        return ret
+
+
+    def flush_user_files(self, user=None):
+        """
+        Write the pending appends for all the files of 1 user, or for all users.
+        """
+        with self._app_lock:
+            keys = [key for key in self._appends if user is None or key[0] == user]
+
+        success = True
+        for usr, fpath in keys:
+            if self.flush_user_file(usr, fpath) is not True:
+                success = False
+        return success
+
+
+    def flush_user_folder(self, user, fdir):
+        """
+        Write the pending appends for all the files from 1 folder, recursively.
+        """
+        if not fdir:
+            return True
+        fdir = os.path.normpath(fdir) + os.sep
+        with self._app_lock:
+            keys = set(self._appends) | set(self._app_wlocks)
+        paths = [fpath for usr, fpath in keys if usr == user and os.path.normpath(fpath).startswith(fdir)]
+
+        success = True
+        for fpath in paths:
+            if self.flush_user_file(user, fpath) is not True:
+                success = False
+        return success
+
+
+    def _appends_writer(self):
+        """
+        Thread that writes the appends older than the max delay.
+        """
+        while 1:
+            time.sleep(APPEND_MAX_DELAY / 2)
+            now = time.time()
+            with self._app_lock:
+                keys = [key for key, pending in self._appends.iteritems() \
+                    if now - pending['time'] >= APPEND_MAX_DELAY]
+            for user, fpath in keys:
+                try:
+                    self.flush_user_file(user, fpath)
+                except Exception as exp_err:
+                    logWarning('{} FS: Cannot write appends in file `{}`, user `{}`: `{}`!'.format(
+                        self.name, fpath, user, exp_err))
+
+
+    def file_size(self, user, fpath):
+        """
+        Get file size for 1 file, after writing the pending appends.
+        """
+        self.flush_user_file(user, fpath)
+        return BaseFS.file_size(self, user, fpath)
+
+
+    def read_user_file(self, user, fpath, flag='r', fstart=0, flen=0):
+        """
+        Read 1 file, after writing the pending appends.
+        """
+        self.flush_user_file(user, fpath)
+        return BaseFS.read_user_file(self, user, fpath, flag, fstart, flen)
+
+
+    def read_user_chunk(self, user, fpath, fstart=0, flen=MAX_CHUNK, compress=False):
+        """
+        Read a chunk of 1 file, after writing the pending appends.
+        """
+        self.flush_user_file(user, fpath)
+        return BaseFS.read_user_chunk(self, user, fpath, fstart, flen, compress)
+
+
+    def write_user_file(self, user, fpath, fdata, flag='w'):
+        """
+        Write 1 file, after writing the pending appends.
+        """
+        self.flush_user_file(user, fpath)
+        return BaseFS.write_user_file(self, user, fpath, fdata, flag)
+
+
+    def copy_user_file(self, user, fpath, newpath):
+        """
+        Copy 1 user file, after writing the pending appends.
+        """
+        self.flush_user_file(user, fpath)
+        return BaseFS.copy_user_file(self, user, fpath, newpath)
+
+
+    def move_user_file(self, user, fpath, newpath):
+        """
+        Move 1 user file, after writing the pending appends.
+        """
+        self.flush_user_file(user, fpath)
+        return BaseFS.move_user_file(self, user, fpath, newpath)
+
+
+    def delete_user_file(self, user, fpath):
+        """
+        Delete 1 user file, after writing the pending appends,
+        so the appends don't create the file again.
+        """
+        self.flush_user_file(user, fpath)
+        return BaseFS.delete_user_file(self, user, fpath)
+
+
+    def delete_user_folder(self, user, fdir):
+        """
+        Delete 1 user folder, after writing the pending appends of its files.
+        """
+        self.flush_user_folder(user, fdir)
+        return BaseFS.delete_user_folder(self, user, fdir)
+
+
+    def targz_user_folder(self, user, fdir, root=''):
+        """
+        Tar.gz a user folder, or file, after writing the pending appends.
+        """
+        self.flush_user_file(user, fdir)
+        self.flush_user_folder(user, fdir)
+        return BaseFS.targz_user_folder(self, user, fdir, root)
+
+
+    # ----- SERVICE ------------------------------------------------------------
+
+
+    def _usr_lock(self, user):
+        """
+        The lock used to start, or check the services of 1 user.
+        """
+        with self._srv_lock:
+            return self._usr_locks.setdefault(user, allocate_lock())
+
+
+    def prespawn(self, user):
+        """
+        Start the User Service in the background, if it's not running,
+        so the first file operation doesn't have to wait for it.
+        """
+        if user not in self._services:
+            start_new_thread(self._usr_service, (user,))
+
+
+    @staticmethod
+    def _pick_conn(pool, oper):
+        """
+        Round robin between the connections of the same type.
+        """
+        conns = pool['conn_' + oper]
+        return conns[next(pool['counter']) % len(conns)]
+
+
     def _usr_service(self, user, oper='read'):
         """
-        Launch a user service.
+        Launch a user service, or return one of its connections.\n
+        Each user has a pool of read and write connections.
+        The connections are checked at most once every `SERVICE_TTL` seconds,
+        and only the services of the same user wait for each other.
         """
         if oper not in ['read', 'write']:
             logWarning('Invalid FS operation `{}`, for user `{}`! Will reset to "read".'.format(oper, user))
             oper = 'read'
 
-        # Must block here, so more users cannot launch Logs at the same time and lose the PID
-        with self._srv_lock:
+        # Fast path, the connections were checked recently
+        pool = self._services.get(user)
+        if pool and time.time() - pool['checked'] < SERVICE_TTL:
+            return self._pick_conn(pool, oper)
+
+        with self._usr_lock(user):
 
-            # Try to re-use the logger server, if available
-            conn = self._services.get(user, {}).get('conn_' + oper, None)
-            if conn:
+            # Another thread might have checked the service, while waiting
+            pool = self._services.get(user)
+            if pool and time.time() - pool['checked'] < SERVICE_TTL:
+                return self._pick_conn(pool, oper)
+
+            # Try to re-use the user service, if available
+            if pool:
                 try:
-                    conn.ping(data='Hello', timeout=30.0)
-                    # logDebug('Reuse old {} User Service connection for `{}` OK.'.format(op, user))
-                    return conn
+                    for conn in pool['conn_read'] + pool['conn_write']:
+                        conn.ping(data='Hello', timeout=5.0)
+                    pool['checked'] = time.time()
+                    return self._pick_conn(pool, oper)
                 except Exception as exp_err:
-                    logWarning('Cannot reuse {} User Service for `{}`: `{}`.'.format(oper, user, exp_err))
-                    self._kill(user)
+                    logWarning('Cannot reuse User Service for `{}`: `{}`.'.format(user, exp_err))
+                    del self._services[user]
+                    for conn in pool['conn_read'] + pool['conn_write']:
+                        try:
+                            conn.close()
+                        except Exception:
+                            pass
             else:
                 logInfo('Launching a User Service for `{}`, the first time...'.format(user))
 
-            port = None
+            # Kill the leftover services, from this CE, or an older one
+            self._kill(user)
+
+            pool = self._launch_service(user)
+            if not pool:
+                return None
+            self._services[user] = pool
+
+        return self._pick_conn(pool, oper)
+
 
-            # If the server is not available, search for a free port in the safe range...
-            while 1:
-                port = random.randrange(63000, 65000)
+    def _launch_service(self, user):
+        """
+        Start the User Service process and connect the pool of connections.
+        The service chooses a free port and sends it back on STDOUT.
+        """
+        p_cmd = 'su {} -c "{} -u {}/server/UserService.py 0 {}"'.\
+        format(user, sys.executable, TWISTER_PATH, self.name)
+        proc = subprocess.Popen(p_cmd, cwd='{}/twister'.\
+        format(userHome(user)), shell=True, close_fds=True,\
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        # Wait for the port number
+        port = None
+        t_end = time.time() + SERVICE_START_TIMEOUT
+        while not port and time.time() < t_end:
+            ready, _, _ = select.select([proc.stdout], [], [], t_end - time.time())
+            if not ready:
+                break
+            line = proc.stdout.readline()
+            if not line:
+                # The process ended
+                break
+            if line.startswith('PORT:'):
                 try:
-                    socket.create_connection((None, port), 1)
+                    port = int(line.strip()[5:])
                 except Exception:
-                    break
-
-            p_cmd = 'su {} -c "{} -u {}/server/UserService.py {} {}"'.\
-            format(user, sys.executable, TWISTER_PATH, port, self.name)
-            proc = subprocess.Popen(p_cmd, cwd='{}/twister'.\
-            format(userHome(user)), shell=True, close_fds=True,\
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            proc.poll()
-            time.sleep(2.0)
-
-            config = {
-                'allow_pickle': True,
-                'allow_getattr': True,
-                'allow_setattr': True,
-                'allow_delattr': True
-            }
-
-            retry = 10
-            delay = 0.5
-            success = False
-
-            while retry > 0:
-                if success:
-                    break
+                    pass
+
+        if not port:
+            logError('Error on starting User Service for `{}`! Return code `{}`, `{}`.'.format(
+                user, proc.poll(), proc.stderr.read() if proc.poll() is not None else ''))
+            return None
+
+        config = {
+            'allow_pickle': True,
+            'allow_getattr': True,
+            'allow_setattr': True,
+            'allow_delattr': True
+        }
 
+        pool = {'proc': proc, 'port': port, 'conn_read': [], 'conn_write': [],
+                'counter': itertools.count(), 'checked': time.time()}
+
+        for oper in ['read', 'write']:
+            for _ in range(SERVICE_POOL_SIZE):
                 try:
-                    stream_r = rpyc.SocketStream.connect('127.0.0.1', port, timeout=5.0)
-                    conn_read = rpyc.connect_stream(stream_r, config=config)
-                    conn_read.root.hello()
-                    logDebug('Connected to User Service for `{}`, operation `read`.'.format(user))
-                    success = True
+                    stream = rpyc.SocketStream.connect('127.0.0.1', port, timeout=5.0)
+                    conn = rpyc.connect_stream(stream, config=config)
+                    conn.root.hello()
+                    pool['conn_' + oper].append(conn)
                 except Exception as exp_err:
-                    logWarning('Cannot connect to User Service for `{}` - \
-                    Exception: `{}`! Wait {}s...'.format(user, exp_err, delay))
-
-                if success:
-                    try:
-                        stream_w = rpyc.SocketStream.connect('127.0.0.1', port, timeout=5.0)
-                        conn_write = rpyc.connect_stream(stream_w, config=config)
-                        conn_write.root.hello()
-                        logDebug('Connected to User Service for `{}`, operation `write`.'.format(user))
-                        break
-                    except Exception as exp_err:
-                        logWarning('Cannot connect to User Service for `{}` \
-                        - Exception: `{}`! Wait {}s...'.\
-                        format(user, exp_err, delay))
-                        success = False
-
-                time.sleep(delay)
-                retry -= 1
-                delay += 0.75
-
-            if not success:
+                    logWarning('Cannot connect to User Service for `{}`, operation `{}` - '\
+                        'Exception: `{}`!'.format(user, oper, exp_err))
+            if not pool['conn_' + oper]:
                 logError('Error on starting User Service for `{}`!'.format(user))
                 return None
 
-            # Save the process inside the block.  99% of the time, this block is executed instantly!
-            self._services[user] = {'proc': proc, 'conn_read': conn_read, 'conn_write': conn_write, 'port': port}
-
-        logDebug('User Service for `{}` launched on `127.0.0.1:{}` - PID `{}`.'.format(user, port, proc.pid))
-
-        return self._services[user].get('conn_' + oper, None)
+        logDebug('User Service for `{}` launched on `127.0.0.1:{}` - PID `{}`, with `{}` '\
+            'connections.'.format(user, port, proc.pid, len(pool['conn_read']) + len(pool['conn_write'])))
+        return pool
 
 #
 
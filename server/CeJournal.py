@@ -0,0 +1,311 @@
+# File: CeJournal.py ; This file is part of Twister.
+
+# version: 3.001
+
+# Copyright (C) 2012-2014 , Luxoft
+
+# Authors:
+#    Andrei Costachi <acostachi@luxoft.com>
+#    Cristi Constantin <crconstantin@luxoft.com>
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Central Engine Project Journal
+******************************
+
+Saves the project state on HDD, so it can be recovered after a CE crash.\n
+Every change of user, EP, suite or file info is appended in a journal,
+as one line: `[user, ep, suite, file, key, value]`.\n
+From time to time, and every time the project structure changes, the whole
+project is saved in a snapshot, by a background thread. The project is copied
+and a new journal is started at the same time, then the copy is saved and the
+old journal is deleted.\n
+On startup, the snapshot is loaded and the journals are replayed over it.
+"""
+
+import os
+import sys
+import threading
+from thread import allocate_lock
+
+try:
+    import simplejson as json
+except Exception:
+    import json
+
+TWISTER_PATH = os.getenv('TWISTER_PATH')
+if not TWISTER_PATH:
+    print 'TWISTER_PATH environment variable is not set! Exiting!'
+    exit(1)
+if TWISTER_PATH not in sys.path:
+    sys.path.append(TWISTER_PATH)
+
+from common.tsclogging import logDebug, logWarning
+
+# A new snapshot is saved after this many changes
+SNAPSHOT_CHANGES = 5000
+
+
+def _index_nodes(nodes, index):
+    """
+    Flat index of all the suites and files, from the suites tree.
+    """
+    for n_id, node in nodes.iteritems():
+        if not isinstance(node, dict):
+            continue
+        index[n_id] = node
+        if node.get('type') == 'suite' and isinstance(node.get('children'), dict):
+            _index_nodes(node['children'], index)
+    return index
+
+
+def copy_data(data):
+    """
+    Copy of the project data, with the types saved in the snapshot.
+    """
+    if isinstance(data, dict):
+        return dict((key, copy_data(value)) for key, value in data.iteritems())
+    if isinstance(data, (list, tuple)):
+        return [copy_data(value) for value in data]
+    if data is None or isinstance(data, (basestring, bool, int, long, float)):
+        return data
+    return str(data)
+
+
+class ProjectJournal(object):
+    """
+    Snapshot and journal of the project users.
+    """
+
+    def __init__(self):
+        """
+        Initialize the journal.
+        """
+        self.snap_path = TWISTER_PATH + '/config/project_users.json'
+        self.jrn_path = TWISTER_PATH + '/config/project_users.journal'
+        # The journal before the snapshot being saved
+        self.old_path = self.jrn_path + '.old'
+        self.jrn_lock = allocate_lock() # Journal write lock
+        self.jrn_file = None
+        self.changes = 0
+        self.snap_cond = threading.Condition()
+        self.snap_func = None  # Copies the project for the next snapshot
+        self.snap_thread = None
+
+
+    def _open(self):
+        """
+        Open the journal for appending.
+        This function must be called with the journal lock!
+        """
+        if not self.jrn_file:
+            self.jrn_file = open(self.jrn_path, 'a')
+        return self.jrn_file
+
+
+    def record(self, user, epname=None, suite=None, fname=None, key=None, value=None):
+        """
+        Append one change in the journal.
+        Returns True if a new snapshot should be saved.
+        """
+        try:
+            line = json.dumps([user, epname, suite, fname, key, value])
+        except Exception as exp_err:
+            logDebug('Journal: Cannot save `{}` = `{}` for `{}`: `{}`!'.format(key, value, user, exp_err))
+            return False
+
+        with self.jrn_lock:
+            try:
+                file_p = self._open()
+                file_p.write(line + '\n')
+                file_p.flush()
+            except Exception as exp_err:
+                logWarning('Journal: Cannot write in `{}`: `{}`!'.format(self.jrn_path, exp_err))
+                self.jrn_file = None
+                return False
+            self.changes += 1
+            return self.changes >= SNAPSHOT_CHANGES
+
+
+    def snapshot(self, get_users):
+        """
+        Ask the snapshot thread to save all the users.\n
+        `get_users` is called by the thread and must return a copy of the users,
+        made while the project is locked, and must call `rotate` at the same time.
+        The requests made while a snapshot is saved, are saved once, after it.
+        """
+        with self.snap_cond:
+            self.snap_func = get_users
+            self.snap_cond.notify()
+            if not self.snap_thread:
+                self.snap_thread = threading.Thread(target=self._snapshot_writer)
+                self.snap_thread.daemon = True
+                self.snap_thread.start()
+        return True
+
+
+    def rotate(self):
+        """
+        Start a new journal. The old journal is deleted after the snapshot is saved.\n
+        This function must be called while the project is locked!
+        """
+        with self.jrn_lock:
+            try:
+                if self.jrn_file:
+                    self.jrn_file.close()
+                    self.jrn_file = None
+                if os.path.isfile(self.old_path):
+                    # The last snapshot was not saved, keep all the changes
+                    if os.path.isfile(self.jrn_path):
+                        with open(self.old_path, 'a') as dst, open(self.jrn_path, 'r') as src:
+                            dst.write(src.read())
+                        os.remove(self.jrn_path)
+                elif os.path.isfile(self.jrn_path):
+                    os.rename(self.jrn_path, self.old_path)
+                else:
+                    # The old journal exists until the snapshot is saved
+                    open(self.old_path, 'w').close()
+            except Exception as exp_err:
+                logWarning('Journal: Cannot start a new journal `{}`: `{}`!'.format(self.jrn_path, exp_err))
+                return False
+            self.changes = 0
+        return True
+
+
+    def _write_snapshot(self, users):
+        """
+        Save the copy of the users in the snapshot, then delete the old journal.
+        The project is not locked, the new changes go in the new journal.
+        """
+        try:
+            data = json.dumps(users, default=str)
+        except Exception as exp_err:
+            logWarning('Journal: Cannot serialize the project: `{}`!'.format(exp_err))
+            return False
+
+        try:
+            # Write a temporary file, then replace the snapshot;
+            # when the old journal is deleted, the temporary file is complete
+            with open(self.snap_path + '.tmp', 'w') as file_p:
+                file_p.write(data)
+                file_p.flush()
+                os.fsync(file_p.fileno())
+            if os.path.isfile(self.old_path):
+                os.remove(self.old_path)
+            os.rename(self.snap_path + '.tmp', self.snap_path)
+        except Exception as exp_err:
+            logWarning('Journal: Cannot save the snapshot `{}`: `{}`!'.format(self.snap_path, exp_err))
+            return False
+
+        return True
+
+
+    def _snapshot_writer(self):
+        """
+        Thread that saves the snapshots, when they are requested.
+        """
+        while 1:
+            with self.snap_cond:
+                while not self.snap_func:
+                    self.snap_cond.wait()
+                get_users, self.snap_func = self.snap_func, None
+            try:
+                users = get_users()
+            except Exception as exp_err:
+                logWarning('Journal: Cannot copy the project: `{}`!'.format(exp_err))
+                continue
+            self._write_snapshot(users)
+
+
+    def replay(self):
+        """
+        Load the last snapshot and apply the journals.
+        Returns the recovered users.
+        """
+        snap_path = self.snap_path
+        # The CE stopped after the old journal was deleted, before replacing the snapshot
+        if not os.path.isfile(self.old_path) and os.path.isfile(self.snap_path + '.tmp'):
+            snap_path = self.snap_path + '.tmp'
+
+        users = {}
+        if os.path.isfile(snap_path):
+            try:
+                with open(snap_path, 'r') as file_p:
+                    users = json.load(file_p)
+            except Exception as exp_err:
+                logWarning('Journal: Cannot load the snapshot `{}`: `{}`!'.format(snap_path, exp_err))
+                users = {}
+
+        # Suites and files index, for each user and EP
+        nodes = {}
+        changes = 0
+
+        # The old journal, if the last snapshot was not saved, then the new journal
+        for jrn_path in (self.old_path, self.jrn_path):
+            if not os.path.isfile(jrn_path):
+                continue
+            with open(jrn_path, 'r') as file_p:
+                for line in file_p:
+                    try:
+                        user, epname, suite, fname, key, value = json.loads(line)
+                    except Exception:
+                        # A partial line, from a crash
+                        continue
+
+                    usr_data = users.setdefault(user, {})
+                    if epname is None:
+                        usr_data[key] = value
+                        changes += 1
+                        continue
+
+                    ep_data = usr_data.setdefault('eps', {}).setdefault(epname, {})
+                    node_id = fname or suite
+                    if node_id is None:
+                        ep_data[key] = value
+                        changes += 1
+                        continue
+
+                    if (user, epname) not in nodes:
+                        nodes[(user, epname)] = _index_nodes(ep_data.get('suites') or {}, {})
+                    node = nodes[(user, epname)].get(node_id)
+                    if node is not None:
+                        node[key] = value
+                        changes += 1
+
+        logDebug('Journal: Recovered `{}` users, with `{}` changes.'.format(len(users), changes))
+        return users
+
+
+    @staticmethod
+    def restore_nodes(suites, old_suites):
+        """
+        Copy the missing info from the recovered suites and files,
+        into the suites and files of the new project.
+        Only the nodes with the same ID and the same name are restored.
+        """
+        old_nodes = _index_nodes(old_suites or {}, {})
+        restored = 0
+
+        for n_id, node in suites.iter_nodes(None, []):
+            old_node = old_nodes.get(n_id)
+            if not old_node or old_node.get('type') != node.get('type'):
+                continue
+            if old_node.get('file') != node.get('file') or old_node.get('name') != node.get('name'):
+                continue
+            for key, value in old_node.iteritems():
+                if key not in node:
+                    node[key] = value
+            restored += 1
+
+        return restored
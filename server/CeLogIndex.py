@@ -0,0 +1,235 @@
+# File: CeLogIndex.py ; This file is part of Twister.
+
+# version: 3.001
+
+# Copyright (C) 2012-2014 , Luxoft
+
+# Authors:
+#    Andrei Costachi <acostachi@luxoft.com>
+#    Cristi Constantin <crconstantin@luxoft.com>
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at:
+
+# http://www.apache.org/licenses/LICENSE-2.0
+
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Central Engine Log Index
+************************
+
+Keeps the byte offsets of the `<<< START filename` and `<<< END filename`
+markers, for every log written by the Central Engine.\n
+The offsets are recorded while the logs are appended, so the log of one test
+file can be read without reading and parsing the whole log.\n
+The index is saved as a journal for each user, in `config/log_index/`,
+and it is replayed the first time the user logs are accessed.
+"""
+
+import os
+import sys
+import re
+from thread import allocate_lock
+
+try:
+    import simplejson as json
+except Exception:
+    import json
+
+TWISTER_PATH = os.getenv('TWISTER_PATH')
+if not TWISTER_PATH:
+    print 'TWISTER_PATH environment variable is not set! Exiting!'
+    exit(1)
+if TWISTER_PATH not in sys.path:
+    sys.path.append(TWISTER_PATH)
+
+from common.tsclogging import logDebug, logWarning
+
+# Start and End markers written by the EPs
+MARKER = re.compile(r'<<< (START|END) filename: `([^`\n]*)` >>>')
+# Part of the previous chunk kept, for the markers split between 2 chunks
+TAIL_SIZE = 2048
+
+
+class LogIndex(object):
+    """
+    Index of test markers in the user logs.
+    """
+
+    def __init__(self, project):
+        """
+        Initialize the log index.
+        """
+        self.project = project
+        self.idx_lock = allocate_lock() # Index access lock
+        self.path_locks = {} # Write locks: (user, log path) -> lock
+        self.sizes = {}  # Current sizes: (user, log path) -> size
+        self.tails = {}  # End of the last chunk: (user, log path) -> string
+        self.index = {}  # Markers: user -> log path -> test key -> [start, end]
+
+
+    @staticmethod
+    def _journal_path(user):
+        """
+        The journal of one user.
+        """
+        return '{}/config/log_index/{}.journal'.format(TWISTER_PATH, user)
+
+
+    def _journal(self, user, entries):
+        """
+        Append some entries in the journal of one user.
+        This function must be called with the index lock!
+        """
+        jpath = self._journal_path(user)
+        try:
+            if not os.path.isdir(os.path.dirname(jpath)):
+                os.makedirs(os.path.dirname(jpath))
+            with open(jpath, 'a') as file_p:
+                for entry in entries:
+                    file_p.write(json.dumps(entry) + '\n')
+        except Exception as exp_err:
+            logWarning('Log Index: Cannot write journal for user `{}`: `{}`!'.format(user, exp_err))
+
+
+    def _user_index(self, user):
+        """
+        Returns the index of one user, replaying the journal if needed.
+        This function must be called with the index lock!
+        """
+        if user in self.index:
+            return self.index[user]
+
+        logs = {}
+        jpath = self._journal_path(user)
+        if os.path.isfile(jpath):
+            try:
+                with open(jpath, 'r') as file_p:
+                    for line in file_p:
+                        try:
+                            entry = json.loads(line)
+                        except Exception:
+                            # A partial line, from a crash
+                            continue
+                        if len(entry) == 1:
+                            logs.pop(entry[0], None)
+                        elif len(entry) == 4:
+                            path, key, mark, offset = entry
+                            rng = logs.setdefault(path, {}).setdefault(key, [None, None])
+                            pos = 0 if mark == 'START' else 1
+                            if rng[pos] is None:
+                                rng[pos] = offset
+                logDebug('Log Index: Loaded `{}` logs for user `{}`.'.format(len(logs), user))
+            except Exception as exp_err:
+                logWarning('Log Index: Cannot load journal for user `{}`: `{}`!'.format(user, exp_err))
+
+        self.index[user] = logs
+        return logs
+
+
+    def _path_lock(self, user, log_path):
+        """
+        The write lock of one log.
+        """
+        with self.idx_lock:
+            return self.path_locks.setdefault((user, log_path), allocate_lock())
+
+
+    def _scan(self, user, log_path, offset, data):
+        """
+        Find the markers in a chunk of log, written at `offset`.
+        This function must be called with the index lock!
+        """
+        tail = self.tails.get((user, log_path), '')
+        text = tail + data
+        base = offset - len(tail)
+        entries = []
+
+        for match in MARKER.finditer(text):
+            # This marker was found in the previous chunk
+            if match.end() <= len(tail):
+                continue
+            mark, key = match.groups()
+            pos = 0 if mark == 'START' else 1
+            rng = self._user_index(user).setdefault(log_path, {}).setdefault(key, [None, None])
+            # Just like searching in the log, the first marker wins
+            if rng[pos] is None:
+                rng[pos] = base + (match.start() if pos == 0 else match.end())
+                entries.append([log_path, key, mark, rng[pos]])
+
+        self.tails[(user, log_path)] = text[-TAIL_SIZE:]
+        if entries:
+            self._journal(user, entries)
+
+
+    def append(self, user, log_path, data):
+        """
+        Append data in one log, using the LocalFS appends, and index the markers.
+        Returns the result of the append.
+        """
+        log_path = os.path.normpath(log_path)
+
+        with self._path_lock(user, log_path):
+
+            offset = self.sizes.get((user, log_path))
+            if offset is None:
+                offset = self.project.localFs.file_size(user, log_path)
+                # The log doesn't exist yet
+                if not isinstance(offset, (int, long)) or offset < 0:
+                    offset = 0
+
+            ret = self.project.localFs.append_user_file(user, log_path, data)
+
+            with self.idx_lock:
+                if ret is True:
+                    self.sizes[(user, log_path)] = offset + len(data)
+                    self._scan(user, log_path, offset, data)
+                else:
+                    # Don't know what was written; ask for the size next time
+                    self.sizes.pop((user, log_path), None)
+                    self.tails.pop((user, log_path), None)
+
+        return ret
+
+
+    def find(self, user, log_path, key):
+        """
+        Returns the [start, end] offsets of one test in one log, or None.
+        """
+        log_path = os.path.normpath(log_path)
+        with self.idx_lock:
+            rng = self._user_index(user).get(log_path, {}).get(key)
+            if rng and rng[0] is not None and rng[1] is not None and rng[1] > rng[0]:
+                return list(rng)
+        return None
+
+
+    def reset(self, user, log_path=None):
+        """
+        Forget the markers of one log, or of all the logs of a user.
+        Must be called when the logs are overwritten.
+        """
+        with self.idx_lock:
+            if log_path is None:
+                for key in self.sizes.keys():
+                    if key[0] == user:
+                        self.sizes.pop(key, None)
+                        self.tails.pop(key, None)
+                self.index[user] = {}
+                try:
+                    with open(self._journal_path(user), 'w'):
+                        pass
+                except Exception:
+                    pass
+            else:
+                log_path = os.path.normpath(log_path)
+                self.sizes.pop((user, log_path), None)
+                self.tails.pop((user, log_path), None)
+                if self._user_index(user).pop(log_path, None) is not None:
+                    self._journal(user, [[log_path]])
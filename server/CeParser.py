@@ -99,19 +99,65 @@ class CeXmlParser(object):
             dependency_dict: a dict that stores the link between new and old ids. Old ids are keys.
         @summary:
             Replaces the ids in all Dependency tags with the new and updated ones.
+            Returns the dependency graph: test ID -> list of required test IDs.
         """
+        graph = OrderedDict()
         dependencies = xml.findall('.//Dependency')
         for dependency in dependencies:
             if dependency.text:
                 dep_list = dependency.text.split(';')
                 new_dep_list = ''
+                required = []
                 for dep in dep_list:
                     condition = dep.split(':')[-1]
                     dep_id = dep.split(':')[0]
                     if dep_id in dependency_dict:
                         new_dep_id = [id+':'+condition for id in dependency_dict[dep_id]]
                         new_dep_list += ';'.join(new_dep_id)+';'
+                        required.extend(dependency_dict[dep_id])
                 dependency.text = new_dep_list
+                # The ID of the test that has this dependency
+                test_id = dependency.getparent().find('ID')
+                if required and test_id is not None:
+                    graph[test_id.text] = required
+        return graph
+
+
+    def _check_dependencies(self, user, xml, graph):
+        '''
+        @param:
+            xml: the project/last_edited xml in etree format
+            graph: the dependency graph, test ID -> list of required test IDs
+        @summary:
+            Checks that the dependency graph is acyclic and that all the required tests exist.
+            The tests in a cycle would wait for each other forever.
+        '''
+        test_ids = set(tc_id.text for tc_id in xml.xpath('//TestCase/ID'))
+        for test_id, required in graph.iteritems():
+            for dep_id in required:
+                if dep_id not in test_ids:
+                    logWarning('User `{}`: Test `{}` depends on unknown test `{}`!'.format(user, test_id, dep_id))
+
+        # Depth first search; 1 = visiting, 2 = done
+        state = {}
+        for start in graph:
+            if start in state:
+                continue
+            stack = [(start, iter(graph.get(start, [])))]
+            state[start] = 1
+            while stack:
+                node, children = stack[-1]
+                for child in children:
+                    if state.get(child) == 1:
+                        logWarning('User `{}`: Dependency cycle between tests `{}` and `{}`! '\
+                            'These tests will wait for each other!'.format(user, node, child))
+                    elif child not in state:
+                        state[child] = 1
+                        stack.append((child, iter(graph.get(child, []))))
+                        break
+                else:
+                    state[node] = 2
+                    stack.pop()
 
 
     def _change_ids(self, xml, repeated_dict):
@@ -544,7 +590,8 @@ class CeXmlParser(object):
         repeated_dict = {}
         self._change_ids(xml, repeated_dict)
 
-        self._resolve_dependencies(xml, repeated_dict)
+        dep_graph = self._resolve_dependencies(xml, repeated_dict)
+        self._check_dependencies(user, xml, dep_graph)
 
         for suite in xml.findall('.//TestSuite'):
             prop = suite.find('Property')
@@ -84,6 +84,7 @@ socket.setdefaulttimeout(5)
 #import platform
 import smtplib
 import binascii
+import zlib
 import traceback
 import threading
 import paramiko
@@ -118,15 +119,15 @@ if TWISTER_PATH not in sys.path:
 from common.constants  import STATUS_WORKING, STATUS_PENDING, testStatus
 from common.constants  import STATUS_NOT_EXEC, STATUS_STOP, STATUS_INVALID
 from common.constants  import STATUS_INTERACT, STATUS_PAUSED, STATUS_RUNNING
-from common.constants  import STATUS_RESUME, EXEC_STATUS, ROLES
+from common.constants  import STATUS_RESUME, STATUS_ABORTED, EXEC_STATUS, ROLES
 #from common.constants  import user
 from common.helpers    import userHome, execScript, decrypt, encrypt
-from common.tsclogging import getLogLevel
 from common.tsclogging import logDebug, logFull, logError, logWarning
 from common.tsclogging import logInfo, logCritical
 from common.xmlparser  import PluginParser, ClearCaseParser, TSCParser
 from common.suitesmanager import SuitesManager
 from common import iniparser
+from plugins import BasePlugin
 
 from server.CeParser import CeXmlParser
 from server.CeServices import ServiceManager
@@ -134,14 +135,27 @@ from server.CeWebUi import WebInterface
 from server.CeReports import ReportingServer
 from server.CeSuts import Suts
 from server.CeTestBeds import TestBeds
-from server.CeFs import LocalFS
+from server.CeFs import LocalFS, MAX_CHUNK
 from server.CeClearCaseFs import ClearCaseFs
 from server.CeConfigs import CeConfigs
 from server.CeDatabase import CeDbManager
+from server.CeLogIndex import LogIndex
+from server.CeJournal import ProjectJournal, copy_data
 
 usrs_and_pwds = {}
 usr_pwds_lock = allocate_lock()
 
+# Part of the CLI log kept between chunks, for Panic Detect
+PANIC_TAIL_SIZE = 1024
+# Panic Detect expressions with flags are not joined with the other expressions
+PANIC_NO_FLAGS = re.compile('').flags
+PANIC_INLINE_FLAG = re.compile(r'\(\?[iLmsux]')
+# Size of the chunks used to read the logs; a multiple of 3, for base64
+LOG_CHUNK = 3 * 1024 * 1024
+# Max log of one test returned by `find_log`
+LOG_PAGE = 4 * LOG_CHUNK
+LOG_TRUNCATED = '\n... The log of this test is too big; the rest of it is in `{}` ...\n'
+
 #
 
 def cache_users():
@@ -248,17 +262,30 @@ class Project(object):
         self.clearFs.project = self
         self.configs = CeConfigs(self)
         self.dbmgr = CeDbManager(self)
+        self.log_index = LogIndex(self) # Test markers in the logs
+        self.journal = ProjectJournal() # Project state on HDD
 
         self.panic_detect_reg_exprs = ""
+        self.panic_matchers = {} # Compiled expressions: user -> matcher
+        self.panic_tails = {}    # End of the last CLI chunk: (user, EP name) -> string
 
         # Users, parsers, IDs...
         self.users = {}
         self.roles = {}
+        self.roles_gen = 0  # Incremented every time the roles are reloaded
+        self.auth_cache = {} # Roles for each user: user -> (roles generation, user roles)
         self.parsers = {}
         self.test_ids = {}  # IDs shortcut
         self.suite_ids = {} # IDs shortcut
         self.plugins = {}   # User plugins
+        self.log_plugins = {} # Plugins with `onLog`: user -> (plugins.xml mtime, plugins)
         self.calc_libraries = {} # dict with user:precalculated_libraries
+        self.lib_blobs = {} # Library files by content: user -> sha1 -> (path, is global)
+        self.dep_waiters = {} # EPs waiting for dependencies: user -> dep ID -> EP names
+        self.dep_index = {}   # Tests by dependency ID: user -> dep ID -> (EP name, file ID)
+
+        # The project state saved before the last CE stop, or crash
+        self.recovered = self.journal.replay()
 
         self.usr_lock = allocate_lock()  # User change lock
         self.auth_lock = allocate_lock()  # Authenticate change lock
@@ -269,6 +296,7 @@ class Project(object):
         self.log_lock = allocate_lock()  # Log access lock
         self.eml_lock = allocate_lock()  # E-mail lock
         self.interact_lock = allocate_lock() # Lock used for interaction queue
+        self.dep_lock = allocate_lock()  # Lock for the dependency waiters
 
         # Read the production/ development option.
         cfg_path = '{}/config/server_init.ini'.format(TWISTER_PATH)
@@ -302,6 +330,9 @@ class Project(object):
         # Start cache users at the beggining...
         start_new_thread(cache_users, ())
 
+        # Reload the users and groups when the file changes
+        start_new_thread(self._watch_users_and_groups, ())
+
         logInfo('SERVER INITIALIZATION TOOK `{:.4f}` SECONDS.'.format(time.time() - t_init))
 
 
@@ -437,6 +468,9 @@ class Project(object):
             logDebug('Reload Execution-Process `{}:{}` with `{}` suites \
             and `{}` files.'.format(user, epname, len(suites), len(files)))
 
+            # The dependency index must be re-created
+            self.dep_index.pop(user, None)
+
         # Save everything.
         self._dump()
 
@@ -465,6 +499,7 @@ class Project(object):
 
             logDebug('Un-Registered Execution-Process `{}:{}`.'.format(user, epname))
             del self.users[user]['eps'][epname]
+            self.dep_index.pop(user, None)
 
         # Save everything.
         self._dump()
@@ -610,6 +645,9 @@ class Project(object):
             if not resp:
                 return False
 
+        # Recover the state from the last run
+        self._restore_user(user)
+
         # Save everything.
         self._dump()
         logInfo('Project: Registered user `{}`.'.format(user))
@@ -729,7 +767,8 @@ class Project(object):
         """
         This func uses what it can to identify the current user and check his roles.\n
         The function is used EVERYWHERE !\n
-        It uses a lock, in order to create the user structure only once.
+        The roles are cached for each user, until the users and groups are reloaded;
+        the lock is used only to populate the cache.
         """
         if not user:
             return False
@@ -743,10 +782,19 @@ class Project(object):
             if not res:
                 return False
 
+        # Fast path, the roles didn't change
+        cached = self.auth_cache.get(user)
+        if cached and cached[0] == self.roles_gen:
+            return cached[1]
+
         with self.auth_lock:
 
-            # Reload users and groups
-            self.roles = self._parse_users_and_groups()
+            # The generation must be read before the roles
+            roles_gen = self.roles_gen
+
+            # Load users and groups, the first time
+            if not self.roles:
+                self.roles = self._parse_users_and_groups()
             if not self.roles:
                 return False
 
@@ -766,26 +814,86 @@ class Project(object):
             self.users[user]['user_groups'] = ', '.join(user_roles['groups'])
             self.users[user]['user_roles'] = ', '.join(user_roles['roles'])
 
+            self.auth_cache[user] = (roles_gen, user_roles)
+
         return user_roles
 
 
+    def _watch_users_and_groups(self):
+        """
+        Thread that reloads the users and groups, when the file is changed.
+        """
+        while 1:
+            time.sleep(2.0)
+            try:
+                with self.usr_lock:
+                    self._parse_users_and_groups()
+            except Exception as exp_err:
+                logWarning('Users and Groups: Cannot reload the roles: `{}`!'.format(exp_err))
+
+
     def _dump(self):
         """
-        Internal function. Save all data structure on HDD.\n
-        This function must use a lock!
+        Internal function. Save all data structure on HDD, in the background.
         """
-        # if the debug level is NOT set to FULL, exit
-        if getLogLevel() != 'FULL':
-            return False
+        self.journal.snapshot(self._snapshot_users)
+
 
+    def _snapshot_users(self):
+        """
+        Internal function. Copy of all the users, for the snapshot thread.\n
+        The journal is rotated while the project is locked, so the changes
+        after the copy are in the new journal.
+        """
         with self.int_lock:
+            # The users not created yet, keep the recovered info
+            users = dict(self.recovered)
+            users.update(self.users)
+            users = copy_data(users)
+            self.journal.rotate()
+        return users
 
-            with open(TWISTER_PATH + '/config/project_users.json', 'w') \
-            as file_p:
-                try:
-                    json.dump(self.users, file_p, indent=4)
-                except Exception:
-                    pass
+
+    def _journal(self, user, epname=None, suite=None, fname=None, key=None, value=None):
+        """
+        Internal function. Save one change of the data structure on HDD.\n
+        Everything is saved, from time to time.
+        """
+        if self.journal.record(user, epname, suite, fname, key, value):
+            self._dump()
+
+
+    def _restore_user(self, user):
+        """
+        Internal function. Restore the info from the last run of the user,
+        if the CE was stopped, or crashed.\n
+        The values from the new project are never overwritten.
+        """
+        old_user = self.recovered.pop(user, None)
+        if not old_user:
+            return False
+
+        for key, value in old_user.iteritems():
+            if key not in ['eps', 'status'] and key not in self.users[user]:
+                self.users[user][key] = value
+
+        restored = 0
+        for epname, old_ep in (old_user.get('eps') or {}).iteritems():
+            ep_data = self.users[user]['eps'].get(epname)
+            if not ep_data:
+                continue
+            for key, value in old_ep.iteritems():
+                if key not in ['suites', 'status'] and key not in ep_data:
+                    ep_data[key] = value
+            if ep_data.get('suites') and old_ep.get('suites'):
+                restored += self.journal.restore_nodes(ep_data['suites'], old_ep['suites'])
+                # The tests that were running are aborted
+                for _, node in ep_data['suites'].iter_nodes(None, []):
+                    if node.get('type') == 'file' and node.get('status') == STATUS_WORKING:
+                        node['status'] = STATUS_ABORTED
+
+        logInfo('Project: Recovered `{}` suites and files for user `{}`.'.format(restored, user))
+        return True
 
 
 # # #
@@ -894,9 +1002,12 @@ class Project(object):
             usr_data['key'] = None
 
         # Update internal structure
-        self.roles = cfg.dict()
+        roles = cfg.dict()
         # Append timer, for next time
-        self.roles['timer'] = m_time
+        roles['timer'] = m_time
+        self.roles = roles
+        # The cached roles of the users are now invalid
+        self.roles_gen += 1
 
         return self.roles
 
@@ -1469,7 +1580,7 @@ class Project(object):
             return False
 
         self.users[user][key] = value
-        self._dump()
+        self._journal(user, key=key, value=value)
         return True
 
 
@@ -1524,7 +1635,7 @@ class Project(object):
 
         try:
             self.users[user]['eps'][epname][key] = value
-            self._dump()
+            self._journal(user, epname, key=key, value=value)
             return True
         except Exception as exp_err:
             logWarning('Cannot set EP `{}` info `{} = {}`: `{}`!'.format(epname, key, value, exp_err))
@@ -1545,7 +1656,7 @@ class Project(object):
         if epname not in eps:
             logDebug('Project: Invalid EP name `{}` !'.format(epname))
             return False
-        if suite_id not in eps[epname]['suites'].get_suites():
+        if not eps[epname]['suites'].is_suite(suite_id):
             logDebug('Project: Invalid Suite ID `{}` !'.format(suite_id))
             return False
 
@@ -1569,7 +1680,7 @@ class Project(object):
         if epname not in eps:
             logDebug('Project: Invalid EP name `{}` !'.format(epname))
             return False
-        if suite_id not in eps[epname]['suites'].get_suites():
+        if not eps[epname]['suites'].is_suite(suite_id):
             logDebug('Project: Invalid Suite ID `{}` !'.format(suite_id))
             return False
 
@@ -1589,7 +1700,7 @@ class Project(object):
         if epname not in eps:
             logDebug('Project: Invalid EP name `{}` !'.format(epname))
             return False
-        if suite_id not in eps[epname]['suites'].get_suites():
+        if not eps[epname]['suites'].is_suite(suite_id):
             logDebug('Project: Invalid Suite ID `{}` !'.format(suite_id))
             return False
         if not key or key == 'children':
@@ -1604,7 +1715,7 @@ class Project(object):
             logDebug('Project: Invalid Suite node `{}` !'.format(suite_id))
             return False
         suite_node[key] = value
-        self._dump()
+        self._journal(user, epname, suite_id, key=key, value=value)
         return True
 
 
@@ -1622,7 +1733,7 @@ class Project(object):
         if epname not in eps:
             logWarning('Project: Invalid EP name `{}` !'.format(epname))
             return False
-        if file_id not in eps[epname]['suites'].get_files():
+        if not eps[epname]['suites'].is_file(file_id):
             logWarning('Project: Invalid File ID `{}` !'.format(file_id))
             return False
 
@@ -1646,7 +1757,7 @@ class Project(object):
         if epname not in eps:
             logWarning('Project: Invalid EP name `{}` !'.format(epname))
             return False
-        if file_id not in eps[epname]['suites'].get_files():
+        if not eps[epname]['suites'].is_file(file_id):
             logWarning('Project: Invalid File ID `{}` !'.format(file_id))
             return False
         if not key:
@@ -1662,13 +1773,15 @@ class Project(object):
             return False
         file_node[key] = value
 
-        self._dump()
+        self._journal(user, epname, fname=file_id, key=key, value=value)
         return True
 
 
-    def get_dependency_info(self, user, dep_id):
+    def get_dependency_info(self, user, dep_id, epname=None):
         """
         Retrieve all info available, about one Test File.\n
+        If the EP name is known and the dependency didn't finish yet,
+        the EP is notified when the dependency finishes.
         """
         logFull('CeProject:get_dependency_info user `{}`.'.format(user))
         res = self.authenticate(user)
@@ -1676,25 +1789,80 @@ class Project(object):
             return {}
         found = False
 
-        # Cycle all EPs to find the dependency
-        for epname, epinfo in self.users[user]['eps'].iteritems():
-            # Empty EP data ?
-            if not epinfo.get('suites'):
-                continue
-            # Cycle all files
-            for file_id in epinfo['suites'].get_files():
-                file_node = epinfo['suites'].find_id(file_id)
-                if not file_node:
-                    continue
-                if file_node.get('_dep_id') == dep_id:
-                    found = dict(file_node)
-                    found['ep'] = epname
-                    found['id'] = file_id
-                    break
+        dep_ep, file_id, file_node = self._find_dependency(user, dep_id)
+        if file_node:
+            found = dict(file_node)
+            found['ep'] = dep_ep
+            found['id'] = file_id
+
+        if found and epname and found.get('status', STATUS_PENDING) in [STATUS_PENDING, STATUS_WORKING]:
+            with self.dep_lock:
+                self.dep_waiters.setdefault(user, {}).setdefault(dep_id, set()).add(epname)
 
         return found
 
 
+    def get_dependencies_status(self, user, dep_ids):
+        """
+        Returns the status of more dependencies, as a tuple of pairs (dep ID, status).\n
+        The status of an unknown dependency is -1.
+        """
+        logFull('CeProject:get_dependencies_status user `{}`.'.format(user))
+        res = self.authenticate(user)
+        if not res:
+            return ()
+        result = []
+        for dep_id in dep_ids:
+            _, _, file_node = self._find_dependency(user, dep_id)
+            if file_node:
+                result.append((dep_id, file_node.get('status', STATUS_PENDING)))
+            else:
+                result.append((dep_id, -1))
+        return tuple(result)
+
+
+    def _find_dependency(self, user, dep_id):
+        """
+        Find a test by dependency ID, using the dependency index.\n
+        The index is created the first time it's needed, after the EPs change.
+        Returns (EP name, file ID, file node), or (None, None, None).
+        """
+        index = self.dep_index.get(user)
+        if index is None:
+            index = {}
+            for epname, epinfo in self.users[user]['eps'].iteritems():
+                # Empty EP data ?
+                if not epinfo.get('suites'):
+                    continue
+                for file_id in epinfo['suites'].get_files():
+                    file_node = epinfo['suites'].find_id(file_id)
+                    if file_node and file_node.get('_dep_id'):
+                        # The first test with this ID wins
+                        index.setdefault(file_node['_dep_id'], (epname, file_id))
+            self.dep_index[user] = index
+
+        if dep_id not in index:
+            return None, None, None
+        epname, file_id = index[dep_id]
+        epinfo = self.users[user]['eps'].get(epname)
+        if not epinfo or not epinfo.get('suites'):
+            return None, None, None
+        return epname, file_id, epinfo['suites'].find_id(file_id)
+
+
+    def _push_dependency_done(self, user, dep_id, status):
+        """
+        Notify the EPs waiting for a dependency, that the dependency finished.
+        """
+        with self.dep_lock:
+            waiters = self.dep_waiters.get(user, {}).pop(dep_id, None)
+        if not waiters or not self.rsrv:
+            return False
+        for epname in waiters:
+            self.rsrv.service.push_ep_event(user, epname, 'dependency_done', dep_id, status)
+        return True
+
+
 # # #
 
 
@@ -1780,6 +1948,18 @@ class Project(object):
         return epname
 
 
+    def _push_ep_status(self, user, epname):
+        """
+        Send the current status to the EP, so it doesn't have to poll for it.
+        """
+        if not self.rsrv:
+            return False
+        reversed = dict((v, k) for k, v in EXEC_STATUS.iteritems())
+        status = self.get_ep_info(user, epname).get('status', STATUS_INVALID)
+        return self.rsrv.service.push_ep_event(user, epname, 'set_ep_status',\
+            reversed.get(status, 'invalid'))
+
+
     def set_exec_status(self, user, epname, new_status, msg=''):
         """
         Set execution status for one EP. (0, 1, 2, or 3)
@@ -1823,6 +2003,9 @@ class Project(object):
             logError('Project: Cannot change status for EP `{} {}` !'.format(user, epname))
             return False
 
+        # The EP doesn't have to ask for the new status
+        self._push_ep_status(user, epname)
+
         # All active EPs for this project...
         project_eps = self.parsers[user].getActiveEps()
         # All REAL, registered EPs
@@ -1834,7 +2017,8 @@ class Project(object):
         if new_status == STATUS_RUNNING:
             self.rsrv.service.exposed_start_ep(epname, user)
         elif new_status == STATUS_STOP:
-            # Call the backup logs
+            # Write all the pending logs, then backup the logs
+            self.localFs.flush_user_files(user)
             self.backup_logs(user)
             self.rsrv.service.exposed_stop_ep(epname, user)
 
@@ -2014,6 +2198,10 @@ class Project(object):
                 return msg
 
             self.reset_logs(user)
+            # Forget the CLI log from the last run
+            for key in self.panic_tails.keys():
+                if key[0] == user:
+                    self.panic_tails.pop(key, None)
 
             # User start time and elapsed time
             self.set_user_info(user, 'start_time', datetime.datetime.today().strftime('%Y-%m-%d %H:%M:%S'))
@@ -2077,6 +2265,7 @@ class Project(object):
                     with self.stt_lock:
                         self.users[user]['eps'][anonim_ep] = self.users[user]['eps'][epname]
                         del self.users[user]['eps'][epname]
+                    self.dep_index.pop(user, None)
                     # The new name
                     epname = anonim_ep
                 # Set the NEW EP status
@@ -2144,6 +2333,7 @@ class Project(object):
             del parser, plugins
 
             # Backup the logs when user pressed STOP
+            self.localFs.flush_user_files(user)
             self.backup_logs(user)
 
             # Cycle all project EPs to: STOP them and to change the PENDING status to NOT_EXEC
@@ -2163,6 +2353,7 @@ class Project(object):
 
                 # Set the NEW EP status
                 self.set_ep_info(user, epname, 'status', new_status)
+                self._push_ep_status(user, epname)
                 # Send STOP to EP Manager
                 rpyc_srv.exposed_stop_ep(epname, user)
 
@@ -2188,6 +2379,7 @@ class Project(object):
                     continue
                 # Set the NEW EP status
                 self.set_ep_info(user, epname, 'status', new_status)
+                self._push_ep_status(user, epname)
 
         # All active EPs for this project, refresh after all settings...
         project_eps = self.parsers[user].getActiveEps()
@@ -2338,11 +2530,15 @@ class Project(object):
 
             # Get logSummary path from framework config
             log_path = self.get_user_info(user, 'log_types')['logSummary']
-            resp = self.localFs.write_user_file(user, log_path, log_msg, 'a')
+            resp = self.localFs.append_user_file(user, log_path, log_msg)
 
             if isinstance(resp, str):
                 logError('Summary log file for `{}` cannot be written! User won\'t see any statistics!'.format(user))
 
+            # Wake up the EPs waiting for this file
+            if data.get('_dep_id') and new_status != STATUS_PENDING:
+                self._push_dependency_done(user, data['_dep_id'], new_status)
+
         # Return string
         return status_str
 
@@ -2379,6 +2575,81 @@ class Project(object):
         return True
 
 
+    def report_test_batch(self, user, epname, batch):
+        """
+        Apply a batch of updates sent by an EP, in one call.
+        The batch is a sequence of operations, applied in order:
+
+        - ('status', file_id, new_status, time_elapsed)
+        - ('file_var', file_id, key, value)
+        - ('ep_var', key, value)
+        - ('log', log_type, message)
+        - ('suite_var', suite_id, key)
+        - ('echo', message)
+
+        Consecutive log messages of the same type are written at once.
+        Returns a pair with the EP status and the results of the suite
+        variable queries, in order.
+        """
+        logFull('CeProject:report_test_batch user `{}`.'.format(user))
+        res = self.authenticate(user)
+        if not res:
+            return False
+
+        if epname not in self.users[user]['eps']:
+            logDebug('Project: Invalid EP name `{}` !'.format(epname))
+            return False
+
+        results = []
+        # Log messages waiting to be written, for one log type
+        pending_log = [None, []]
+
+        def write_pending():
+            """ write the collected log messages """
+            if pending_log[1]:
+                self.log_message(user, pending_log[0], ''.join(pending_log[1]))
+            pending_log[0] = None
+            pending_log[1] = []
+
+        for oper in batch:
+            if not oper:
+                continue
+            cmd, args = oper[0], oper[1:]
+
+            if cmd == 'log':
+                if pending_log[0] != args[0]:
+                    write_pending()
+                    pending_log[0] = args[0]
+                pending_log[1].append(args[1])
+                continue
+
+            write_pending()
+
+            try:
+                if cmd == 'status':
+                    self.set_file_status(user, epname, *args)
+                elif cmd == 'file_var':
+                    self.set_file_info(user, epname, *args)
+                elif cmd == 'ep_var':
+                    self.set_ep_info(user, epname, *args)
+                elif cmd == 'suite_var':
+                    data = self.get_suite_info(user, epname, args[0])
+                    results.append(data.get(args[1], False) if data else False)
+                elif cmd == 'echo':
+                    logInfo(':: {}'.format(args[0]))
+                else:
+                    logWarning('Report batch: Unknown operation `{}` from `{}:{}`!'.format(cmd, user, epname))
+            except Exception:
+                trace = traceback.format_exc()[34:].strip()
+                logWarning('Report batch: Cannot apply `{}` from `{}:{}`: `{}`!'.format(cmd, user, epname, trace))
+
+        write_pending()
+
+        reversed = dict((v, k) for k, v in EXEC_STATUS.iteritems())
+        ep_status = self.users[user]['eps'][epname].get('status', STATUS_INVALID)
+        return (reversed.get(ep_status, 'invalid'), tuple(results))
+
+
 # # #
 
 
@@ -2494,8 +2765,7 @@ class Project(object):
             finfo['Runnable'] = "true"
 
             # Add file for the user, in a specific suite
-            suite = suites_manager.find_id(suite_id)
-            suite['children'][file_id] = finfo
+            suites_manager.add_node(suite_id, file_id, finfo)
 
             # Add the file in suites.xml ?
             # self.setPersistentFile(self, user, suite, fname)
@@ -2555,12 +2825,11 @@ class Project(object):
             # All files from Suite ID
             suite_id = rest
 
-            if suite_id not in suites_manager.get_suites():
+            if not suites_manager.is_suite(suite_id):
                 log = '*ERROR* Invalid Suite ID `{}` !'.format(suite_id)
                 logError(log)
                 return log
 
-            suite_node = suites_manager.find_id(suite_id)
             files = suites_manager.get_files(suite_id, True)
             logDebug('Removing file IDs `{}` from `{}:{}`...'.format(', '.join(files), epname, suite_id))
 
@@ -2569,7 +2838,7 @@ class Project(object):
             file_id = rest
             suite_id = None
 
-            if file_id not in suites_manager.get_files(None, True):
+            if not suites_manager.is_file(file_id):
                 log = '*ERROR* Invalid File ID `{}` !'.format(file_id)
                 logError(log)
                 return log
@@ -2579,7 +2848,6 @@ class Project(object):
 
         else:
             suite_id = None
-            suite_node = None
 
             if not suites_manager.get_files(None, True):
                 log = '*ERROR* No files left to unqueue!'
@@ -2589,7 +2857,6 @@ class Project(object):
             for s_id, node in suites_manager.iter_nodes(None, []):
                 if node['type'] == 'suite' and node['name'] == rest:
                     suite_id = s_id
-                    suite_node = node
 
             if not suite_id:
                 log = '*ERROR* Invalid suite name `{}`!'.format(rest)
@@ -2616,12 +2883,8 @@ class Project(object):
                 logError(log)
                 return log
 
-            if not suite_id:
-                suite_id = file_node['suite']
-                suite_node = suites_manager.find_id(suite_id)
-
-            if not suite_node:
-                log = '*ERROR* Invalid Suite node `{}` !'.format(suite_id)
+            if not suites_manager.get_parent(file_id):
+                log = '*ERROR* Invalid Suite node for file `{}` !'.format(file_id)
                 logError(log)
                 return log
 
@@ -2631,7 +2894,7 @@ class Project(object):
                 file_index = self.test_ids[user].index(file_id)
                 self.test_ids[user].pop(file_index)
                 # Remove file from suites
-                del suite_node['children'][file_id]
+                suites_manager.del_node(file_id)
 
         self._dump()
         return ', '.join(files)
@@ -2771,6 +3034,60 @@ class Project(object):
             logDebug('Current project deep libraries for user `{}`: {}.'.format(user, libs))
             return libs
 
+
+    def get_libraries_manifest(self, user, libs_list):
+        """
+        Returns the files of some libraries, with their SHA1, as a tuple of
+        (library, ((path, sha1, size), ...)), so the EPs can download only the changed files.\n
+        The user libraries have priority over the global libraries.
+        Returns False if the libraries are in ClearCase; the EPs must download the archives.
+        """
+        logFull('CeProject:get_libraries_manifest user `{}`.'.format(user))
+
+        if self.get_clearcase_config(user, 'libs_path'):
+            return False
+
+        glob_root = (TWISTER_PATH + '/lib/').replace('//', '/')
+        user_root = (self.get_user_info(user, 'libs_path') or '').rstrip('/') + '/'
+        blobs = self.lib_blobs.setdefault(user, {})
+        manifest = []
+
+        for name in libs_list:
+            name = name.lstrip('/')
+            files = ''
+            if user_root != '/':
+                files = self.localFs.hash_user_files(user, user_root + name, user_root)
+            if not files or isinstance(files, str):
+                files = self.localFs.hash_system_files(glob_root + name, glob_root)
+                if isinstance(files, str):
+                    logDebug('Libraries manifest: Cannot find library `{}`, user `{}`.'.format(name, user))
+                    manifest.append((name, ()))
+                    continue
+                for rel_path, digest, _ in files:
+                    blobs[digest] = (glob_root + rel_path, True)
+            else:
+                for rel_path, digest, _ in files:
+                    blobs[digest] = (user_root + rel_path, False)
+            manifest.append((name, tuple(files)))
+
+        return tuple(manifest)
+
+
+    def read_library_blob(self, user, digest, fstart=0, flen=0):
+        """
+        Returns a chunk of one library file by SHA1, from the files listed in the last manifest.
+        Max `flen` bytes from position `fstart`; an empty chunk means the end of the file.
+        """
+        logFull('CeProject:read_library_blob user `{}`.'.format(user))
+        blob = self.lib_blobs.get(user, {}).get(digest)
+        if not blob:
+            return '*ERROR* Unknown library file `{}`, user `{}`!'.format(digest, user)
+        fpath, is_global = blob
+        flen = min(flen, MAX_CHUNK) if flen else MAX_CHUNK
+        if is_global:
+            return self.localFs.read_system_file(fpath, 'rb', fstart, flen)
+        return self.localFs.read_user_chunk(user, fpath, fstart, flen)
+
     def send_mail(self, user, force=False):
         """
         Send e-mail function.\n
@@ -3095,9 +3412,47 @@ class Project(object):
 # # #
 
 
+    def _get_log_plugins(self, user):
+        """
+        Returns the list of (name, instance) for the plugins that override `onLog`.\n
+        The list is created again only when plugins.xml is changed.
+        """
+        cfg_path = '{}/twister/config/plugins.xml'.format(userHome(user))
+        try:
+            m_time = os.path.getmtime(cfg_path)
+        except Exception:
+            return []
+
+        cached = self.log_plugins.get(user)
+        if cached and cached[0] == m_time:
+            return cached[1]
+
+        base_on_log = BasePlugin.BasePlugin.onLog.__func__
+        log_plugins = []
+        try:
+            plugins = PluginParser(user).getPlugins()
+        except Exception as exp_err:
+            logWarning('Plug-ins: Cannot load the plugins for `{}`: `{}`!'.format(user, exp_err))
+            plugins = {}
+
+        for pname, pdict in plugins.iteritems():
+            on_log = getattr(pdict['plugin'], 'onLog', None)
+            # This plugin doesn't do anything with the logs
+            if getattr(on_log, '__func__', None) is base_on_log:
+                continue
+            plugin = self._build_plugin(user, pname, {'log_type': 'cli'})
+            if plugin:
+                log_plugins.append((pname, plugin))
+
+        logDebug('Plug-ins: User `{}` has `{}` plugins with onLog.'.format(user, len(log_plugins)))
+        self.log_plugins[user] = (m_time, log_plugins)
+        return log_plugins
+
+
     def get_log_file(self, user, read, fstart, filename):
         """
         Called in the Java GUI to show the logs.
+        Returns the log from position `fstart` until the end, encoded in base64.
         """
         logFull('CeProject:get_log_file user `{}`.'.format(user))
         if fstart is None:
@@ -3131,10 +3486,19 @@ class Project(object):
 
         if filename.startswith(TWISTER_PATH):
             data = self.localFs.read_system_file(filename, flag='r', fstart=fstart)
-        else:
-            data = self.localFs.read_user_file(user, filename, flag='r', fstart=fstart)
+            return binascii.b2a_base64(data)
 
-        return binascii.b2a_base64(data)
+        # Encode the log chunk by chunk, so only the encoded log is kept in memory;
+        # the chunk size is a multiple of 3, so the encoded chunks can be joined
+        # without padding in the middle
+        encoded = []
+        try:
+            for chunk in self.localFs.iter_user_file(user, filename, fstart, chunk=LOG_CHUNK):
+                encoded.append(binascii.b2a_base64(chunk)[:-1])
+        except IOError as exp_err:
+            return binascii.b2a_base64(str(exp_err))
+
+        return ''.join(encoded) + '\n'
 
 
     def find_log(self, user, ltype, file_id, file_name, epname=None):
@@ -3154,21 +3518,69 @@ class Project(object):
             logDebug('Find Log: Cannot find log type `{}` for user `{}`!'.format(ltype, user))
             return '*no log*'
 
-        data = self.localFs.read_user_file(user, log_path)
+        test_key = '{}:{}'.format(file_id, file_name)
 
-        if data.startswith('*ERROR*'):
-            logDebug(data)
+        # Read only the part of the log, between the START and END markers
+        rng = self.log_index.find(user, log_path, test_key)
+        if rng:
+            # Only the first part of a huge test log is returned
+            flen = min(rng[1] - rng[0], LOG_PAGE)
+            try:
+                data = ''.join(self.localFs.iter_user_file(user, log_path, rng[0], flen))
+            except IOError as exp_err:
+                data = str(exp_err)
+            if data.startswith('<<< START filename: `{}`'.format(test_key)):
+                if flen < rng[1] - rng[0]:
+                    return data + LOG_TRUNCATED.format(log_path)
+                if data.endswith('<<< END filename: `{}` >>>'.format(test_key)):
+                    return data
+            logDebug('Find Log: Invalid index for `{}` in log `{}`; will search the log.'.format(test_key, log_path))
+
+        start_mark = '<<< START filename: `{}'.format(test_key)
+        end_mark = '<<< END filename: `{}` >>>'.format(test_key)
+        # Scan the log in chunks; only the part of the test is kept in memory
+        found = []
+        kept = 0
+        text = ''
+        fend = -1
+
+        try:
+            for chunk in self.localFs.iter_user_file(user, log_path, chunk=LOG_CHUNK):
+                text += chunk
+                if not found:
+                    fbegin = text.find(start_mark)
+                    if fbegin == -1:
+                        # Keep the end, in case the marker is split between chunks
+                        text = text[-len(end_mark):]
+                        continue
+                    text = text[fbegin:]
+                    found.append('')
+                fend = text.find(end_mark)
+                if fend != -1:
+                    found.append(text[:fend + len(end_mark)])
+                    break
+                # Keep the end, in case the marker is split between chunks
+                found.append(text[:-len(end_mark)])
+                kept += len(found[-1])
+                text = text[-len(end_mark):]
+                # Only the first part of a huge test log is returned
+                if kept >= LOG_PAGE:
+                    break
+        except IOError as exp_err:
+            logDebug(exp_err)
             return '*no log*'
 
-        fbegin = data.find('<<< START filename: `{}:{}'.format(file_id, file_name))
-        if fbegin == -1:
-            logDebug('Find Log: Cannot find `{}:{}` in log `{}`!'.format(file_id, file_name, log_path))
+        if not found:
+            logDebug('Find Log: Cannot find `{}` in log `{}`!'.format(test_key, log_path))
             return '*no log*'
 
-        fend = data.find('<<< END filename: `{}:{}'.format(file_id, file_name))
-        fend += len('<<< END filename: `{}:{}` >>>'.format(file_id, file_name))
+        if kept >= LOG_PAGE:
+            found.append(LOG_TRUNCATED.format(log_path))
+        elif fend == -1:
+            # Not finished; return everything after the START marker
+            found.append(text)
 
-        return data[fbegin:fend]
+        return ''.join(found)
 
 
     def log_message(self, user, log_type, log_msg):
@@ -3192,12 +3604,13 @@ class Project(object):
             return False
 
         log_path = self.get_user_info(user, 'log_types')[log_type]
-        return self.localFs.write_user_file(user, log_path, log_msg, 'a')
+        return self.log_index.append(user, log_path, log_msg)
 
 
-    def log_live(self, user, epname, log_msg):
+    def log_live(self, user, epname, log_msg, compressed=False):
         """
         Writes CLI messages in a big log, so all output can be checked LIVE.\n
+        The message is base64, or zlib compressed if `compressed` is True.\n
         Called from the EP.
         """
         logFull('CeProject:log_live user `{}`.'.format(user))
@@ -3212,22 +3625,26 @@ class Project(object):
             logError('Log Error for `{}`: Invalid EP name `{}` !'.format(user, epname))
             return False
 
-        try:
-            log_string = binascii.a2b_base64(log_msg)
-        except Exception:
-            logError('Log Error for `{}`: Invalid base64 log!'.format(user))
-            return False
+        if compressed:
+            try:
+                log_string = zlib.decompress(log_msg)
+            except Exception:
+                logError('Log Error for `{}`: Invalid compressed log!'.format(user))
+                return False
+        else:
+            try:
+                log_string = binascii.a2b_base64(log_msg)
+            except Exception:
+                logError('Log Error for `{}`: Invalid base64 log!'.format(user))
+                return False
 
-        # Execute "onLog" for all plugins
-        plugins = PluginParser(user).getPlugins()
-        for pname in plugins:
-            plugin = self._build_plugin(user, pname, {'log_type': 'cli'})
+        # Execute "onLog" for the plugins that implement it
+        for pname, plugin in self._get_log_plugins(user):
             try:
                 plugin.onLog(epname, log_string)
             except Exception as exp_err:
                 trace = traceback.format_exc()[34:].strip()
-                logWarning('Error on running plugin `{} onStop` for `{}` - Exception: `{}`!'.format(pname, user, trace))
-        del plugins
+                logWarning('Error on running plugin `{} onLog` for `{}` - Exception: `{}`!'.format(pname, user, trace))
 
         # Calling Panic Detect
         panic_det = self._panic_detect_log_parse(user, epname, log_string)
@@ -3240,7 +3657,7 @@ class Project(object):
         if panic_det:
             self.log_message(user, 'logRunning', 'PANIC DETECT: Execution stopped.')
 
-        return self.localFs.write_user_file(user, log_path, log_string, 'a')
+        return self.log_index.append(user, log_path, log_string)
 
 
     def reset_log(self, user, log_name):
@@ -3274,6 +3691,7 @@ class Project(object):
 
         # This will overwrite the file completely
         ret = self.localFs.write_user_file(user, log_path, '')
+        self.log_index.reset(user, log_path)
 
         if ret is True:
             logDebug('Log `{}` reset for user `{}`.'.format(log_path, user))
@@ -3331,6 +3749,9 @@ class Project(object):
         logs_path = self.get_user_info(user, 'logs_path')
         ar_logs_path = self.get_user_info(user, 'archive_logs_path').rstrip('/')
 
+        # The pending logs must not be written after the reset
+        self.localFs.flush_user_files(user)
+
         # Find all user log files. Validate first.
         logs = self.localFs.list_user_files(user, logs_path)
         if not (logs and isinstance(logs, dict) and logs.get('children')):
@@ -3349,6 +3770,8 @@ class Project(object):
                 success = False
                 logError('Cannot reset log `{}` in `{}`! Error `{}`!'.format(log, ar_logs_path, ret))
 
+        self.log_index.reset(user)
+
         if success:
             logDebug('All logs reset for user `{}`.'.format(user))
             return True
@@ -3357,45 +3780,119 @@ class Project(object):
             return False
 
 
+    def _panic_detect_matcher(self, user):
+        """
+        Returns the compiled Panic Detect expressions of one user, as a tuple:
+        (one regex with all simple expressions, list of (expression, regex) for the
+        simple expressions, list of (expression, regex) for the rest).\n
+        The expressions are compiled once, until the Panic Detect config is changed.
+        """
+        matcher = self.panic_matchers.get(user)
+        if matcher is not None:
+            return matcher
+
+        with self.panic_lock:
+            try:
+                with open(self.panic_cfg_path, 'rb') as config:
+                    reg_exprs = json.load(config).get(user, {})
+            except Exception as exp_err:
+                logError('Panic Detect: Cannot load config for user `{}`: `{}`!'.format(user, exp_err))
+                reg_exprs = {}
+
+        simple = []
+        others = []
+        for value in reg_exprs.itervalues():
+            if value.get('enabled') != 'true':
+                continue
+            try:
+                regex = re.compile(value['expression'])
+            except Exception as exp_err:
+                logError('Panic Detect: Invalid expression `{}` for user `{}`: `{}`!'.format(
+                    value.get('expression'), user, exp_err))
+                continue
+            # Expressions with groups might have back-references, and the inline
+            # flags, like `(?i)`, would apply to all the joined expressions
+            if regex.groups or regex.flags != PANIC_NO_FLAGS or PANIC_INLINE_FLAG.search(value['expression']):
+                others.append((value['expression'], regex))
+            else:
+                simple.append((value['expression'], regex))
+
+        combined = None
+        if simple:
+            try:
+                combined = re.compile('|'.join('(?:{})'.format(expr) for expr, _ in simple))
+            except Exception:
+                others = simple + others
+                simple = []
+
+        matcher = (combined, simple, others)
+        self.panic_matchers[user] = matcher
+        return matcher
+
+
     def _panic_detect_log_parse(self, user, epname, log_string):
         """
-        Panic Detect parse log mechanism.
+        Panic Detect parse log mechanism.\n
+        The end of the previous chunk is kept, so the expressions split
+        between two chunks are also found.
         """
         logFull('CeProject:_panic_detect_log_parse user `{}`.'.format(user))
-        status = False
-        self.panic_detect_config(user, {'command': 'list'})
+        combined, simple, others = self._panic_detect_matcher(user)
 
-        with open(self.panic_cfg_path, 'rb') as config:
-            self.panic_detect_reg_exprs = json.load(config)
-
-        if user not in self.panic_detect_reg_exprs:
-            return status
+        if not combined and not others:
+            return False
 
-        # Verify if for current suite Panic Detect is enabled
-        suite_id = self.get_ep_info(user, epname).get('curent_suite')
+        # Verify if for current suite Panic Detect is enabled;
+        # the worker processes of the EP run other suites, in parallel, and
+        # their log is not separated, so any running suite can enable it
+        ep_info = self.get_ep_info(user, epname)
+        suite_ids = [ep_info[key] for key in ep_info.keys() \
+            if (key == 'curent_suite' or key.startswith('curent_suite_')) and ep_info[key]]
         # When running first, the current_suite is not defined yet
-        if not suite_id:
-            return status
+        if not suite_ids:
+            return False
 
-        enabled = self.get_suite_info(user, epname, suite_id).get('pd')
+        enabled = False
+        for suite_id in suite_ids:
+            pd = self.get_suite_info(user, epname, suite_id).get('pd')
+            if pd and pd.lower() != 'false':
+                enabled = True
+                break
 
-        if not enabled or enabled.lower() == 'false':
-            return status
+        if not enabled:
+            self.panic_tails.pop((user, epname), None)
+            return False
 
-        for key, value in self.panic_detect_reg_exprs[user].iteritems():
-            if value.get('enabled') == 'true':
-                try:
-                    if re.search(value['expression'], log_string):
-                        # Stop EP
-                        self.set_exec_status(user, epname, STATUS_STOP,\
-                        msg='Panic detect activated, expression `{}` found in \
-                        CLI log!'.format(value['expression']))
-                        status = True
-                except Exception as exc_err:
-                    trace = traceback.format_exc()[34:].strip()
-                    logError(trace)
+        text = self.panic_tails.get((user, epname), '') + log_string
+        found = None
 
-        return status
+        if combined:
+            match = combined.search(text)
+            if match:
+                found = match.group(0)
+                # Which expression matched?
+                for expression, regex in simple:
+                    if regex.match(text, match.start()):
+                        found = expression
+                        break
+        if not found:
+            for expression, regex in others:
+                if regex.search(text):
+                    found = expression
+                    break
+
+        if not found:
+            self.panic_tails[(user, epname)] = text[-PANIC_TAIL_SIZE:]
+            return False
+
+        # The text was already matched
+        self.panic_tails.pop((user, epname), None)
+        # Stop EP
+        self.set_exec_status(user, epname, STATUS_STOP,\
+        msg='Panic detect activated, expression `{}` found in \
+        CLI log!'.format(found))
+
+        return True
 
 
     def panic_detect_config(self, user, args):
@@ -3480,6 +3977,8 @@ class Project(object):
                     config = open(self.panic_cfg_path, 'wb')
                     json.dump(self.panic_detect_reg_exprs, config)
                     config.close()
+                # The expressions must be compiled again
+                self.panic_matchers.pop(user, None)
 
                 #response['data'] = reg_exp_id
                 response = reg_exp_id
@@ -3511,6 +4010,8 @@ class Project(object):
                     config = open(self.panic_cfg_path, 'wb')
                     json.dump(self.panic_detect_reg_exprs, config)
                     config.close()
+                # The expressions must be compiled again
+                self.panic_matchers.pop(user, None)
 
                 #response['data'] = reg_exp_id
                 response = True
@@ -3533,6 +4034,8 @@ class Project(object):
                     config = open(self.panic_cfg_path, 'wb')
                     json.dump(self.panic_detect_reg_exprs, config)
                     config.close()
+                # The expressions must be compiled again
+                self.panic_matchers.pop(user, None)
 
                 #response['data'] = reg_exp_id
                 response = True
@@ -109,21 +109,40 @@ def _recursive_find_id(parent_node, node_id, path=[]):
             return result
 
 
-def _recursive_refresh_id(node):
+def _collect_ids(parent_node, ids):
+    """ set of all the ids from a node """
+    stack = [parent_node]
+    while stack:
+        node = stack.pop()
+        if not isinstance(node, dict):
+            continue
+        if node.get('id'):
+            ids.add(node['id'])
+        if node.get('children'):
+            stack.extend(node['children'].values())
+    return ids
+
+
+def _recursive_refresh_id(node, used_ids=None):
     """ refresh ids """
 
+    # The ids are collected only once, for the whole tree
+    if used_ids is None:
+        used_ids = _collect_ids(node, set())
+
     res_id = False
     while not res_id:
         res_id = hexlify(os.urandom(5))
         # If by any chance, this ID already exists, generate another one!
-        if _recursive_find_id(node, res_id, []):
+        if res_id in used_ids:
             res_id = False
 
+    used_ids.add(res_id)
     node.update([('id', res_id), ])
 
     if node['children']:
         for c_child in node['children']:
-            node['children'][c_child] = _recursive_refresh_id(node['children'][c_child])
+            node['children'][c_child] = _recursive_refresh_id(node['children'][c_child], used_ids)
 
     return node
 
@@ -31,6 +31,7 @@ import copy
 import time
 import thread
 import traceback
+import zlib
 import rpyc
 from lxml import etree
 
@@ -47,6 +48,10 @@ from common.helpers    import userHome, re
 from common.tsclogging import logError, logInfo, logFull, logDebug, logWarning
 from common.tsclogging import getLogLevel, setLogLevel
 from common.xmlparser  import PluginParser
+from server.CeFs       import MAX_CHUNK
+
+# The events pushed to the EPs; the EP functions are resolved when the EP says hello
+EP_EVENTS = ('set_ep_status', 'dependency_done')
 
 #
 
@@ -67,6 +72,8 @@ class CeRpycService(rpyc.Service):
     #    'checked': True, 'user': '...',
     #    'conn': <Remote RPyc Service>,
     #    'eps': ['...'],
+    #    'ep_events': True, # The EP accepts pushed events
+    #    'ep_calls': {'set_ep_status': <async EP function>, ...},
     #   }
     conns = {}
     conn_lock = thread.allocate_lock()
@@ -260,10 +267,20 @@ class CeRpycService(rpyc.Service):
             del extra['user']
         if 'checked' in extra:
             del extra['checked']
+        if 'ep_calls' in extra:
+            del extra['ep_calls']
         if 'eps' in extra:
             # Register the VALID eps...
             self.register_eps(extra['eps'])
             del extra['eps']
+        if extra.get('ep_events'):
+            # Resolve the EP functions only once, so pushing an event never waits for the EP
+            extra['ep_calls'] = {}
+            for event in EP_EVENTS:
+                try:
+                    extra['ep_calls'][event] = rpyc.async(getattr(self._conn.root, event))
+                except Exception as exp_err:
+                    logWarning('EP `{}` cannot receive event `{}`: {}'.format(hello, event, exp_err))
 
         with self.conn_lock:
             old_data = self.conns.get(str_addr, {})
@@ -292,6 +309,13 @@ class CeRpycService(rpyc.Service):
             old_data.update({'checked': resp, 'user': user})
             self.conns[str_addr] = old_data
 
+        # The identity of this connection
+        self._auth_user = user if resp else None
+
+        # Start the User Service, before the user needs it
+        if resp:
+            self.project.localFs.prespawn(user)
+
         logDebug('User login: `{}`: {}.'.format(user, 'success' if resp else 'failure'))
         return resp
 
@@ -302,12 +326,17 @@ class CeRpycService(rpyc.Service):
         then check user login.
         """
         logFull('CeRpyc:_check_login')
+        # The identity is cached on the connection, after login
+        user = getattr(self, '_auth_user', None)
+        if user:
+            return user
         str_addr = self._get_addr()
-        check = self.conns[str_addr].get('checked')
-        user = self.conns[str_addr].get('user')
+        check = self.conns.get(str_addr, {}).get('checked')
+        user = self.conns.get(str_addr, {}).get('user')
         if (not check) or (not user):
             return False
         else:
+            self._auth_user = user
             return user
 
 
@@ -463,13 +492,27 @@ class CeRpycService(rpyc.Service):
         return self.project.set_file_info(user, epname, filename, variable, value)
 
 
-    def exposed_get_dependency_info(self, dep_id):
-        """ get infromation about dependencies """
+    def exposed_get_dependency_info(self, dep_id, epname=None):
+        """
+        Get infromation about dependencies.
+        If the EP name is given, the EP is notified when the dependency finishes.
+        """
         logFull('CeRpyc:exposed_get_dependency_info')
         user = self._check_login()
         if not user:
             return False
-        return self.project.get_dependency_info(user, dep_id)
+        return self.project.get_dependency_info(user, dep_id, epname)
+
+
+    def exposed_get_dependencies_status(self, dep_ids):
+        """
+        Get the status of more dependencies, in one call.
+        """
+        logFull('CeRpyc:exposed_get_dependencies_status')
+        user = self._check_login()
+        if not user:
+            return False
+        return self.project.get_dependencies_status(user, dep_ids)
 
 
 # # #   Persistence   # # #
@@ -946,6 +989,35 @@ class CeRpycService(rpyc.Service):
             return False
 
 
+    @classmethod
+    def push_ep_event(cls, user, epname, event, *args):
+        """
+        Send an event (status change, dependency finished) to a running EP.
+        Only the EPs that declared `ep_events` in their hello receive events.
+        The call is async, the Central Engine doesn't wait for the EP.
+        """
+        logFull('CeRpyc:push_ep_event')
+        found = []
+
+        for str_addr, data in cls.conns.items():
+            if user != data.get('user') or not data.get('checked'):
+                continue
+            if not data.get('ep_calls', {}).get(event):
+                continue
+            # Normal EPs say hello as `ep::name`, portable EPs register as clients
+            if data.get('hello') == 'ep::' + epname or epname in (data.get('eps') or []):
+                found.append(data['ep_calls'][event])
+
+        for ep_call in found:
+            try:
+                ep_call(*args)
+            except Exception:
+                trace = traceback.format_exc()[34:].strip()
+                logWarning('Cannot send event `{}` to EP `{}:{}`: {}'.format(event, user, epname, trace))
+
+        return bool(found)
+
+
 # # #   EP and File statuses   # # #
 
 
@@ -1066,6 +1138,21 @@ class CeRpycService(rpyc.Service):
         return self.project.set_file_status_all(user, epname, new_status)
 
 
+    def exposed_report_test_batch(self, epname, batch):
+        """
+        Apply all the updates collected by the Runner for one test:
+        file statuses, file and EP variables, log messages and heartbeats.
+        The batch should be a tuple of tuples, so RPyc sends it by value.
+        Returns the EP status and the results of the queries.
+        Called from the Runner.
+        """
+        logFull('CeRpyc:exposed_report_test_batch')
+        user = self._check_login()
+        if not user:
+            return False
+        return self.project.report_test_batch(user, epname, batch)
+
+
 # # #   Download Files and Libraries   # # #
 
 
@@ -1192,6 +1279,30 @@ class CeRpycService(rpyc.Service):
                 return resp
 
 
+    def exposed_get_libraries_manifest(self, libs_list):
+        """
+        Returns the files of some libraries, with their SHA1.
+        The EP downloads only the files it doesn't have.
+        """
+        logFull('CeRpyc:exposed_get_libraries_manifest')
+        user = self._check_login()
+        if not user:
+            return False
+        return self.project.get_libraries_manifest(user, libs_list)
+
+
+    def exposed_download_library_blob(self, digest, fstart=0, flen=0):
+        """
+        Sends a chunk of one library file to the EP, by SHA1.
+        An empty chunk means the end of the file.
+        """
+        logFull('CeRpyc:exposed_download_library_blob')
+        user = self._check_login()
+        if not user:
+            return False
+        return self.project.read_library_blob(user, digest, fstart, flen)
+
+
     def exposed_get_ep_files(self, epname):
         """
         Returns all files that must be run on one EP.
@@ -1222,24 +1333,18 @@ class CeRpycService(rpyc.Service):
         return data
 
 
-    def exposed_download_file(self, epname, file_info):
+    def _test_file(self, user, epname, file_info):
         """
-        Sends requested file to the EP, to be executed.
+        The path of a test file, from a path or a file ID.
+        Returns (path, ClearCase view), or (None, None) for an invalid file ID.
         """
-        logFull('CeRpyc:exposed_download_file')
-        user = self._check_login()
-        if not user:
-            return False
-
-        if epname not in self.project.get_user_info(user, 'eps'):
-            logDebug('*ERROR* Invalid EP name `{}` !'.format(epname))
-            return False
-
         tests_path = self.project.get_user_info(user, 'tests_path')
 
-        # If this is a test file path
-        if os.path.isfile(tests_path + os.sep + file_info):
-            filename = tests_path + os.sep + file_info
+        # If this is an absolute path, or a test file path
+        if file_info.startswith('~') or file_info.startswith('/'):
+            filename = file_info
+        elif os.path.isfile(tests_path + os.sep + file_info):
+            return tests_path + os.sep + file_info, None
 
         # If this is a file ID
         else:
@@ -1247,32 +1352,100 @@ class CeRpycService(rpyc.Service):
             data = self.project.get_file_info(user, epname, file_id)
             if not data:
                 logError('*ERROR* Invalid File ID `{}` !'.format(file_id))
-                return False
+                return None, None
 
             filename = data['file']
 
             # Auto detect if ClearCase Test Config Path is active
             cc_cfg = self.project.get_clearcase_config(user, 'tests_path')
             if cc_cfg and data.get('clearcase'):
-                logDebug('Execution process `{}:{}` requested ClearCase file `{}`.'.format(user, epname, filename))
                 # Set TC Revision variable
                 self.project.set_file_info(user, epname, file_id, 'twister_tc_revision', -1)
-                view = cc_cfg['view']
-                # Read ClearCase TestCase file
-                text = self.project.read_file(user, filename, type='clearcase:' + view)
-                return text
-            # End of ClearCase hack !
-
-            # Fix ~ $HOME path (from project XML)
-            if filename.startswith('~'):
-                filename = userHome(user) + filename[1:]
-            # Fix incomplete file path (from project XML)
-            if not os.path.isfile(filename):
-                filename = tests_path + os.sep + filename
+                return filename, cc_cfg['view']
+
+        # Fix ~ $HOME path (from project XML)
+        if filename.startswith('~'):
+            filename = userHome(user) + filename[1:]
+        # Fix incomplete file path (from project XML)
+        if not os.path.isfile(filename):
+            filename = tests_path + os.sep + filename
+        return filename, None
+
+
+    def exposed_download_file(self, epname, file_info):
+        """
+        Sends requested file to the EP, to be executed.
+        The big files must be downloaded with `download_chunk`.
+        """
+        logFull('CeRpyc:exposed_download_file')
+        user = self._check_login()
+        if not user:
+            return False
+
+        if epname not in self.project.get_user_info(user, 'eps'):
+            logDebug('*ERROR* Invalid EP name `{}` !'.format(epname))
+            return False
+
+        filename, view = self._test_file(user, epname, file_info)
+        if not filename:
+            return False
+
+        if view:
+            logDebug('Execution process `{}:{}` requested ClearCase file `{}`.'.format(user, epname, filename))
+            # Read ClearCase TestCase file
+            return self.project.read_file(user, filename, f_type='clearcase:' + view)
 
         logDebug('Execution process `{}:{}` requested file `{}`.'.format(user, epname, filename))
 
-        return self.project.localFs.read_user_file(user, filename, 'rb')
+        fsize = self.project.localFs.file_size(user, filename)
+        if isinstance(fsize, (int, long)) and fsize > 20*1000*1000:
+            err = '*ERROR* File too big `{}`: {}! Use download chunk!'.format(filename, fsize)
+            logWarning(err)
+            return err
+
+        # Read the file in chunks, so the User Service never loads all of it
+        try:
+            return ''.join(self.project.localFs.iter_user_file(user, filename))
+        except IOError as exp_err:
+            logWarning(exp_err)
+            return str(exp_err)
+
+
+    def exposed_download_chunk(self, epname, file_info, fstart=0, flen=0, compress=True):
+        """
+        Sends a chunk from a test file, a log, or a binary test artifact to the EP.
+        The file is a path, or a file ID, just like for `download_file`.
+        The chunk is compressed with zlib, if `compress` is True.
+        An empty chunk means the end of the file.
+        """
+        logFull('CeRpyc:exposed_download_chunk')
+        user = self._check_login()
+        if not user:
+            return False
+
+        if epname not in self.project.get_user_info(user, 'eps'):
+            logDebug('*ERROR* Invalid EP name `{}` !'.format(epname))
+            return False
+
+        fpath, view = self._test_file(user, epname, file_info)
+        if not fpath:
+            return False
+
+        if flen:
+            flen = min(flen, MAX_CHUNK)
+        else:
+            flen = MAX_CHUNK
+
+        if view:
+            # ClearCase files are not read in chunks
+            fdata = self.project.read_file(user, fpath, f_type='clearcase:' + view)
+            if not fdata.startswith('*ERROR*'):
+                fdata = fdata[fstart:fstart + flen]
+        else:
+            fdata = self.project.localFs.read_user_chunk(user, fpath, fstart, flen)
+        if compress and not fdata.startswith('*ERROR*'):
+            return zlib.compress(fdata)
+        return fdata
 
 
 # # #   Plugins   # # #
@@ -1353,15 +1526,16 @@ class CeRpycService(rpyc.Service):
         return self.project.log_message(user, log_type, log_message)
 
 
-    def exposed_log_live(self, epname, log_message):
+    def exposed_log_live(self, epname, log_message, compressed=False):
         """
         Writes CLI messages in a big log, so all output can be checked LIVE.
+        The message is base64, or zlib compressed if `compressed` is True.
         """
         logFull('CeRpyc:exposed_log_live')
         user = self._check_login()
         if not user:
             return False
-        return self.project.log_live(user, epname, log_message)
+        return self.project.log_live(user, epname, log_message, compressed)
 
 
     def exposed_reset_log(self, log_name):
@@ -1423,6 +1597,23 @@ class CeRpycService(rpyc.Service):
             return False
 
 
+    def exposed_get_tbs(self, queries):
+        """
+        Get the content of many resources, with one call.
+        The queries are copied locally, to avoid a round trip for each query.
+        """
+        logFull('CeRpyc:exposed_get_tbs')
+        user = self._check_login()
+        if not user:
+            return False
+        try:
+            queries = copy.deepcopy(queries)
+            return self.project.testbeds.get_resources(queries, props={'__user': user})
+        except Exception as exp_err:
+            logWarning(exp_err)
+            return False
+
+
     def exposed_create_new_tb(self, name, parent, props={}):
         """
         New TB.
@@ -1459,6 +1650,18 @@ class CeRpycService(rpyc.Service):
         return self.project.testbeds.update_meta_tb(name, parent, props)
 
 
+    def exposed_update_meta_tbs(self, updates):
+        """
+        Update meta for many resources: path -> props.
+        """
+        logFull('CeRpyc:exposed_update_meta_tbs')
+        user = self._check_login()
+        if not user:
+            return False
+        updates = copy.deepcopy(updates)
+        return self.project.testbeds.update_meta_many(updates, props={'__user': user})
+
+
     def exposed_set_tb(self, name, parent='/', props={}):
         """
         Update a TB.
@@ -1507,6 +1710,18 @@ class CeRpycService(rpyc.Service):
         return self.project.sut.update_meta_sut(name, parent, props)
 
 
+    def exposed_update_meta_suts(self, updates):
+        """
+        Update meta for many SUT components: path -> props.
+        """
+        logFull('CeRpyc:exposed_update_meta_suts')
+        user = self._check_login()
+        if not user:
+            return False
+        updates = copy.deepcopy(updates)
+        return self.project.sut.update_meta_many(updates, props={'__user': user})
+
+
     def exposed_set_sut(self, name, parent='/', props={}):
         """
         Update a SUT.
@@ -1563,6 +1778,23 @@ class CeRpycService(rpyc.Service):
             return False
 
 
+    def exposed_get_suts(self, queries, follow_links=False):
+        """
+        Get the content of many SUTs, with one call.
+        """
+        logFull('CeRpyc:exposed_get_suts')
+        user = self._check_login()
+        if not user:
+            return False
+        try:
+            queries = copy.deepcopy(queries)
+            return self.project.sut.get_resources(queries,\
+            props={'__user': user, 'follow_links': bool(follow_links)})
+        except Exception as exp_err:
+            logWarning(exp_err)
+            return False
+
+
     def exposed_get_info_sut(self, query):
         """
         Get SUT meta.
@@ -1655,6 +1887,26 @@ class CeRpycService(rpyc.Service):
         return self.project.sut.reserve_sut(query, props={'__user': user})
 
 
+    def exposed_reserve_tbs(self, queries):
+        """ reserve many resources """
+        logFull('CeRpyc:exposed_reserve_tbs')
+        user = self._check_login()
+        if not user:
+            return (False, 'DEFAULT_ERROR')
+        queries = copy.deepcopy(queries)
+        return self.project.testbeds.reserve_many(queries, props={'__user': user})
+
+
+    def exposed_reserve_suts(self, queries):
+        """ reserve many SUTs """
+        logFull('CeRpyc:exposed_reserve_suts')
+        user = self._check_login()
+        if not user:
+            return (False, 'DEFAULT_ERROR')
+        queries = copy.deepcopy(queries)
+        return self.project.sut.reserve_many(queries, props={'__user': user})
+
+
     def exposed_save_reserved_tb(self, query):
         """ save reserved resource and keep it reserved """
         logFull('CeRpyc:exposed_save_reserved_tb')
@@ -48,7 +48,7 @@ if TWISTER_PATH not in sys.path:
 
 from common.tsclogging import logFull, logDebug, logInfo, logWarning, logError
 from common.helpers import userHome
-from server.CeCommonAllocator import CommonAllocator
+from server.CeCommonAllocator import CommonAllocator, RWLock
 
 CONSTANT_DICTIONARY = {'version': 0, 'name': '/', 'meta': {}, 'children': {}}
 
@@ -233,11 +233,67 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
         self.reservedResources = {}
         self.lockedResources = {}
         self.id_list = {}
+        self.pending = {} # SUT files not saved yet
+        self.pend_lock = thread.allocate_lock() # Pending saves lock
+        self.save_thread = None
+        self.sut_versions = {} # SUT file -> how many times the CE wrote it
+        self.sut_source = {} # SUT name -> (SUT file, file sign, SUT node) it was loaded from
+        self.sut_indexed = {} # SUT file -> file sign, when it was indexed
+        self.sut_ids = {} # ID -> SUT name, from id_list
         self.acc_lock = thread.allocate_lock() # Task change lock
         self.ren_lock = thread.allocate_lock() # Rename lock
         self.imp_lock = thread.allocate_lock() # Import lock
         self.save_lock = thread.allocate_lock() # Save lock
         self.load_lock = thread.allocate_lock() # Save lock
+        self.idx_lock = thread.allocate_lock() # ID index lock
+        self.res_index = {} # ID -> path of names, for self.resources
+        self.idx_tops = {}  # Top level name -> (node, IDs)
+        self.idx_root = None
+        self.idx_version = 0
+        self.res_version = 0 # Incremented when a top level resource is changed
+        self.tree_lock = RWLock() # Whole tree (write) / top level resource (read) lock
+        self.top_locks = {} # Top level resource ID -> write lock
+
+
+    def _sut_file_sign(self, sut_file):
+        """
+        The (version, mtime, size) of a SUT file, or None if the file cannot be checked.
+        The version is incremented every time the CE writes the file,
+        so two writes in the same second are never mistaken.
+        """
+        try:
+            f_stat = os.stat(sut_file)
+        except Exception:
+            return None
+        return (self.sut_versions.get(sut_file, 0), f_stat.st_mtime, f_stat.st_size)
+
+
+    def _set_sut_source(self, sut_name, sut_file):
+        """
+        Remember the file that a SUT from the resources was loaded from, or saved in.
+        """
+        sign = self._sut_file_sign(sut_file)
+        node = self.resources['children'].get(sut_name)
+        if sign and node is not None:
+            self.sut_source[sut_name] = (sut_file, sign, node)
+        else:
+            self.sut_source.pop(sut_name, None)
+
+
+    def _loaded_sut(self, sut_name, sut_file):
+        """
+        Returns the SUT from the resources, if it was loaded from this file,
+        and the file didn't change since then.
+        """
+        source = self.sut_source.get(sut_name)
+        if not source or source[0] != sut_file:
+            return None
+        # Some other version of the SUT was put in the resources
+        if self.resources['children'].get(sut_name) is not source[2]:
+            return None
+        if self._sut_file_sign(sut_file) != source[1]:
+            return None
+        return source[2]
 
 
     def save_sut(self, props={}, resource_name=None):
@@ -245,64 +301,97 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
         Function used to write the changes on HDD.
         The save is separate for Devices and SUTs, so the version is not incremented
         for both, before saving.
+        The SUT file is written a little later, after the burst of changes.
         """
         user = self.user_info(props)[0]
         logDebug('CeSuts:_save {} {} {} '.format(props, resource_name, user))
-        log = []
 
-        # Write changes, using the Access Lock.
-        with self.save_lock:
-            if resource_name[0] == '/':
-                resource_name = resource_name[1:]
+        if resource_name[0] == '/':
+            resource_name = resource_name[1:]
 
-            if resource_name.split('.')[-1] == 'user':
-                suts_gb_path = self.project.get_user_info(user, 'sut_path')
-            else:
-                suts_gb_path = self.project.get_user_info(user, 'sys_sut_path')
+        if resource_name not in self.resources['children']:
+            msg = 'User {}: Cannot save SUT `{}`, it is not loaded!'.format(user, resource_name)
+            logError(msg)
+            return '*ERROR* ' + msg
 
-            if not suts_gb_path:
-                suts_gb_path = '{}/config/sut/'.format(TWISTER_PATH)
+        self.save_later(resource_name, user)
 
-            filename = os.path.join(suts_gb_path, '.'.join(resource_name.split('.')[:-1] + ['json']))
+        # update id_list
+        self.parse_sut(self.resources['children'][resource_name], resource_name)
 
-            if resource_name.split('.')[-1] == 'system':
-                try:
-                    resp = self.project.localFs.write_system_file(filename, \
-                        json.dumps(self.resources['children'][resource_name], indent=4), 'w')
-                except Exception as exp_err:
-                    log.append(exp_err)
-                    logError('User {}: Saving ERROR system:: `{}`.'.format(user, exp_err))
-
-            if resource_name.split('.')[-1] == 'user':
-                # user SUT file; we have to check if the cleacase plugin
-                # is activated; if so, use it to write the SUT file; else
-                # use the UserService to read it
-                cc_cfg = self.project.get_clearcase_config(user, 'sut_path')
-                if cc_cfg:
-                    view = cc_cfg['view']
-                    actv = cc_cfg['actv']
-                    path = cc_cfg['path']
-                    user_view_actv = '{}:{}:{}'.format(user, view, actv)
-                    f_name = ''.join(resource_name.split('.')[:-1])
-                    resp = self.project.clearFs.write_user_file(user_view_actv, path +'/'+ f_name + '.json', \
-                        json.dumps(self.resources['children'][resource_name], indent=4))
-                else:
-                    # Get the user connection
-                    resp = self.project.localFs.write_user_file(user, filename, \
-                        json.dumps(self.resources['children'][resource_name], indent=4), 'w')
-                if resp is not True:
-                    log.append(resp)
-                    logError('User {}: Saving ERROR user:: `{}`.'.format(user, resp))
+        return True
 
-                # targeted resource is saved now; do not continue with
-                # the rest of resources
+
+    def _write(self, key, data):
+        """
+        Write one SUT file, as compact JSON, for all the users that saved it.
+        This function is called with the save lock!
+        """
+        log = []
+        for user in data:
+            resp = self._write_sut(key, user)
+            if resp is not True:
+                log.append(resp)
         if log:
             return '*ERROR* ' + str(log)
+        return True
 
-        # update id_list
-        self.parse_sut(self.resources['children'][resource_name], resource_name)
 
-        return True
+    def _write_sut(self, resource_name, user):
+        """
+        Write one SUT file, for one user.
+        This function is called with the save lock!
+        """
+        # The SUT was saved as a different file, or deleted meanwhile
+        if resource_name not in self.resources['children']:
+            logDebug('User {}: SUT `{}` is not loaded, nothing to save.'.format(user, resource_name))
+            return True
+
+        if resource_name.split('.')[-1] == 'user':
+            suts_gb_path = self.project.get_user_info(user, 'sut_path')
+        else:
+            suts_gb_path = self.project.get_user_info(user, 'sys_sut_path')
+
+        if not suts_gb_path:
+            suts_gb_path = '{}/config/sut/'.format(TWISTER_PATH)
+
+        filename = os.path.join(suts_gb_path, '.'.join(resource_name.split('.')[:-1] + ['json']))
+        fdata = json.dumps(self.resources['children'][resource_name], separators=(',', ':'))
+        resp = True
+
+        filename = os.path.normpath(filename)
+        self.sut_versions[filename] = self.sut_versions.get(filename, 0) + 1
+        self.sut_source.pop(resource_name, None)
+
+        if resource_name.split('.')[-1] == 'system':
+            resp = self.project.localFs.write_system_file_atomic(filename, fdata)
+            if resp is True:
+                self._set_sut_source(resource_name, filename)
+            else:
+                logError('User {}: Saving ERROR system:: `{}`.'.format(user, resp))
+
+        if resource_name.split('.')[-1] == 'user':
+            # user SUT file; we have to check if the cleacase plugin
+            # is activated; if so, use it to write the SUT file; else
+            # use the UserService to write it, in a temporary file, then rename
+            cc_cfg = self.project.get_clearcase_config(user, 'sut_path')
+            if cc_cfg:
+                view = cc_cfg['view']
+                actv = cc_cfg['actv']
+                path = cc_cfg['path']
+                user_view_actv = '{}:{}:{}'.format(user, view, actv)
+                f_name = ''.join(resource_name.split('.')[:-1])
+                resp = self.project.clearFs.write_user_file(user_view_actv, path +'/'+ f_name + '.json', fdata)
+            else:
+                resp = self.project.localFs.write_user_file(user, filename + '.tmp', fdata, 'w')
+                if resp is True:
+                    resp = self.project.localFs.move_user_file(user, filename + '.tmp', filename)
+                if resp is True:
+                    self._set_sut_source(resource_name, filename)
+            if resp is not True:
+                logError('User {}: Saving ERROR user:: `{}`.'.format(user, resp))
+
+        return resp
 
 
     @cherrypy.expose
@@ -339,7 +428,10 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
             return '*ERROR* ' + str(log)
 
         # remove the new sut from resources
-        self.resources['children'].pop(sut_name)
+        with self.acc_lock:
+            self.resources['children'].pop(sut_name)
+        self.tree_changed()
+        self.drop_pending(sut_name)
         logDebug('Sut resource: `{}` removed from the resources'.format(sut_name))
         return True
 
@@ -370,20 +462,29 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
 
         self.format_content(sut_content, kids_list)
 
+        self.forget_sut(sut_name)
         kids_list = list(kids_list)
         self.id_list[sut_name] = kids_list
+        for kid in kids_list:
+            self.sut_ids[kid] = sut_name
 
         return True
 
 
+    def forget_sut(self, sut_name):
+        """
+        Removes the IDs of a SUT from id_list.
+        """
+        for kid in self.id_list.pop(sut_name, []):
+            if self.sut_ids.get(kid) == sut_name:
+                del self.sut_ids[kid]
+
+
     def find_sut_id(self, sut_id):
         """
         Search for an ID in id_list.
         """
-        for key, value in self.id_list.items():
-            if sut_id in value:
-                return key
-        return False
+        return self.sut_ids.get(sut_id, False)
 
 
     def _format_dict_sut(self, result, query):
@@ -410,6 +511,8 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
         user = user_info[0]
         usr_home = userHome(user)
 
+        # The SUT files must be up to date
+        self.flush()
         sut_content = False
 
         try:
@@ -424,9 +527,16 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
             for sut_path in sut_all_pats:
                 sut_name = '.'.join(['.'.join(sut_path.split('.')[:-1]  + ['system'])])
 
-                with open(os.path.join(suts_gb_path, sut_path), 'r') as f_p:
+                # Only the files changed since the last index are parsed again
+                sut_file = os.path.normpath(os.path.join(suts_gb_path, sut_path))
+                sign = self._sut_file_sign(sut_file)
+                if sign and sut_name in self.id_list and self.sut_indexed.get(sut_file) == sign:
+                    continue
+
+                with open(sut_file, 'r') as f_p:
                     sut_content = json.load(f_p)
                     self.parse_sut(sut_content, sut_name)
+                self.sut_indexed[sut_file] = sign
         except Exception as exp_err:
             logError('_load ERROR:: {} for user {}'.format(exp_err, user))
 
@@ -474,6 +584,12 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
                 else:
                     complete_sut_path = suts_gb_path + sut_path
 
+                # Only the files changed since the last index are read again
+                sut_file = os.path.normpath(complete_sut_path)
+                sign = self._sut_file_sign(sut_file)
+                if sign and sut_name in self.id_list and self.sut_indexed.get(sut_file) == sign:
+                    continue
+
                 resp = self.project.localFs.read_user_file(user, complete_sut_path)
                 try:
                     sut_content = json.loads(resp)
@@ -482,6 +598,7 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
                     logWarning(msg)
                     return '*ERROR* ' + msg
                 self.parse_sut(sut_content, sut_name)
+                self.sut_indexed[sut_file] = sign
 
         return True
 
@@ -613,13 +730,29 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
         sut_file = sut_path + f_name
         sut_content = False
 
+        # The changes not saved yet must not be lost
+        self.flush(query.lstrip('/'))
+
         if not os.path.isdir(sut_path):
             # Cannot get read access to the SUT directory
             msg = '*ERROR* Cannot get access to SUT path `{}`, user `{}`!'.format(sut_path, username)
             logWarning(msg)
             return msg
 
-        if sut_type == 'system':
+        cc_cfg = None
+        if sut_type != 'system':
+            cc_cfg = self.project.get_clearcase_config(username, 'sut_path')
+
+        # The SUT is already loaded and the file didn't change; no need to read it again
+        sut_loaded = None
+        if not cc_cfg:
+            sut_file = os.path.normpath(sut_path + '/' + f_name)
+            sut_loaded = self._loaded_sut(query.lstrip('/'), sut_file)
+
+        if sut_loaded:
+            sut_content = dict(sut_loaded)
+
+        elif sut_type == 'system':
             # System SUT file
             try:
                 with open(sut_file, 'r') as f_p:
@@ -631,7 +764,6 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
         else:
             # User SUT file, check if the ClearCase plugin is activated
             # If so, use it to read the SUT file; else use the UserService to read it
-            cc_cfg = self.project.get_clearcase_config(username, 'sut_path')
             if cc_cfg:
                 view = cc_cfg['view']
                 actv = cc_cfg['actv']
@@ -649,8 +781,7 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
                     logWarning('User {}: Cannot load ClearCase SUT `{}`!'.format(username, sut_path))
                     sut_content = False
             else:
-                sut_path = (sut_path + '/' + f_name).replace('//', '/')
-                resp = self.project.localFs.read_user_file(username, sut_path)
+                resp = self.project.localFs.read_user_file(username, sut_file)
                 # Invalid sut file?
                 if resp.startswith('*ERROR*'):
                     logWarning(resp)
@@ -658,7 +789,7 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
                 try:
                     sut_content = json.loads(resp)
                 except Exception:
-                    logWarning('User {}: Cannot load SUT `{}`!'.format(username, sut_path))
+                    logWarning('User {}: Cannot load SUT `{}`!'.format(username, sut_file))
                     sut_content = False
 
         if isinstance(sut_content, str) and sut_content.startswith('*ERROR*'):
@@ -673,23 +804,29 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
         if query[0] == '/':
             query = query[1:]
 
-        if sut_content.get('path'):
-            sut_content['path'] = sut_content['path'][0]
-        else:
-            sut_content['path'] = query
-
-        self.resources['children'][query] = copy.deepcopy(sut_content)
-        # make older resources files that don't have 'path' compatible
-        self.resources['children'][query]['path'] = [query]
-        modified = self.fix_path(self.resources['children'][query], [query])
-
-        if modified:
-            # now we have to save the version with path
-            issaved = self.save_sut(props, query)
-            if isinstance(issaved, str):
-                msg = 'Cannot save SUT `{}`, for user `{}`!'.format(query, username)
-                logWarning(msg)
-                return msg
+        if not sut_loaded:
+            if sut_content.get('path'):
+                sut_content['path'] = sut_content['path'][0]
+            else:
+                sut_content['path'] = query
+
+            sut_node = copy.deepcopy(sut_content)
+            # make older resources files that don't have 'path' compatible
+            sut_node['path'] = [query]
+            modified = self.fix_path(sut_node, [query])
+            with self.acc_lock:
+                self.resources['children'][query] = sut_node
+            self.tree_changed()
+
+            if modified:
+                # now we have to save the version with path
+                issaved = self.save_sut(props, query)
+                if isinstance(issaved, str):
+                    msg = 'Cannot save SUT `{}`, for user `{}`!'.format(query, username)
+                    logWarning(msg)
+                    return msg
+            elif not cc_cfg:
+                self._set_sut_source(query, sut_file)
 
         if initial_query:
             result = self.get_info_sut(initial_query, props)
@@ -794,9 +931,9 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
         # If the SUT is reserved, get the latest unsaved changes
         if user_info[0] in self.reservedResources:
             for i in range(len(self.reservedResources[user_info[0]].values())):
-                current_res_reserved = CONSTANT_DICTIONARY
+                # Search in the reserved copy only; the loaded SUTs are not changed
                 current_path_root = self.reservedResources[user_info[0]].values()[i]['path'][0]
-                current_res_reserved['children'][current_path_root] = self.reservedResources[user_info[0]].values()[i]
+                current_res_reserved = {'children': {current_path_root: self.reservedResources[user_info[0]].values()[i]}}
 
                 result = self.get_resource(res_query, current_res_reserved)
                 if isinstance(result, dict):
@@ -857,7 +994,7 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
             return '*ERROR* ' + msg
 
         props = self.valid_props(props)
-        with self.acc_lock:
+        with self.tree_lock.read, self.top_lock(parent):
             #the resource should be reserved previously
             parent_p = self.get_reserved_resource(parent, props)
 
@@ -911,7 +1048,7 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
             logError(msg)
             return '*ERROR* ' + msg
 
-        with self.acc_lock:
+        with self.tree_lock.read, self.acc_lock:
             #root can not be reserved so we just take it
             if name.split('.')[-1] != 'user' and \
             name.split('.')[-1] != 'system':
@@ -929,6 +1066,7 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
             # the resource doesn't exist - create it
             res_id = self.generate_index()
             self.resources['children'][name] = {'id': res_id, 'meta': props, 'children': {}, 'path': [name]}
+            self.tree_changed()
 
             #save this new SUT
             if save:
@@ -984,7 +1122,7 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
             logError(msg)
             return '*ERROR* ' + msg
 
-        with self.acc_lock:
+        with self.tree_lock.read, self.top_lock(verify_reserved):
 
             parent_p = self.get_reserved_resource(verify_reserved, props)
 
@@ -1229,7 +1367,7 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
             logError(msg)
             return '*ERROR* ' + msg
 
-        with self.acc_lock:
+        with self.tree_lock.read, self.top_lock(res_query):
             parent_p = self.get_reserved_resource(res_query, props)
 
             if not parent_p:
@@ -1355,12 +1493,17 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
 
         usr_home = userHome(user_info[0])
 
+        # The SUT file must not be written again
+        self.drop_pending(res_query.split('/')[-1])
+        self.sut_source.pop(res_query.split('/')[-1], None)
+
         # temporary fix; the SUT must be removed from self.resources
         def delete_sut_memory(sut_to_remove):
             parent_p = self.get_resource('/')
 
             if parent_p is not None and parent_p['children'].get(sut_to_remove) is not None:
                 parent_p['children'].pop(sut_to_remove)
+                self.tree_changed()
         # end temporary fix
 
         # SUT file can be user or system file
@@ -1384,9 +1527,9 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
             delete_sut_memory(res_query.split('/')[-1])
 
             # delete from id_list if possible
-            try:
-                del self.id_list[res_query]
-            except Exception:
+            if res_query in self.id_list:
+                self.forget_sut(res_query)
+            else:
                 logDebug('User {}: id_list does not contain the sut: {}'.format(user_info[0], res_query))
 
             # get user SUT file; we have to check if the cleacase plugin
@@ -1416,6 +1559,8 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
         """
         Fast list suts.
         """
+        # The new SUT files must be written
+        self.flush()
         suts = []
         result = []
         usr_home = userHome(user)
@@ -1553,6 +1698,7 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
         user = user_info[0]
 
         logDebug('User {}: export XML file `{}`, query = {}...'.format(user, xml_file, query))
+        self.flush()
 
         sut_path = None
         sut_type = query.split('.')[-1]
@@ -1757,15 +1903,9 @@ class Suts(_cptools.XMLRPCController, CommonAllocator):
 
         reserved_node = self.reservedResources[user_info[0]][resource_node['id']]
 
-        # Maybe the user renamed the TB
-        if reserved_node['path'][0] != resource_node['path'][0]:
-            self.resources['children'][reserved_node['path'][0]] = \
-            self.resources['children'].pop(resource_node['path'][0])
-        # ...or maybe the name of the resource is the same
-        resources['children'].update([(reserved_node['path'][0], reserved_node), ])
-
-        # Update path
-        resources['children'][reserved_node['path'][0]]['path'] = [reserved_node['path'][0]]
+        with self.tree_lock.read, self.top_lock(resource_node['id']):
+            # Maybe the user renamed the SUT, or maybe the name is the same
+            self.replace_top(resource_node['path'][0], reserved_node['path'][0], reserved_node)
         # Now save
         if path == '':
             issaved = self.save_sut(props, resource_node['path'][0])
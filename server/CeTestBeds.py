@@ -48,7 +48,7 @@ if TWISTER_PATH not in sys.path:
 
 from common.tsclogging import logFull, logDebug, logWarning, logError
 #from common.helpers import user_info
-from server.CeCommonAllocator import CommonAllocator
+from server.CeCommonAllocator import CommonAllocator, RWLock
 
 CONSTANT_DICTIONARY = {'version': 0, 'name': '/', 'path' : [], 'meta': {}, 'children': {}}
 
@@ -238,7 +238,20 @@ class TestBeds(_cptools.XMLRPCController, CommonAllocator):
         self.imp_lock = thread.allocate_lock() # Import lock
         self.save_lock = thread.allocate_lock() # Save lock
         self.load_lock = thread.allocate_lock() # Save lock
+        self.idx_lock = thread.allocate_lock() # ID index lock
+        self.res_index = {} # ID -> path of names, for self.resources
+        self.idx_tops = {}  # Top level name -> (node, IDs)
+        self.idx_root = None
+        self.idx_version = 0
+        self.res_version = 0 # Incremented when a top level resource is changed
+        self.tree_lock = RWLock() # Whole tree (write) / top level resource (read) lock
+        self.top_locks = {} # Top level resource ID -> write lock
+        self.pending = {} # Resource files not saved yet
+        self.pend_lock = thread.allocate_lock() # Pending saves lock
+        self.save_thread = None
         self.res_file = '{}/config/resources.json'.format(TWISTER_PATH)
+        self.res_sign = None # (mtime, size) of the file, when loaded or saved
+        self.tb_json = {} # TB name -> (TB node, JSON), for the TBs not changed
         self._loaded_users = {}
         self.load_tb(verbose=True)
 
@@ -249,16 +262,28 @@ class TestBeds(_cptools.XMLRPCController, CommonAllocator):
         """
         logDebug('CeTestBeds:load_tb {}'.format(verbose))
 
+        # The changes not saved yet must not be lost
+        self.flush()
+
         with self.load_lock:
             if not self.resources.get('children'):
                 self.resources = CONSTANT_DICTIONARY
 
+            # Nothing to do, if the file didn't change since it was loaded or saved
+            f_sign = self._file_sign()
+            if f_sign and f_sign == self.res_sign:
+                return self.resources
+
             # try to load test bed resources file
             try:
                 f_p = open(self.res_file, 'r')
-                self.resources = json.load(f_p)
+                resources = json.load(f_p)
                 f_p.close()
                 del f_p
+                with self.tree_lock.write:
+                    self.resources = resources
+                    self.tree_changed()
+                self.res_sign = f_sign
                 if verbose:
                     logDebug('TBs loaded successfully.')
             except Exception as exp_err:
@@ -284,27 +309,65 @@ class TestBeds(_cptools.XMLRPCController, CommonAllocator):
         return self.resources
 
 
-    def save_tb(self, props={}):
+    def _file_sign(self):
+        """
+        The (mtime, size) of the resources file, or None.
+        """
+        try:
+            f_stat = os.stat(self.res_file)
+            return (f_stat.st_mtime, f_stat.st_size)
+        except Exception:
+            return None
+
+
+    def save_tb(self, props={}, changed=None):
         """
         Function used to write the changes on HDD.
+        Changed is the list of TBs that were modified; the default is all of them.
+        The file is written a little later, after the burst of changes.
         """
-        logFull('CeTestBeds:_save {}'.format(props))
-        log = []
+        logFull('CeTestBeds:_save {} {}'.format(props, changed))
 
         with self.save_lock:
             ver = self.resources.get('version', 0)
             self.resources['version'] = ver + 1
-            try:
-                logDebug('Saving test bed file.')
-                with open(self.res_file, 'w') as f_p:
-                    json.dump(self.resources, f_p, indent=4)
-            except Exception as exp_err:
-                log.append(exp_err)
-        if log:
-            logError(log)
-            return '*ERROR* ' + str(log)
+            if changed is None:
+                self.tb_json = {}
+            else:
+                for name in changed:
+                    self.tb_json.pop(name, None)
 
-        return True
+        return self.save_later(self.res_file)
+
+
+    def _write(self, key, data):
+        """
+        Write the resources file, as compact JSON.
+        Only the TBs changed since the last write are serialized again.
+        This function is called with the save lock!
+        """
+        logDebug('Saving test bed file.')
+        resources = self.resources
+        tb_json = {}
+        parts = []
+
+        for name, node in (resources.get('children') or {}).items():
+            cached = self.tb_json.get(name)
+            if not cached or cached[0] is not node:
+                cached = (node, json.dumps(node, separators=(',', ':')))
+            tb_json[name] = cached
+            parts.append(json.dumps(name) + ':' + cached[1])
+
+        self.tb_json = tb_json
+        header = dict((k, v) for k, v in resources.items() if k != 'children')
+        header = json.dumps(header, separators=(',', ':'))[:-1]
+        if header != '{':
+            header += ','
+
+        ret = self.project.localFs.write_system_file_atomic(self.res_file, header + '"children":{' + ','.join(parts) + '}}')
+        if ret is True:
+            self.res_sign = self._file_sign()
+        return ret
 
 
     @cherrypy.expose
@@ -404,8 +467,10 @@ class TestBeds(_cptools.XMLRPCController, CommonAllocator):
             if isinstance(resource_node, dict) and ''.join(resource_node['path']) in self.resources['children']:
                 # user wants to delete the entire TB
                 if ''.join(resource_node['path']) in self.resources['children']:
-                    self.resources['children'].pop(resource_node['path'][0])
-                    issaved = self.save_tb(props)
+                    with self.tree_lock.read, self.top_lock(res_query), self.acc_lock:
+                        self.resources['children'].pop(resource_node['path'][0], None)
+                        self.tree_changed()
+                    issaved = self.save_tb(props, [])
                     if not issaved:
                         msg = "We could not save this TB: {}.".format(res_query)
                         logDebug(msg)
@@ -547,7 +612,7 @@ class TestBeds(_cptools.XMLRPCController, CommonAllocator):
             logError(msg)
             return '*ERROR* ' + msg
 
-        with self.acc_lock:
+        with self.tree_lock.read, self.top_lock(parent):
             #the resource should be reserved previously
             parent_p = self.get_reserved_resource(parent, props)
             if not parent_p:
@@ -597,7 +662,7 @@ class TestBeds(_cptools.XMLRPCController, CommonAllocator):
 
         props = self.valid_props(props)
 
-        with self.acc_lock:
+        with self.tree_lock.read, self.acc_lock:
             # root can not be reserved so we just take it
             parent_p = self.get_resource('/', resources)
 
@@ -617,8 +682,9 @@ class TestBeds(_cptools.XMLRPCController, CommonAllocator):
             # the resource doesn't exist - create it
             res_id = self.generate_index()
             parent_p['children'][name] = {'id': res_id, 'meta': props, 'children': {}, 'path': [name]}
+            self.tree_changed()
 
-            issaved = self.save_tb(props)
+            issaved = self.save_tb(props, [name])
             if not issaved:
                 msg = "User {}: Could not save TB `{}`".format(user_info[0], name)
                 logDebug(msg)
@@ -664,7 +730,7 @@ class TestBeds(_cptools.XMLRPCController, CommonAllocator):
             logError(msg)
             return '*ERROR* ' + msg
 
-        with self.acc_lock:
+        with self.tree_lock.read, self.top_lock(verify_reserved):
 
             l_props = dict(props)
             if '__user' in l_props:
@@ -674,7 +740,7 @@ class TestBeds(_cptools.XMLRPCController, CommonAllocator):
             if name == '/' and parent == '/':
                 resources['meta'].update(l_props)
                 # Write changes for Device or SUT
-                issaved = self.save_tb(props)
+                issaved = self.save_tb(props, [])
                 if not issaved:
                     msg = "User {}: We didnt save this entry = {} having props = {}".format(user_info[0], name, props)
                     logDebug(msg)
@@ -904,7 +970,10 @@ class TestBeds(_cptools.XMLRPCController, CommonAllocator):
 
         with self.imp_lock:
             try:
-                self.resources = xml_to_res(params_xml, {})
+                resources = xml_to_res(params_xml, {})
+                with self.tree_lock.write:
+                    self.resources = resources
+                    self.tree_changed()
             except Exception as exp_err:
                 msg = 'User {}: Import XML: Exception `{}`.'.format(user_info[0], exp_err)
                 logError(msg)
@@ -966,18 +1035,12 @@ class TestBeds(_cptools.XMLRPCController, CommonAllocator):
 
         reserved_node = reserved_resources[resource_node['id']]
 
-        # maybe the user renamed the TB
-        if reserved_node != resource_node:
-            self.resources['children'][reserved_node['path'][0]] = \
-            self.resources['children'].pop(resource_node['path'][0])
-        # or maybe the name of the resource is the same
-        resources['children'].update([(reserved_node['path'][0], reserved_node), ])
-
-        # update path
-        resources['children'][reserved_node['path'][0]]['path'] = [reserved_node['path'][0]]
+        with self.tree_lock.read, self.top_lock(resource_node['id']):
+            # maybe the user renamed the TB, or maybe the name is the same
+            self.replace_top(resource_node['path'][0], reserved_node['path'][0], reserved_node)
 
         #now we have to save
-        issaved = self.save_tb(props)
+        issaved = self.save_tb(props, [reserved_node['path'][0]])
         if isinstance(issaved, str):
             if issaved.startswith('*ERROR* '):
                 msg = "We could not save this TB for user = {}.".format(user_info[0])
@@ -117,6 +117,10 @@ if __name__ == "__main__":
 
     def close():
         """ Close server. """
+        # Write the resources not saved yet
+        PROJ.testbeds.flush()
+        PROJ.sut.flush()
+        PROJ.localFs.flush_user_files()
         RPYC_SERVER.close()
         del PROJ.manager
 
@@ -33,17 +33,27 @@ import re
 import sys
 import pwd
 import grp
+import stat
 import time
 import shutil
 import subprocess
+import zlib
+import ast
+import pkgutil
 import tarfile
 import cStringIO
+import threading
 import multiprocessing
 
 
 import rpyc
 from rpyc.utils.server import ThreadedServer
 
+# The `common` package needs the Central Engine logging, so the
+# common modules used by the User Service are imported directly
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + '/common')
+from filehash import file_hashes
+
 TYPE = sys.argv[2:3]
 
 if TYPE == ['ClearCase']:
@@ -76,20 +86,207 @@ def logError(msg):
     """ error """
     log_msg("ERROR", msg)
 
+# Max size of one chunk, for the chunked reads
+MAX_CHUNK = 4*1024*1024
+
 PATTERN = re.compile('from[\s]+([\w]+).*?[\s]+import|[\s]*import[\s]+([\w]+)[\s]*\n')
 
+# Detected imports for each test file: path -> ((mtime, size), imports)
+IMPORTS_CACHE = {}
+IMPORTS_LOCK = threading.Lock()
+# Long lived pool of workers, created the first time it's needed
+DETECT_POOL = None
+# Below this many files to parse, the files are parsed without the pool
+DETECT_POOL_MIN = 64
+# The modules available on this system, found only once
+AVAIL_MODULES = None
+
+
+def parse_imports(fpath):
+    """
+    Returns the top level modules imported by one test file.
+    The file is parsed with AST; if it's not valid Python, the regular expression is used.
+    """
+    with open(fpath, 'r') as f_p:
+        data = f_p.read()
+    try:
+        tree = ast.parse(data, fpath)
+    except Exception:
+        return sorted(set([i[0] or i[1] for i in PATTERN.findall(data)]))
+    imports = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            imports.update([n.name.split('.')[0] for n in node.names])
+        # Relative imports are local to the tests
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            imports.add(node.module.split('.')[0])
+    return sorted(imports)
+
+
 def worker(files):
     """
-    A worker that parses a batch of tests. Returns all the import statements found.
+    A worker that parses a batch of tests. Returns the imports found for each file.
     """
-    missing = set([])
+    result = []
     for l_file in files:
-        f_p = open(l_file, 'r')
-        data = f_p.read()
-        f_p.close()
-        imports = PATTERN.findall(data)
-        missing.update([i[0] or i[1] for i in imports])
-    return sorted(missing)
+        try:
+            result.append((l_file, parse_imports(l_file)))
+        except Exception:
+            result.append((l_file, []))
+    return result
+
+
+def available_modules():
+    """
+    The names of all the modules that can be imported on this system.
+    The modules are found without importing them, only once.
+    """
+    global AVAIL_MODULES
+    if AVAIL_MODULES is None:
+        modules = set(sys.builtin_module_names)
+        modules.update([m[1] for m in pkgutil.iter_modules()])
+        AVAIL_MODULES = modules
+    return AVAIL_MODULES
+
+
+# The folders are listed again after this many seconds, even if they didn't change
+LIST_CACHE_TTL = 60.0
+# Max number of folders kept in the listing cache
+LIST_CACHE_SIZE = 20000
+
+# Owner names, for the meta info of the listings
+_UID_NAMES = {}
+_GID_NAMES = {}
+# Entries of the listed folders: (path, hidden, accept, reject) -> (mtime, time, folders, files)
+_LIST_CACHE = {}
+_LIST_LOCK = threading.Lock()
+
+
+def _uid_name(uid):
+    """
+    User name for one UID, or the UID if the user is unknown.
+    """
+    if uid not in _UID_NAMES:
+        try:
+            _UID_NAMES[uid] = pwd.getpwuid(uid).pw_name
+        except Exception:
+            _UID_NAMES[uid] = uid
+    return _UID_NAMES[uid]
+
+
+def _gid_name(gid):
+    """
+    Group name for one GID, or the GID if the group is unknown.
+    """
+    if gid not in _GID_NAMES:
+        try:
+            _GID_NAMES[gid] = grp.getgrgid(gid).gr_name
+        except Exception:
+            _GID_NAMES[gid] = gid
+    return _GID_NAMES[gid]
+
+
+def _path_patterns(patterns):
+    """
+    The Accept or Reject patterns, as a tuple, or None if there are no patterns.
+    """
+    if not patterns:
+        return None
+    if isinstance(patterns, basestring):
+        return (patterns,)
+    return tuple(patterns)
+
+
+def _dir_entries(path, hidden, accept, reject):
+    """
+    The sub-folders and the files of one folder, filtered and sorted,
+    as 2 lists of (name, meta info).
+    The entries are listed again only when the folder changes.
+    """
+    try:
+        d_mtime = os.stat(path).st_mtime
+    except Exception as exp_err:
+        logWarning('*WARN* Cannot list folder `{}`: `{}`!'.format(path, exp_err))
+        return [], []
+
+    key = (path, hidden, accept, reject)
+    now = time.time()
+    cached = _LIST_CACHE.get(key)
+    if cached and cached[0] == d_mtime and now - cached[1] < LIST_CACHE_TTL:
+        return cached[2], cached[3]
+
+    try:
+        names = sorted(os.listdir(path), key=str.lower)
+    except Exception as exp_err:
+        logWarning('*WARN* Cannot list folder `{}`: `{}`!'.format(path, exp_err))
+        return [], []
+
+    dlist = [] # Folders list
+    flist = [] # Files list
+
+    for fname in names:
+        # Ignore hidden files
+        if hidden and fname[0] == '.':
+            continue
+        long_path = path + '/' + fname
+        # Only one stat for each entry
+        try:
+            fstat = os.stat(long_path)
+        except Exception:
+            flist.append((fname, ''))
+            continue
+
+        if stat.S_ISDIR(fstat.st_mode):
+            is_folder = True
+        else:
+            is_folder = False
+            if stat.S_ISREG(fstat.st_mode):
+                # If Accept is active and file doesn't match, ignore file
+                if accept and not (long_path.startswith(accept) or long_path.endswith(accept)):
+                    continue
+                # If Reject is active and file matches, ignore the file
+                if reject and (long_path.startswith(reject) or long_path.endswith(reject)):
+                    continue
+
+        meta_info = '{}|{}|{}|{}'.format(_uid_name(fstat.st_uid), _gid_name(fstat.st_gid),
+            fstat.st_size, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(fstat.st_mtime)))
+
+        if is_folder:
+            dlist.append((fname, meta_info))
+        else:
+            flist.append((fname, meta_info))
+
+    with _LIST_LOCK:
+        if len(_LIST_CACHE) >= LIST_CACHE_SIZE:
+            _LIST_CACHE.clear()
+        _LIST_CACHE[key] = (d_mtime, now, dlist, flist)
+
+    return dlist, flist
+
+
+def _list_tree(base_path, path, hidden, recursive, accept, reject):
+    """
+    Create recursive list of folders and files from base path.
+    The format of a node is: {"path": "/..." "data": "name", "folder":true|false, "children": []}
+    The unchanged sub-folders are not listed again; only their mtime is checked.
+    """
+    len_path = len(base_path) + 1
+    folders, files = _dir_entries(path, hidden, accept, reject)
+    dlist = []
+
+    for fname, meta_info in folders:
+        long_path = path + '/' + fname
+        if recursive:
+            children = _list_tree(base_path, long_path, hidden, recursive, accept, reject)
+        else:
+            children = []
+        dlist.append({'path': long_path[len_path:], 'data': fname, 'meta': meta_info,
+            'folder': True, 'children': children})
+
+    # Folders first, files second
+    return dlist + [{'path': (path + '/' + fname)[len_path:], 'data': fname, 'meta': meta_info}
+        for fname, meta_info in files]
+
 
 if sys.version < '2.7':
     logError('Python version error! User Service must run on Python 2.7++ !')
@@ -163,9 +360,9 @@ class UserService(rpyc.Service):
 
 
     @staticmethod
-    def exposed_read_file(fpath, flag='r', fstart=0):
+    def exposed_read_file(fpath, flag='r', fstart=0, flen=0):
         """
-        Read 1 file.
+        Read 1 file, or `flen` bytes from position `fstart`.
         Less spam, please.
         """
         global last_msg
@@ -187,7 +384,10 @@ class UserService(rpyc.Service):
                     last_msg = msg
                 if fstart:
                     f_p.seek(fstart)
-                fdata = f_p.read()
+                if flen:
+                    fdata = f_p.read(flen)
+                else:
+                    fdata = f_p.read()
                 if len(fdata) > 20*1000*1000:
                     err = '*ERROR* File data too long `{}`: {}!'.format(fpath, len(fdata))
                     logWarning(err)
@@ -199,6 +399,33 @@ class UserService(rpyc.Service):
             return err
 
 
+    @staticmethod
+    def exposed_read_chunk(fpath, fstart=0, flen=MAX_CHUNK, compress=False):
+        """
+        Read a chunk of max `flen` bytes from position `fstart`, in binary mode.
+        If `compress` is True, the chunk is compressed with zlib.
+        An empty chunk means the end of the file.
+        """
+        if fpath[0] == '~':
+            fpath = USER_HOME + fpath[1:]
+        if not os.path.isfile(fpath):
+            err = '*ERROR* No such file `{}`!'.format(fpath)
+            logWarning(err)
+            return err
+        try:
+            with open(fpath, 'rb') as f_p:
+                if fstart:
+                    f_p.seek(fstart)
+                fdata = f_p.read(min(flen, MAX_CHUNK) if flen else MAX_CHUNK)
+            if compress:
+                return zlib.compress(fdata)
+            return fdata
+        except Exception as exp_err:
+            err = '*ERROR* Cannot read file `{}`! {}'.format(fpath, exp_err)
+            logWarning(err)
+            return err
+
+
     @staticmethod
     def exposed_write_file(fpath, fdata, flag='a'):
         """
@@ -321,108 +548,12 @@ class UserService(rpyc.Service):
             logWarning(err)
             return err
 
-        def dirList(path):
-            """
-            Create recursive list of folders and files from base path.
-            The format of a node is: {"path": "/..." "data": "name", "folder":true|false, "children": []}
-            """
-            # The node is valid ?
-            if not path:
-                return False
-            # Cleanup '/'
-            if path != '/':
-                path = path.rstrip('/')
-            # This is folder ?
-            if os.path.isfile(path):
-                return False
-
-            len_path = len(base_path) + 1
-            dlist = [] # Folders list
-            flist = [] # Files list
-
-            try:
-                names = sorted(os.listdir(path), key=str.lower)
-            except Exception as exp_err:
-                logWarning('*WARN* Cannot list folder `{}`: `{}`!'.format(path, exp_err))
-                return []
-
-            # Cycle a folder
-            for fname in names:
-                long_path = path + '/' + fname
-
-                # If Accept is active and file doesn't match, ignore file
-                if accept and os.path.isfile(long_path):
-                    valid = True
-                    if isinstance(accept, list):
-                        # If nothing from the Accept matches the file
-                        if True not in [(long_path.startswith(f) or long_path.endswith(f)) for f in accept]:
-                            valid = False
-                    elif isinstance(accept, str):
-                        if not (long_path.startswith(accept) or long_path.endswith(accept)):
-                            valid = False
-                    if not valid:
-                        continue
-
-                # If Reject is active and file matches, ignore the file
-                if reject and os.path.isfile(long_path):
-                    valid = True
-                    if isinstance(reject, list):
-                        # If nothing from the Reject matches the file
-                        if True in [(long_path.startswith(f) or long_path.endswith(f)) for f in reject]:
-                            valid = False
-                    elif isinstance(reject, str):
-                        if long_path.startswith(reject) or long_path.endswith(reject):
-                            valid = False
-                    if not valid:
-                        continue
-
-                # Ignore hidden files
-                if hidden and fname[0] == '.':
-                    continue
-                # Meta info
-                try:
-                    fstat = os.stat(long_path)
-                    try:
-                        uname = pwd.getpwuid(fstat.st_uid).pw_name
-                    except Exception:
-                        uname = fstat.st_uid
-                    try:
-                        gname = grp.getgrgid(fstat.st_gid).gr_name
-                    except Exception:
-                        gname = fstat.st_gid
-                    meta_info = '{}|{}|{}|{}'.format(uname, gname,\
-                    fstat.st_size, time.strftime('%Y-%m-%d %H:%M:%S',\
-                    time.localtime(fstat.st_mtime)))
-                except Exception:
-                    meta_info = ''
-
-                # Semi long path
-                short_path = long_path[len_path:]
-                # Data to append
-                c_nd = {'path': short_path, 'data': fname, 'meta': meta_info}
-
-                if os.path.isdir(long_path):
-                    c_nd['folder'] = True
-                    # Recursive !
-                    if recursive:
-                        children = dirList(long_path)
-                    else:
-                        children = []
-                    if children in [False, None]:
-                        continue
-                    c_nd['children'] = children
-                    dlist.append(c_nd)
-                else:
-                    flist.append(c_nd)
-
-            # Folders first, files second
-            return dlist + flist
-
         paths = {
             'path' : '/',
             'data' : base_path,
             'folder' : True,
-            'children' : dirList(base_path) or []
+            'children' : _list_tree(base_path, base_path, hidden, recursive,
+                _path_patterns(accept), _path_patterns(reject))
         }
 
         clen = len(paths['children'])
@@ -473,46 +604,80 @@ class UserService(rpyc.Service):
         return io_s.getvalue()
 
 
+    @staticmethod
+    def exposed_hash_files(fpath, root=''):
+        """
+        The SHA1 of one file, or of all the files from a folder.
+        Returns a tuple of (path relative to `root`, sha1, size).
+        """
+        if fpath[0] == '~':
+            fpath = USER_HOME + fpath[1:]
+        if root and root[0] == '~':
+            root = USER_HOME + root[1:]
+        if not os.path.exists(fpath):
+            err = '*ERROR* Invalid path `{}`!'.format(fpath)
+            logWarning(err)
+            return err
+        try:
+            return file_hashes(fpath, root or os.path.dirname(fpath))
+        except Exception as exp_err:
+            err = '*ERROR* Cannot hash `{}`! {}'.format(fpath, exp_err)
+            logWarning(err)
+            return err
+
+
     @staticmethod
     def exposed_detect_libraries(files):
         """
         Autodetect libraries: parses all the tests and finds the import statements.
         Returns a list of the modules not available by default in python path.
         """
-        numthreads = 4*multiprocessing.cpu_count()
-        num_files = len(files)/numthreads
-
-        # create the process pool
-        pool = multiprocessing.Pool(processes=numthreads)
-        #start = time.time()
-        result_list = pool.map(worker, (files[i*num_files:((i+1)*num_files \
-        if i != numthreads-1 else len(files))] for i in range(0, numthreads)))
-        #print 'Total time: {}'.format(time.time() - start)
+        global DETECT_POOL
+        result = set()
+        stale = []
 
-        result = []
+        # Only the new and the changed files are parsed
+        with IMPORTS_LOCK:
+            for l_file in files:
+                try:
+                    f_st = os.stat(l_file)
+                except Exception:
+                    continue
+                f_key = (f_st.st_mtime, f_st.st_size)
+                cached = IMPORTS_CACHE.get(l_file)
+                if cached and cached[0] == f_key:
+                    result.update(cached[1])
+                else:
+                    stale.append((l_file, f_key))
 
-        for res_l in result_list:
-            result += res_l
+        if stale:
+            paths = [f[0] for f in stale]
+            if len(paths) < DETECT_POOL_MIN:
+                parsed = worker(paths)
+            else:
+                with IMPORTS_LOCK:
+                    if DETECT_POOL is None:
+                        DETECT_POOL = multiprocessing.Pool(processes=multiprocessing.cpu_count())
+                    pool = DETECT_POOL
+                num_files = len(paths) / (4 * multiprocessing.cpu_count()) + 1
+                parsed = []
+                for res_l in pool.map(worker, [paths[i:i + num_files] for i in range(0, len(paths), num_files)]):
+                    parsed.extend(res_l)
 
-        old_stdout = sys.stdout
-        new_stdout = cStringIO.StringIO()
-        new_stdout.flush()
-        sys.stdout = new_stdout
-        help('modules')
-        sys.stdout = old_stdout
-        modules = new_stdout.getvalue().split('\n')[3:-5]
-        avail_modules = []
-        modules = map((lambda m:\
-        avail_modules.extend(re.sub('[\s]+', ' ', m).split(' '))), modules)
+            with IMPORTS_LOCK:
+                for (l_file, f_key), (_, imports) in zip(stale, parsed):
+                    IMPORTS_CACHE[l_file] = (f_key, imports)
+                    result.update(imports)
 
-        result_list = sorted(set(result) - set(avail_modules))
-        return result_list
+        return sorted(result - available_modules())
 
 
     @staticmethod
     def exposed_exit():
         """ Must Exit """
         logWarning('User Service: *sigh* received EXIT signal...')
+        if DETECT_POOL:
+            DETECT_POOL.terminate()
         th_s.close()
         # Reply to client.
         return True
@@ -527,6 +692,9 @@ if __name__ == '__main__':
         logError('User Service: Must start with parameter PORT number!')
         exit(1)
 
+    # Port 0 means any free port, only on localhost. The port is sent to the CE on STDOUT.
+    PORT = int(PORT[0])
+
     CONFIG = {
         'allow_pickle': True,
         'allow_getattr': True,
@@ -554,7 +722,13 @@ if __name__ == '__main__':
 
     USER_HOME = subprocess.check_output('echo ~' + USER_NAME, shell=True).strip().rstrip('/')
 
-    th_s = ThreadedServer(UserService, port=int(PORT[0]), protocol_config=CONFIG, listener_timeout=1)
+    if PORT:
+        th_s = ThreadedServer(UserService, port=PORT, protocol_config=CONFIG, listener_timeout=1)
+    else:
+        th_s = ThreadedServer(UserService, hostname='127.0.0.1', port=0, protocol_config=CONFIG, listener_timeout=1)
+        print 'PORT:{}'.format(th_s.port)
+        sys.stdout.flush()
+    logInfo('User Service: Listening on port `{}`.'.format(th_s.port))
     th_s.start()
 
     logInfo('User Service: Bye bye.')